@@ -4,8 +4,7 @@
 import sys
 import json
 
-from vasl_templates.webapp.scenarios import _match_roar_scenario, \
-    _asa_scenarios, _build_asa_scenario_index, _roar_scenarios, _build_roar_scenario_index
+from vasl_templates.webapp.scenarios import _match_roar_scenarios, _asa_scenarios, _roar_scenarios
 
 # ---------------------------------------------------------------------
 
@@ -27,18 +26,14 @@ def roar_string( s ):
 fname = sys.argv[1]
 with open( fname, "r", encoding="utf-8" ) as fp:
     asa_data = json.load( fp )
-_build_asa_scenario_index( _asa_scenarios, asa_data, None )
+_asa_scenarios._set_data( fname ) #pylint: disable=protected-access
 
 # load the ROAR scenarios
-fname = sys.argv[2]
-with open( fname, "r", encoding="utf-8" ) as fp:
-    roar_data = json.load( fp )
-_build_roar_scenario_index( _roar_scenarios, roar_data, None )
+_roar_scenarios._set_data( sys.argv[2] ) #pylint: disable=protected-access
 
 # try to connect each ASA scenario to ROAR
 exact_matches, multiple_matches, unmatched = [], [], []
-for scenario in asa_data["scenarios"]:
-    matches = _match_roar_scenario( scenario )
+for scenario, matches in zip( asa_data["scenarios"], _match_roar_scenarios( asa_data["scenarios"] ) ):
     if not matches:
         unmatched.append( scenario )
     elif len(matches) == 1:
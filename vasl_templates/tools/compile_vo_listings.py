@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+""" Compile the vehicle/ordnance listings for a VASL module and its extensions. """
+
+import logging
+
+import click
+
+from vasl_templates.webapp import app, globvars
+from vasl_templates.webapp.snippets import load_default_template_pack
+from vasl_templates.webapp.vasl_mod import set_vasl_mod
+from vasl_templates.webapp.vo import compile_vo_listings, get_compiled_vo_listings_dname
+from vasl_templates.webapp.utils import MsgStore
+
+# ---------------------------------------------------------------------
+
+@click.command()
+@click.option( "--vasl-mod","vmod_fname", help="VASL module (.vmod) to compile the listings for." )
+@click.option( "--vasl-extns-dir", help="VASL extensions directory." )
+@click.option( "--output","-o","output_dname", help="Directory to save the compiled listings in." )
+@click.option( "--verbose","-v", is_flag=True, default=False, help="Verbose output." )
+def main( vmod_fname, vasl_extns_dir, output_dname, verbose ):
+    """Compile the vehicle/ordnance listings for a VASL module and its extensions.
+
+    The webapp will load the compiled listings at startup (if they are in the directory configured
+    by COMPILED_VO_LISTINGS_DIR), instead of generating them from the data files.
+    """
+
+    # initialize
+    logging.basicConfig( level = logging.INFO if verbose else logging.WARNING )
+    msg_store = MsgStore()
+    if vasl_extns_dir:
+        app.config[ "VASL_EXTNS_DIR" ] = vasl_extns_dir
+    # NOTE: We need to decide where to save the compiled listings before we disable loading them.
+    if not output_dname:
+        output_dname = get_compiled_vo_listings_dname()
+    app.config[ "COMPILED_VO_LISTINGS_DIR" ] = "disabled"
+
+    # load the VASL module and extensions
+    load_default_template_pack()
+    set_vasl_mod( vmod_fname, msg_store )
+    for msg in msg_store.get_msgs( "error" ):
+        raise click.ClickException( msg )
+    if globvars.vasl_mod:
+        print( "Loaded VASL {}: {}".format( globvars.vasl_mod.vasl_real_version, vmod_fname ) )
+        for extn in globvars.vasl_mod.get_extns():
+            print( "- {} ({}/{})".format( extn[0], extn[1]["extensionId"], extn[1]["version"] ) )
+
+    # compile the vehicle/ordnance listings
+    fname = compile_vo_listings( globvars.vasl_mod, output_dname )
+    print( "Saved the compiled listings: {}".format( fname ) )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() #pylint: disable=no-value-for-parameter
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" Benchmark how counter image throughput scales with the number of waitress threads. """
+
+import threading
+import urllib.request
+import json
+import time
+import random
+import logging
+
+import click
+import waitress.server
+
+from vasl_templates.webapp import app
+
+# ---------------------------------------------------------------------
+
+@click.command()
+@click.option( "--vasl-mod","vmod_fname", required=True, help="VASL module (.vmod) to serve images from." )
+@click.option( "--vasl-extns-dir", help="VASL extensions directory." )
+@click.option( "--waitress-threads", default="1,2,4,8,16", help="Comma-separated list of waitress thread counts." )
+@click.option( "--client-threads", default=32, help="Number of client threads requesting images." )
+@click.option( "--duration", default=10, help="How long to run each benchmark for (seconds)." )
+@click.option( "--counter-image-cache-size", default=0,
+    help="Counter image cache size (MB). Defaults to 0 (disabled), so that images are read from the VASL module."
+)
+def main( vmod_fname, vasl_extns_dir, waitress_threads, client_threads, duration, counter_image_cache_size ):
+    """Benchmark how counter image throughput scales with the number of waitress threads."""
+
+    # initialize
+    logging.disable( logging.CRITICAL )
+    app.config[ "VASL_MOD" ] = vmod_fname
+    app.config[ "COUNTER_IMAGE_CACHE_SIZE" ] = counter_image_cache_size
+    if vasl_extns_dir:
+        app.config[ "VASL_EXTNS_DIR" ] = vasl_extns_dir
+    app.config[ "DISABLE_DOWNLOADED_FILES" ] = True
+
+    # run the benchmark for each waitress thread count
+    results = []
+    for nthreads in waitress_threads.replace( " ", "" ).split( "," ):
+        nthreads = int( nthreads )
+        print( "Running benchmark: waitress-threads={} ; client-threads={}".format( nthreads, client_threads ) )
+        nrequests, nbytes = run_benchmark( nthreads, client_threads, duration )
+        results.append( ( nthreads, nrequests, nbytes ) )
+
+    # output the results
+    print()
+    print( "=== RESULTS ===" )
+    print()
+    print( "{:>16} | {:>12} | {:>10}".format( "waitress threads", "requests/sec", "MB/sec" ) )
+    print( "{}-+-{}-+-{}".format( "-"*16, "-"*12, "-"*10 ) )
+    for nthreads, nrequests, nbytes in results:
+        print( "{:>16} | {:>12.1f} | {:>10.2f}".format(
+            nthreads, float(nrequests)/duration, float(nbytes)/duration/(1024*1024)
+        ) )
+
+# ---------------------------------------------------------------------
+
+def run_benchmark( nthreads, client_threads, duration ): #pylint: disable=too-many-locals
+    """Run the benchmark for a given number of waitress threads."""
+
+    # start the server
+    # NOTE: We let the OS pick a free port.
+    server = waitress.server.create_server( app, host="127.0.0.1", port=0, threads=nthreads )
+    server_thread = threading.Thread( target=server.run, daemon=True )
+    server_thread.start()
+    base_url = "http://127.0.0.1:{}".format( server.effective_port )
+
+    try:
+
+        # figure out which counter images are available
+        # NOTE: This also triggers initialization of the webapp (the first time only).
+        urls = []
+        for gpid, piece_info in get_json( base_url + "/vasl-piece-info" ).items():
+            for side in ("front","back"):
+                for index in range( 0, piece_info[side+"_images"] ):
+                    urls.append( "{}/counter/{}/{}/{}".format( base_url, gpid, side, index ) )
+        if not urls:
+            raise RuntimeError( "Couldn't find any counter images (is the VASL module configured correctly?)" )
+
+        # start the client threads
+        counts = [ [0,0] for _ in range(client_threads) ] # nb: [ #requests, #bytes ]
+        stop_event = threading.Event()
+        def client_thread( thread_no ): #pylint: disable=missing-docstring
+            rand = random.Random( thread_no )
+            while not stop_event.is_set():
+                with urllib.request.urlopen( rand.choice( urls ) ) as resp:
+                    data = resp.read()
+                counts[ thread_no ][0] += 1
+                counts[ thread_no ][1] += len( data )
+        threads = [
+            threading.Thread( target=client_thread, args=(i,), daemon=True )
+            for i in range( client_threads )
+        ]
+        for thread in threads:
+            thread.start()
+
+        # wait for the benchmark to finish
+        time.sleep( duration )
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    finally:
+        # stop the server
+        server.close()
+        server.task_dispatcher.shutdown()
+
+    return sum( c[0] for c in counts ), sum( c[1] for c in counts )
+
+def get_json( url ):
+    """Get JSON data from the webapp."""
+    with urllib.request.urlopen( url ) as resp:
+        return json.load( resp )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() #pylint: disable=no-value-for-parameter
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" Report how much memory the vehicle/ordnance listings and notes use. """
+
+import sys
+import time
+import tracemalloc
+import logging
+
+import click
+
+from vasl_templates.webapp import app, globvars
+from vasl_templates.webapp.snippets import load_default_template_pack
+from vasl_templates.webapp.vasl_mod import set_vasl_mod
+from vasl_templates.webapp.vo import get_vo_listings
+from vasl_templates.webapp.vo_notes import load_vo_notes
+
+# ---------------------------------------------------------------------
+
+@click.command()
+@click.option( "--vasl-mod","vmod_fname", help="VASL module (.vmod)." )
+@click.option( "--vasl-extns-dir", help="VASL extensions directory." )
+@click.option( "--chapter-h-notes-dir", help="Chapter H vehicle/ordnance notes directory." )
+def main( vmod_fname, vasl_extns_dir, chapter_h_notes_dir ):
+    """Report how much memory the vehicle/ordnance listings and notes use.
+
+    Objects that are shared between nationalities (e.g. the Allied/Axis Minor common vehicles/ordnance,
+    or the British notes used by the Canadians, ANZAC's, etc.) are only counted once in the "actual" size,
+    but once for each place they appear in the "unshared" size (i.e. what the footprint would be if
+    everything were deep-copied).
+    """
+
+    # initialize
+    logging.disable( logging.CRITICAL )
+    if vasl_extns_dir:
+        app.config[ "VASL_EXTNS_DIR" ] = vasl_extns_dir
+    if chapter_h_notes_dir:
+        app.config[ "CHAPTER_H_NOTES_DIR" ] = chapter_h_notes_dir
+    # NOTE: We want to measure the listings as they are generated from the data files.
+    app.config[ "COMPILED_VO_LISTINGS_DIR" ] = "disabled"
+    load_default_template_pack()
+    set_vasl_mod( vmod_fname, None )
+
+    # load the vehicle/ordnance listings and notes
+    results = []
+    def measure( caption, func ): #pylint: disable=missing-docstring
+        tracemalloc.start()
+        start_time = time.time()
+        func()
+        elapsed_time = time.time() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append( [ caption, elapsed_time, peak ] )
+    listings = {}
+    measure( "V/O listings", lambda: listings.update( get_vo_listings( globvars.vasl_mod, None ) ) )
+    measure( "V/O notes", lambda: load_vo_notes( None ) )
+    results[0].extend( [ get_deep_size( listings, set() ), get_deep_size( listings, None ) ] )
+    results[1].extend( [ get_deep_size( globvars.vo_notes, set() ), get_deep_size( globvars.vo_notes, None ) ] )
+
+    # output the results
+    print( "{:<14} | {:>10} | {:>12} | {:>12} | {:>12}".format(
+        "", "load time", "peak alloc", "actual size", "unshared size"
+    ) )
+    print( "{}-+-{}-+-{}-+-{}-+-{}".format( "-"*14, "-"*10, "-"*12, "-"*12, "-"*13 ) )
+    for caption, elapsed_time, peak, actual_size, unshared_size in results:
+        print( "{:<14} | {:>9.3f}s | {:>12} | {:>12} | {:>13}".format(
+            caption, elapsed_time, fmt_size( peak ), fmt_size( actual_size ), fmt_size( unshared_size )
+        ) )
+
+# ---------------------------------------------------------------------
+
+def get_deep_size( obj, seen ):
+    """Get the size of an object, and everything it contains.
+
+    If a set of already-seen object ID's is passed in, shared objects will only be counted once.
+    """
+    if seen is not None:
+        if id( obj ) in seen:
+            return 0
+        seen.add( id( obj ) )
+    size = sys.getsizeof( obj )
+    if isinstance( obj, dict ):
+        size += sum( get_deep_size( k, seen ) + get_deep_size( v, seen ) for k,v in obj.items() )
+    elif isinstance( obj, (list, tuple, set) ):
+        size += sum( get_deep_size( v, seen ) for v in obj )
+    return size
+
+def fmt_size( nbytes ):
+    """Format a size."""
+    return "{:.1f} KB".format( float(nbytes) / 1024 )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() #pylint: disable=no-value-for-parameter
@@ -71,7 +71,29 @@ def _init_webapp():
     from vasl_templates.webapp.snippets import load_default_template_pack
     load_default_template_pack()
 
+    # initialize the counter image cache
+    from vasl_templates.webapp.files import init_counter_image_cache #pylint: disable=cyclic-import
+    init_counter_image_cache()
+
+    # initialize the snippet image cache
+    from vasl_templates.webapp.webdriver import init_snippet_image_cache #pylint: disable=cyclic-import
+    init_snippet_image_cache()
+
+    # initialize the analysis cache
+    from vasl_templates.webapp.vassal import init_analysis_cache #pylint: disable=cyclic-import
+    init_analysis_cache()
+
     # configure the VASL module
+    from vasl_templates.webapp import vasl_mod as webapp_vasl_mod #pylint: disable=cyclic-import
+    dname = app.config.get( "VASL_MOD_CACHE_DIR" )
+    if dname in ( "disable", "disabled" ):
+        webapp_vasl_mod._piece_index_cache_dname = None #pylint: disable=protected-access
+    elif dname:
+        webapp_vasl_mod._piece_index_cache_dname = dname #pylint: disable=protected-access
+    else:
+        webapp_vasl_mod._piece_index_cache_dname = os.path.join( #pylint: disable=protected-access
+            tempfile.gettempdir(), "vasl-templates", "vasl-mod-cache"
+        )
     fname = app.config.get( "VASL_MOD" )
     from vasl_templates.webapp.vasl_mod import set_vasl_mod #pylint: disable=cyclic-import
     set_vasl_mod( fname, startup_msg_store )
@@ -81,11 +103,20 @@ def _init_webapp():
     load_vo_listings( startup_msg_store )
 
     # load the vehicle/ordnance notes
+    from vasl_templates.webapp import vo_notes as webapp_vo_notes #pylint: disable=cyclic-import,reimported
+    dname = app.config.get( "CHAPTER_H_INDEX_CACHE_DIR" )
+    if dname in ( "disable", "disabled" ):
+        webapp_vo_notes._chapter_h_index_cache_dname = None #pylint: disable=protected-access
+    elif dname:
+        webapp_vo_notes._chapter_h_index_cache_dname = dname #pylint: disable=protected-access
+    else:
+        webapp_vo_notes._chapter_h_index_cache_dname = os.path.join( #pylint: disable=protected-access
+            tempfile.gettempdir(), "vasl-templates", "chapter-h-index-cache"
+        )
     from vasl_templates.webapp.vo_notes import load_vo_notes #pylint: disable=cyclic-import
     load_vo_notes( startup_msg_store )
 
     # initialize the vehicle/ordnance notes image cache
-    from vasl_templates.webapp import vo_notes as webapp_vo_notes #pylint: disable=reimported
     dname = app.config.get( "VO_NOTES_IMAGE_CACHE_DIR" )
     if dname in ( "disable", "disabled" ):
         webapp_vo_notes._vo_notes_image_cache_dname = None #pylint: disable=protected-access
@@ -253,6 +284,7 @@ import vasl_templates.webapp.nat_caps #pylint: disable=cyclic-import
 import vasl_templates.webapp.scenarios #pylint: disable=cyclic-import
 import vasl_templates.webapp.downloads #pylint: disable=cyclic-import
 import vasl_templates.webapp.lfa #pylint: disable=cyclic-import
+import vasl_templates.webapp.jobs #pylint: disable=cyclic-import
 
 # install our signal handler (must be done in the main thread)
 signal.signal( signal.SIGINT, _on_sigint )
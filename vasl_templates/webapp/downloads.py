@@ -4,16 +4,23 @@ This module manages downloading files on a schedule e.g. the ASL Scenario Archiv
 """
 
 import os
+import re
+import shutil
 import threading
+import types
+import copy
 import json
 import urllib.request
 import urllib.error
 import gzip
+import random
 import time
 import datetime
 import tempfile
 import logging
 
+from flask import jsonify, abort
+
 from vasl_templates.webapp import app
 from vasl_templates.webapp.utils import parse_int
 
@@ -22,12 +29,17 @@ _logger = logging.getLogger( "downloads" )
 
 _etags = {}
 
+# NOTE: The scheduler sleeps on this event, so it can be woken up when a download finishes,
+# or when someone asks for a file to be refreshed.
+_wakeup = threading.Event()
+_scheduler_lock = threading.Lock()
+
 # ---------------------------------------------------------------------
 
-class DownloadedFile:
+class DownloadedFile: #pylint: disable=too-many-instance-attributes
     """Manage a downloaded file."""
 
-    def __init__( self, key, ttl, fname, url, on_data, extra_args=None ):
+    def __init__( self, key, ttl, fname, url, on_data, snapshot_class=types.SimpleNamespace, on_journal_entry=None ): #pylint: disable=too-many-arguments
 
         # initialize
         self.key = key
@@ -35,22 +47,30 @@ class DownloadedFile:
         self.fname = fname
         self.url = url
         self.on_data = on_data
+        self.on_journal_entry = on_journal_entry
         self.error_msg = None
 
-        # initialize
-        self._lock = threading.Lock()
-        self._data = None
+        # initialize the download status
+        self.last_attempt_time = self.last_success_time = None
+        self.last_duration = self.last_size = None
+        self._failures = 0
+        self._next_check_time = 0
+        self._in_progress = self._force_refresh = False
 
-        # install any extra member variables
-        if extra_args:
-            for k,v in extra_args.items():
-                setattr( self, k, v )
+        # initialize
+        # NOTE: The data is made available as an immutable snapshot (an instance of the snapshot class,
+        # which declares the member variables the owner uses), which readers can grab without any locking.
+        # New data is installed by building a new snapshot, then swapping it in, so the lock is only used
+        # to stop multiple updates from happening at the same time.
+        self._update_lock = threading.Lock()
+        self._snapshot = snapshot_class()
 
         # register this instance
         _registry.add( self )
 
         # check if we have a cached copy of the file
         self.cache_fname = os.path.join( tempfile.gettempdir(), "vasl-templates."+fname )
+        self.journal_fname = self.cache_fname + ".journal"
         if os.path.isfile( self.cache_fname ):
             # yup - load it
             _logger.info( "Using cached %s file: %s", key, self.cache_fname )
@@ -59,118 +79,366 @@ class DownloadedFile:
             # nope - start with an empty data set
             _logger.debug( "No cached %s file: %s", key, self.cache_fname )
 
-    def _set_data( self, data ):
+    def _set_data( self, data, fresh_download=False ):
         """Install a new data set."""
-        with self:
-            try:
-                # install the new data
-                if len(data) < 1024 and os.path.isfile( data ):
-                    with open( data, "r", encoding="utf-8" ) as fp:
-                        data = fp.read()
-                self._data = json.loads( data )
-                # notify the owner
-                if self.on_data:
-                    self.on_data( self, self._data, _logger )
-            except Exception as ex: #pylint: disable=broad-except
-                # NOTE: It would be nice to report this to the user in the UI, but because downloading
-                # happens in a background thread, the web page will probably have already finished rendering,
-                # and without the ability to push notifications, it's too late to tell the user.
-                _logger.error( "Can't install %s data: %s", self.key, ex )
-                self.error_msg = str(ex)
-
-    def __enter__( self ):
-        """Gain access to the underlying data.
-
-        Since the file is downloaded in a background thread, access to the underlying data
-        must be protected by a lock.
+        try:
+            # parse the new data
+            if len(data) < 1024 and os.path.isfile( data ):
+                with open( data, "r", encoding="utf-8" ) as fp:
+                    data = json.load( fp )
+            else:
+                data = json.loads( data )
+            # notify the owner (who will build the new snapshot)
+            # NOTE: If anything goes wrong, the new snapshot doesn't get installed, and we keep the old one.
+            # We also replay the journal while holding the update lock, so that we can't miss any changes
+            # that are being made to it at the same time.
+            def install_data( snapshot ): #pylint: disable=missing-docstring
+                if self.on_journal_entry:
+                    if fresh_download:
+                        self._compact_journal( data.get( "_generatedAt_" ) )
+                    self._replay_journal( data )
+                self.on_data( snapshot, data, _logger )
+            if self.on_data:
+                self.update_snapshot( install_data )
+            self.error_msg = None
+            return True
+        except Exception as ex: #pylint: disable=broad-except
+            # NOTE: It would be nice to report this to the user in the UI, but because downloading
+            # happens in a background thread, the web page will probably have already finished rendering,
+            # and without the ability to push notifications, it's too late to tell the user.
+            _logger.error( "Can't install %s data: %s", self.key, ex )
+            self.error_msg = str(ex)
+            return False
+
+    @property
+    def snapshot( self ):
+        """Get the current data.
+
+        Since the file is downloaded in a background thread, callers should get the snapshot once,
+        and use that, rather than accessing this property repeatedly. The snapshot must not be modified.
+        """
+        return self._snapshot
+
+    def update_snapshot( self, func ):
+        """Make changes to the current data.
+
+        The function is passed a (shallow) copy of the current snapshot, and must replace, not modify,
+        any values it wants to change. The updated snapshot is then installed.
+        """
+        with self._update_lock:
+            snapshot = copy.copy( self._snapshot )
+            func( snapshot )
+            # NOTE: This is an atomic reference swap, so readers will see either the old or new snapshot.
+            self._snapshot = snapshot
+
+    def append_to_journal( self, entry ):
+        """Record a local change to the data.
+
+        Local changes are kept in a journal (next to the cached copy of the file), and are replayed
+        each time the data is installed, until a freshly-downloaded copy of the file includes them.
+        This should be called from within update_snapshot().
         """
-        self._lock.acquire()
-        return self._data
+        # NOTE: Each entry is written as a single line of JSON. If we crash while writing it, we will be left
+        # with a partial line at the end of the file, which will be ignored when the journal is replayed.
+        line = json.dumps( { "time": time.time(), "entry": entry } ) + "\n"
+        try:
+            with open( self.journal_fname, "ab+" ) as fp:
+                # NOTE: If there's a partial line at the end of the file, we start a new one, so that this entry
+                # doesn't get appended to it (and lost).
+                if fp.tell() > 0:
+                    fp.seek( -1, os.SEEK_END )
+                    if fp.read( 1 ) != b"\n":
+                        line = "\n" + line
+                fp.write( line.encode( "utf-8" ) )
+                fp.flush()
+                os.fsync( fp.fileno() )
+        except OSError as ex:
+            _logger.warning( "Can't update the %s journal: %s\n- %s", self.key, self.journal_fname, ex )
+
+    def _read_journal( self ):
+        """Read the journal."""
+        if not os.path.isfile( self.journal_fname ):
+            return []
+        entries = []
+        try:
+            with open( self.journal_fname, "r", encoding="utf-8" ) as fp:
+                for line_no, line in enumerate( fp ):
+                    try:
+                        entries.append( json.loads( line ) )
+                    except ValueError:
+                        _logger.warning( "Ignoring invalid %s journal entry: line %d", self.key, 1+line_no )
+        except OSError as ex:
+            _logger.warning( "Can't read the %s journal: %s\n- %s", self.key, self.journal_fname, ex )
+        return entries
+
+    def _replay_journal( self, data ):
+        """Apply the local changes recorded in the journal to a newly-loaded data set."""
+        entries = self._read_journal()
+        for entry in entries:
+            self.on_journal_entry( data, entry["entry"] )
+        if entries:
+            _logger.debug( "Replayed the %s journal: #entries=%d", self.key, len(entries) )
 
-    def __exit__( self, exc_type, exc_val, exc_tb ):
-        """Relinquish access to the underlying data."""
-        self._lock.release()
+    def _compact_journal( self, generated_at ):
+        """Remove journal entries that are older than a freshly-downloaded copy of the file."""
+        entries = self._read_journal()
+        if not entries:
+            return
+        # NOTE: If we can't tell when the file was generated, we assume it includes all our local changes
+        # (they would have been lost when the file was overwritten by the download, before we had a journal).
+        generated_at = _parse_timestamp( generated_at )
+        entries = [
+            e for e in entries
+            if generated_at is not None and e.get( "time", 0 ) > generated_at
+        ]
+        _logger.debug( "Compacting the %s journal: #entries=%d", self.key, len(entries) )
+        try:
+            if entries:
+                _write_file( self.journal_fname,
+                    "".join( json.dumps( e ) + "\n" for e in entries )
+                )
+            else:
+                os.unlink( self.journal_fname )
+        except OSError as ex:
+            _logger.warning( "Can't compact the %s journal: %s\n- %s", self.key, self.journal_fname, ex )
+
+    def refresh_now( self ):
+        """Download a fresh copy of the file, even if the cached copy hasn't expired."""
+        with _scheduler_lock:
+            self._force_refresh = True
+            self._next_check_time = 0
+        _wakeup.set()
+
+    def get_status( self ):
+        """Get the download status."""
+        with _scheduler_lock:
+            return {
+                "key": self.key,
+                "inProgress": self._in_progress,
+                "lastAttempt": self.last_attempt_time,
+                "lastSuccess": self.last_success_time,
+                "duration": self.last_duration,
+                "size": self.last_size,
+                "error": self.error_msg,
+                "failures": self._failures,
+                "nextCheck": self._next_check_time or None,
+            }
 
     @staticmethod
     def download_files():
-        """Download fresh copies of each file."""
+        """Download fresh copies of each file.
+
+        This runs forever (in a background thread), and starts a check for each file when its timer expires.
+        Each check runs in its own thread, so a slow download won't hold up the others.
+        """
         #pylint: disable=protected-access
 
         # loop forever (until the program exits)
         while True:
 
-            # process each DownloadedFile
+            # NOTE: We clear the event before checking the timers, so that we can't miss a wakeup.
+            _wakeup.clear()
+
+            # start checks for any files whose timer has expired
             # NOTE: The DownloadedFile registry is built once at startup, so we don't need to lock it.
-            for df in _registry:
-
-                # get the download URL
-                url = app.config.get( "{}_DOWNLOAD_URL".format( df.key.upper() ), df.url )
-                if os.path.isfile( url ):
-                    # read the data directly from a file (for debugging porpoises)
-                    _logger.info( "Loading the %s data directly from a file: %s", df.key, url )
-                    df._set_data( url )
-                    continue
-
-                # check if we have a cached copy of the file
-                ttl = parse_int( app.config.get( "{}_DOWNLOAD_CACHE_TTL".format( df.key ), df.ttl ), 24 )
-                if ttl <= 0:
-                    _logger.info( "Download of the %s file has been disabled.", df.key )
-                    continue
-                ttl *= 60*60
-                if os.path.isfile( df.cache_fname ):
-                    # yup - check how long ago it was downloaded
-                    mtime = os.path.getmtime( df.cache_fname )
-                    age = int( time.time() - mtime )
-                    _logger.debug( "Checking the cached %s file: age=%s, ttl=%s (mtime=%s)",
-                        df.key,
-                        datetime.timedelta( seconds=age ),
-                        datetime.timedelta( seconds=ttl ),
-                        time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime(mtime) )
-                    )
-                    if age < ttl:
+            with _scheduler_lock:
+                now = time.time()
+                for df in _registry:
+                    if df._in_progress or df._next_check_time > now:
                         continue
+                    df._in_progress = True
+                    threading.Thread( daemon=True,
+                        name = "download-" + df.key.lower(),
+                        target = df._check_for_update
+                    ).start()
+                next_check_time = min(
+                    ( df._next_check_time for df in _registry if not df._in_progress ),
+                    default = None
+                )
 
-                # download the file
-                if app.config.get( "DISABLE_DOWNLOADED_FILES" ):
-                    _logger.info( "Download disabled (%s): %s", df.key, url )
-                    continue
-                _logger.info( "Downloading the %s file: %s", df.key, url )
-                try:
-                    headers = { "Accept-Encoding": "gzip" }
-                    if url in _etags:
-                        _logger.debug( "- If-None-Match = %s", _etags[url] )
-                        headers[ "If-None-Match" ] = _etags[ url ]
-                    req = urllib.request.Request( url, headers=headers )
-                    with urllib.request.urlopen( req ) as resp:
-                        resp_data = resp.read()
-                        if resp.headers.get( "Content-Encoding" ) == "gzip":
-                            resp_data = gzip.decompress( resp_data )
-                        data = resp_data.decode( "utf-8" )
-                        etag = resp.headers.get( "ETag" )
-                    _logger.info( "Downloaded the %s file OK: %d bytes", df.key, len(data) )
-                    if etag:
-                        _logger.debug( "- Got etag: %s", etag )
-                        _etags[ url ] = etag
-                except Exception as ex: #pylint: disable=broad-except
-                    if isinstance( ex, urllib.error.HTTPError ) and ex.code == 304: #pylint: disable=no-member
-                        _logger.info( "Download %s file: 304 Not Modified", df.key )
-                        if os.path.isfile( df.cache_fname ):
-                            # NOTE: We touch the file so that the TTL check will work the next time around.
-                            os.utime( df.cache_fname )
-                        continue
-                    msg = str( getattr(ex,"reason",None) or ex )
-                    _logger.error( "Can't download the %s file: %s", df.key, msg )
-                    df.error_msg = msg
-                    continue
-
-                # install the new data
-                df._set_data( data )
-
-                # save a cached copy of the data
-                _logger.debug( "Saving a cached copy of the %s file: %s", df.key, df.cache_fname )
-                with open( df.cache_fname, "w", encoding="utf-8" ) as fp:
-                    fp.write( data )
-
-            # sleep before looping back and doing it all again
-            delay = parse_int( app.config.get( "DOWNLOAD_CHECK_INTERVAL" ), 2 )
-            time.sleep( delay * 60*60 )
+            # sleep until the next timer expires (or we get woken up)
+            _wakeup.wait( None if next_check_time is None else max( next_check_time - time.time(), 0 ) )
+
+    def _check_for_update( self ):
+        """Check if a fresh copy of the file needs to be downloaded."""
+        try:
+            delay = self._do_check_for_update()
+        except Exception as ex: #pylint: disable=broad-except
+            # NOTE: We should never get here, but we make sure we always reschedule the next check.
+            _logger.error( "Unexpected error checking the %s file: %s", self.key, ex )
+            delay = self._get_retry_delay()
+        with _scheduler_lock:
+            self._next_check_time = time.time() + delay
+            self._in_progress = False
+        _wakeup.set()
+
+    def _do_check_for_update( self ):
+        """Check if a fresh copy of the file needs to be downloaded.
+
+        Returns the number of seconds until the file should be checked again.
+        """
+
+        # initialize
+        with _scheduler_lock:
+            force_refresh = self._force_refresh
+            self._force_refresh = False
+        check_interval = parse_int( app.config.get( "DOWNLOAD_CHECK_INTERVAL" ), 2 ) * 60*60
+
+        # get the download URL
+        url = app.config.get( "{}_DOWNLOAD_URL".format( self.key.upper() ), self.url )
+        if os.path.isfile( url ):
+            # read the data directly from a file (for debugging porpoises)
+            _logger.info( "Loading the %s data directly from a file: %s", self.key, url )
+            self._set_data( url )
+            return check_interval
+
+        # check if we have a cached copy of the file
+        ttl = parse_int( app.config.get( "{}_DOWNLOAD_CACHE_TTL".format( self.key ), self.ttl ), 24 )
+        if ttl <= 0:
+            _logger.info( "Download of the %s file has been disabled.", self.key )
+            return check_interval
+        ttl *= 60*60
+        if os.path.isfile( self.cache_fname ) and not force_refresh:
+            # yup - check how long ago it was downloaded
+            mtime = os.path.getmtime( self.cache_fname )
+            age = int( time.time() - mtime )
+            _logger.debug( "Checking the cached %s file: age=%s, ttl=%s (mtime=%s)",
+                self.key,
+                datetime.timedelta( seconds=age ),
+                datetime.timedelta( seconds=ttl ),
+                time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime(mtime) )
+            )
+            if age < ttl:
+                # NOTE: We check again when the cached file expires.
+                return min( ttl - age, check_interval )
+
+        # download the file
+        if app.config.get( "DISABLE_DOWNLOADED_FILES" ):
+            _logger.info( "Download disabled (%s): %s", self.key, url )
+            return check_interval
+        _logger.info( "Downloading the %s file: %s", self.key, url )
+        start_time = time.time()
+        with _scheduler_lock:
+            self.last_attempt_time = start_time
+        try:
+            self._download( url )
+        except Exception as ex: #pylint: disable=broad-except
+            if isinstance( ex, urllib.error.HTTPError ) and ex.code == 304: #pylint: disable=no-member
+                _logger.info( "Download %s file: 304 Not Modified", self.key )
+                if os.path.isfile( self.cache_fname ):
+                    # NOTE: We touch the file so that the TTL check will work the next time around.
+                    os.utime( self.cache_fname )
+            else:
+                msg = str( getattr(ex,"reason",None) or ex )
+                _logger.error( "Can't download the %s file: %s", self.key, msg )
+                with _scheduler_lock:
+                    self.error_msg = msg
+                    self.last_duration = time.time() - start_time
+                    self._failures += 1
+                    # NOTE: If we were asked to refresh the file, we keep trying until we succeed.
+                    self._force_refresh = self._force_refresh or force_refresh
+                # NOTE: We retry (with backoff), rather than waiting for the file to expire.
+                return self._get_retry_delay()
+        with _scheduler_lock:
+            self.last_success_time = time.time()
+            self.last_duration = self.last_success_time - start_time
+            self._failures = 0
+        return min( ttl, check_interval )
+
+    def _download( self, url ):
+        """Download a fresh copy of the file, and install it."""
+
+        # initialize
+        headers = { "Accept-Encoding": "gzip" }
+        if url in _etags:
+            _logger.debug( "- If-None-Match = %s", _etags[url] )
+            headers[ "If-None-Match" ] = _etags[ url ]
+        req = urllib.request.Request( url, headers=headers )
+        timeout = parse_int( app.config.get( "DOWNLOAD_TIMEOUT" ), 60 )
+
+        # download the file
+        # NOTE: We stream the response to a temp file (decompressing it on the fly, if necessary),
+        # rather than holding it all in memory.
+        temp_fname = "{}.{}.download".format( self.cache_fname, os.getpid() )
+        try:
+            with urllib.request.urlopen( req, timeout=timeout ) as resp:
+                if resp.headers.get( "Content-Encoding" ) == "gzip":
+                    resp_data = gzip.GzipFile( fileobj=resp )
+                else:
+                    resp_data = resp
+                with open( temp_fname, "wb" ) as fp:
+                    shutil.copyfileobj( resp_data, fp, 64*1024 )
+                    nbytes = fp.tell()
+                etag = resp.headers.get( "ETag" )
+            _logger.info( "Downloaded the %s file OK: %d bytes", self.key, nbytes )
+            with _scheduler_lock:
+                self.last_size = nbytes
+
+            # install the new data
+            if not self._set_data( temp_fname, fresh_download=True ):
+                raise RuntimeError( self.error_msg )
+            if etag:
+                _logger.debug( "- Got etag: %s", etag )
+                _etags[ url ] = etag
+
+            # save a cached copy of the data
+            # NOTE: We only do this once we know the data is good, and since we've already written it
+            # to a temp file, we can just rename it into place.
+            _logger.debug( "Saving a cached copy of the %s file: %s", self.key, self.cache_fname )
+            try:
+                os.replace( temp_fname, self.cache_fname )
+            except OSError as ex:
+                _logger.warning( "Can't save the cached %s file: %s\n- %s", self.key, self.cache_fname, ex )
+        finally:
+            if os.path.isfile( temp_fname ):
+                os.unlink( temp_fname )
+
+    def _get_retry_delay( self ):
+        """Get how long to wait before retrying a failed download."""
+        retry_delay = parse_int( app.config.get( "DOWNLOAD_RETRY_DELAY" ), 60 )
+        max_retry_delay = parse_int( app.config.get( "DOWNLOAD_MAX_RETRY_DELAY" ), 60*60 )
+        delay = min( retry_delay * 2 ** min( max( self._failures-1, 0 ), 16 ), max_retry_delay )
+        # NOTE: We add some jitter, so that retries don't all happen at the same time.
+        return random.uniform( delay/2, delay )
+
+# ---------------------------------------------------------------------
+
+@app.route( "/downloads" )
+def get_download_status():
+    """Get the status of each downloaded file."""
+    return jsonify( sorted(
+        ( df.get_status() for df in _registry ),
+        key = lambda s: s["key"]
+    ) )
+
+@app.route( "/downloads/refresh/<key>", methods=["POST"] )
+def refresh_download( key ):
+    """Download a fresh copy of a file."""
+    for df in _registry:
+        if df.key.lower() == key.lower():
+            df.refresh_now()
+            return jsonify( df.get_status() )
+    abort( 404 )
+    return None # stop pylint from complaining :-/
+
+# ---------------------------------------------------------------------
+
+def _write_file( fname, data ):
+    """Write a file."""
+    # NOTE: We write to a temp file, then rename it into place, so that a concurrent (or crashed)
+    # instance of the program will never see a partially-written file.
+    temp_fname = "{}.{}.tmp".format( fname, os.getpid() )
+    with open( temp_fname, "w", encoding="utf-8" ) as fp:
+        fp.write( data )
+    os.replace( temp_fname, fname )
+
+def _parse_timestamp( val ):
+    """Parse a timestamp (as it appears in a downloaded file)."""
+    if not val:
+        return None
+    # FUDGE! Adjust the timezone offset from "HH:MM" to "HHMM".
+    val = re.sub( r"(\d{2}):(\d{2})$", r"\1\2", val )
+    try:
+        return datetime.datetime.strptime( val, "%Y-%m-%d %H:%M:%S %z" ).timestamp()
+    except ValueError:
+        return None
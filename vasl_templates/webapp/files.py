@@ -2,15 +2,28 @@
 
 import os
 import io
+import shutil
+import tempfile
+import uuid
+import time
 import urllib.request
 import urllib.parse
 import mimetypes
+import threading
 import logging
 
-from flask import send_file, send_from_directory, jsonify, redirect, url_for, abort, render_template
+from flask import request, make_response, send_file, send_from_directory, jsonify, redirect, url_for, abort, \
+    render_template
 
 from vasl_templates.webapp import app, globvars
-from vasl_templates.webapp.utils import resize_image_response, is_empty_file
+from vasl_templates.webapp.utils import LruCache, resize_image_response, is_empty_file, parse_int
+
+_counter_image_cache = None
+
+_temp_downloads = {}
+_temp_downloads_lock = threading.Lock()
+_temp_downloads_cleanup_registered = False
+DEFAULT_TEMP_DOWNLOADS_TTL = 15 * 60
 
 # ---------------------------------------------------------------------
 
@@ -72,6 +85,57 @@ def get_user_file( path ):
 
 # ---------------------------------------------------------------------
 
+def add_temp_download( download_fname, fname=None, data=None, mimetype="application/octet-stream" ):
+    """Make a generated file available for download, and return its URL.
+
+    The file content can be passed in either as a file (which will be copied) or as data.
+    Downloads are kept for TEMP_DOWNLOADS_TTL seconds, so that they can be retrieved more than once.
+    """
+
+    # save a copy of the file
+    with tempfile.NamedTemporaryFile( delete=False ) as fp:
+        if data is not None:
+            fp.write( data )
+        else:
+            with open( fname, "rb" ) as fp2:
+                shutil.copyfileobj( fp2, fp )
+
+    # register the download
+    global _temp_downloads_cleanup_registered
+    token = uuid.uuid4().hex
+    with _temp_downloads_lock:
+        _purge_temp_downloads()
+        if not _temp_downloads_cleanup_registered:
+            globvars.cleanup_handlers.append( lambda: _purge_temp_downloads( 0 ) )
+            _temp_downloads_cleanup_registered = True
+        _temp_downloads[ token ] = ( fp.name, download_fname, mimetype, time.time() )
+    return url_for( "get_temp_download", token=token )
+
+@app.route( "/temp-download/<token>" )
+def get_temp_download( token ):
+    """Download a generated file."""
+    with _temp_downloads_lock:
+        _purge_temp_downloads()
+        download = _temp_downloads.get( token )
+    if not download:
+        abort( 404 )
+    return send_file( download[0], mimetype=download[2], as_attachment=True, download_name=download[1] )
+
+def _purge_temp_downloads( ttl=None ):
+    """Remove expired downloads."""
+    if ttl is None:
+        ttl = parse_int( app.config.get( "TEMP_DOWNLOADS_TTL" ), DEFAULT_TEMP_DOWNLOADS_TTL )
+    now = time.time()
+    for token, download in list( _temp_downloads.items() ):
+        if now - download[3] >= ttl:
+            del _temp_downloads[ token ]
+            try:
+                os.unlink( download[0] )
+            except OSError:
+                pass # nb: it might be in the middle of being downloaded (on Windows)
+
+# ---------------------------------------------------------------------
+
 # FUDGE! We had a weird problem here after upgrading to Flask 1.1.2. We used the "defaults" parameter
 # to set a default value of 0 for the "index" parameter, but if the caller explicitly passed in a value of 0,
 # I think Flask was trying to be clever and returning a HTTP 308 Permanent Redirect to the other path e.g.
@@ -89,15 +153,50 @@ def get_counter_image( gpid, side, index=0 ):
     if not globvars.vasl_mod:
         return redirect( url_for( "static", filename="images/missing-image.png" ), code=302 )
 
-    # return the specified counter image
-    image_path, image_data = globvars.vasl_mod.get_piece_image( gpid, side, int(index) )
-    if not image_data:
+    # locate the specified counter image
+    vasl_mod = globvars.vasl_mod
+    image_path, zip_info = vasl_mod.get_piece_image_info( gpid, side, int(index) )
+    if not zip_info:
         abort( 404 )
+
+    # check if the client already has the image
+    # NOTE: The ETag is derived from the image's CRC and size (as stored in the ZIP file), so it will change
+    # if the image changes (e.g. a different VASL module is configured), and we can check it without
+    # having to read (and decompress) the image.
+    etag = "{:08x}-{}".format( zip_info.CRC, zip_info.file_size )
+    if request.if_none_match.contains( etag ):
+        resp = make_response( "", 304 )
+        resp.set_etag( etag )
+        return resp
+
+    # get the image data
+    cache = _counter_image_cache
+    image_data = cache.get( etag ) if cache else None
+    if image_data is None:
+        image_path, image_data = vasl_mod.get_piece_image( gpid, side, int(index) )
+        if not image_data:
+            abort( 404 )
+        if cache:
+            cache.put( etag, image_data )
+
+    # return the counter image
     return send_file(
         io.BytesIO( image_data ),
-        download_name = os.path.split( image_path )[1] # nb: so Flask can figure out the MIME type
+        download_name = os.path.split( image_path )[1], # nb: so Flask can figure out the MIME type
+        etag = etag,
+        max_age = parse_int( app.config.get( "COUNTER_IMAGE_MAX_AGE" ) )
     )
 
+def init_counter_image_cache():
+    """Initialize the counter image cache."""
+    global _counter_image_cache
+    _counter_image_cache = None
+    # NOTE: The cache size is configured in MB, and can be set to 0 to disable the cache.
+    max_size = parse_int( app.config.get( "COUNTER_IMAGE_CACHE_SIZE" ), 20 ) * 1024*1024
+    if max_size <= 0:
+        return
+    _counter_image_cache = LruCache( "counter-images", max_size )
+
 # ---------------------------------------------------------------------
 
 @app.route( "/vasl-piece-info" )
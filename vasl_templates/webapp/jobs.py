@@ -0,0 +1,202 @@
+""" Run long-running operations as background jobs. """
+
+import uuid
+import threading
+import concurrent.futures
+import time
+import logging
+
+from flask import request, jsonify, abort
+from werkzeug.datastructures import MultiDict
+
+from vasl_templates.webapp import app, globvars
+from vasl_templates.webapp.utils import TempFile, parse_int, save_uploaded_file
+
+# NOTE: Each kind of job runs an existing request handler, and has a limit on how many can run concurrently
+# (so that e.g. several large scenario updates can't tie up all the VASSAL shim processes and webdriver's).
+_JOB_KINDS = {
+    "update-vsav": ( "update_vsav", 1 ),
+    "analyze-vsav": ( "analyze_vsav", 2 ),
+    "analyze-vlogs": ( "analyze_vlogs", 2 ),
+    "prepare-asa-upload": ( "prepare_asa_upload", 1 ),
+}
+
+# NOTE: We keep the results of finished jobs for a while, since the front-end polls for them (and so may not
+# collect them straight away). The front-end doesn't remember its jobs, so if the page is reloaded while a job
+# is running, its result is not picked up, and just gets purged when it expires.
+DEFAULT_JOB_RESULTS_TTL = 15 * 60
+
+_jobs = {}
+_executors = {}
+_jobs_lock = threading.Lock()
+_curr_job = threading.local()
+
+_logger = logging.getLogger( "jobs" )
+
+# ---------------------------------------------------------------------
+
+class Job:
+    """A background job."""
+
+    def __init__( self, kind, payload, uploads=None ):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.uploads = uploads
+        self.status = "queued"
+        self.progress = None
+        self.result = None
+        self.created_time = time.time()
+        self.start_time = self.end_time = None
+
+    def run( self ):
+        """Run the job."""
+
+        # initialize
+        self.status = "running"
+        self.start_time = time.time()
+        _logger.info( "Starting job: %s (%s)", self.job_id, self.kind )
+        _curr_job.job = self
+
+        open_files = []
+        try:
+            # run the request handler for this kind of job
+            if self.uploads is None:
+                ctx = app.test_request_context( method="POST", json=self.payload )
+            else:
+                # NOTE: This was a multipart request, so we pass the form fields and uploaded files through.
+                data = MultiDict( self.payload )
+                for key, temp_file, fname in self.uploads:
+                    open_files.append( open( temp_file.name, "rb" ) ) #pylint: disable=consider-using-with
+                    data.add( key, ( open_files[-1], fname ) )
+                ctx = app.test_request_context( method="POST", data=data, content_type="multipart/form-data" )
+            with ctx:
+                resp = app.make_response( app.view_functions[ _JOB_KINDS[self.kind][0] ]() )
+            self.result = resp.get_json()
+            if resp.status_code != 200 or self.result is None:
+                raise RuntimeError( "Unexpected response: {}".format( resp.status ) )
+            self.status = "completed"
+        except Exception as ex: #pylint: disable=broad-except
+            _logger.error( "Job failed: %s (%s): %s", self.job_id, self.kind, ex )
+            self.result = { "error": str(ex) }
+            self.status = "failed"
+        finally:
+            _curr_job.job = None
+            # NOTE: The payload can be large (e.g. a scenario file), so we don't hang on to it.
+            self.payload = None
+            for fp in open_files:
+                fp.close()
+            for _, temp_file, _ in self.uploads or []:
+                temp_file.close( delete=True )
+            self.uploads = None
+            self.progress = None
+            self.end_time = time.time()
+
+        _logger.info( "Job finished: %s (%s): status=%s ; elapsed=%.3fs",
+            self.job_id, self.kind, self.status, self.end_time - self.start_time
+        )
+
+    def get_status( self, include_result ):
+        """Get the job's status."""
+        status = {
+            "jobId": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+        }
+        if self.progress:
+            status[ "progress" ] = self.progress
+        if self.start_time:
+            status[ "elapsed" ] = ( self.end_time or time.time() ) - self.start_time
+        if include_result and self.result is not None:
+            status[ "result" ] = self.result
+        return status
+
+# ---------------------------------------------------------------------
+
+@app.route( "/jobs/<kind>", methods=["POST"] )
+def submit_job( kind ):
+    """Submit a job."""
+
+    # initialize
+    if kind not in _JOB_KINDS:
+        abort( 404 )
+    if request.mimetype == "multipart/form-data":
+        # NOTE: We stream any uploaded files to disk, and pass them on to the request handler when the job runs.
+        uploads = []
+        try:
+            for key, upload in request.files.items( multi=True ):
+                temp_file = TempFile()
+                temp_file.open()
+                uploads.append( ( key, temp_file, upload.filename ) )
+                save_uploaded_file( temp_file, upload )
+                temp_file.close( delete=False )
+        except:
+            for _, temp_file, _ in uploads:
+                temp_file.close( delete=True )
+            raise
+        job = Job( kind, list( request.form.items( multi=True ) ), uploads )
+    else:
+        job = Job( kind, request.json )
+
+    # queue the job
+    with _jobs_lock:
+        _purge_old_jobs()
+        executor = _executors.get( kind )
+        if not executor:
+            max_workers = parse_int(
+                app.config.get( "JOB_CONCURRENCY_" + kind.upper().replace( "-", "_" ) ),
+                _JOB_KINDS[kind][1]
+            )
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = max( max_workers, 1 ),
+                thread_name_prefix = "job-" + kind
+            )
+            _executors[ kind ] = executor
+            if len( _executors ) == 1:
+                globvars.cleanup_handlers.append( shutdown_jobs )
+        _jobs[ job.job_id ] = job
+        executor.submit( job.run )
+    _logger.debug( "Queued job: %s (%s)", job.job_id, kind )
+
+    return jsonify( job.get_status( False ) )
+
+@app.route( "/jobs/<job_id>" )
+def get_job_status( job_id ):
+    """Get the status of a job (including its result, if it has finished)."""
+    with _jobs_lock:
+        _purge_old_jobs()
+        job = _jobs.get( job_id )
+    if not job:
+        abort( 404 )
+    return jsonify( job.get_status( True ) )
+
+@app.route( "/jobs" )
+def get_jobs():
+    """Get the status of all known jobs."""
+    with _jobs_lock:
+        _purge_old_jobs()
+        jobs = list( _jobs.values() )
+    return jsonify( [ job.get_status( False ) for job in jobs ] )
+
+def set_job_progress( progress ):
+    """Report the progress of the current job."""
+    # NOTE: This is a no-op if the current request is not being run as a job.
+    job = getattr( _curr_job, "job", None )
+    if job:
+        job.progress = progress
+
+def _purge_old_jobs():
+    """Remove finished jobs whose results have expired."""
+    ttl = parse_int( app.config.get( "JOB_RESULTS_TTL" ), DEFAULT_JOB_RESULTS_TTL )
+    now = time.time()
+    for job in list( _jobs.values() ):
+        if job.end_time and now - job.end_time > ttl:
+            del _jobs[ job.job_id ]
+
+def shutdown_jobs():
+    """Shutdown the job executors."""
+    with _jobs_lock:
+        executors = list( _executors.values() )
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown( wait=False, cancel_futures=True )
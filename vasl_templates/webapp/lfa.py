@@ -1,16 +1,19 @@
 """ Webapp handlers. """
 
+import sys
 import os
+import re
 import time
-import base64
 import logging
+import concurrent.futures
 import xml.etree.cElementTree as ET
 
 from flask import request, jsonify
 
 from vasl_templates.webapp import app
-from vasl_templates.webapp.vassal import VassalShim
-from vasl_templates.webapp.utils import SimpleError, TempFile
+from vasl_templates.webapp.vassal import VassalShim, make_analysis_cache_key, get_cached_analysis, save_cached_analysis
+from vasl_templates.webapp.saved_game import analyze_logfile, DEFAULT_LFA_PATTERNS
+from vasl_templates.webapp.utils import SimpleError, TempFile, parse_int, save_uploaded_file
 
 # weights for each possible roll value
 DEFAULT_LFA_DICE_HOTNESS_WEIGHTS = {
@@ -30,8 +33,13 @@ def analyze_vlogs(): #pylint: disable=too-many-locals
     """Analyze VASL log file(s)."""
 
     # parse the request
+    # NOTE: The log files can be uploaded as multipart/form-data (as "vlog_data" files), or base64-encoded
+    # in a JSON list of [ filename, data ].
     start_time = time.time()
-    vlog_data = request.json
+    if request.mimetype == "multipart/form-data":
+        vlog_data = [ ( upload.filename, upload ) for upload in request.files.getlist( "vlog_data" ) ]
+    else:
+        vlog_data = request.json
 
     # initialize
     logger = logging.getLogger( "analyze_vlogs" )
@@ -44,11 +52,10 @@ def analyze_vlogs(): #pylint: disable=too-many-locals
             raise SimpleError( "No log files were submitted." )
         for vlog_no, vlog in enumerate( vlog_data ):
             fname, data = vlog
-            data = base64.b64decode( data )
-            logger.info( "Analyzing VLOG (#bytes=%d): %s", len(data), fname )
             temp_file = TempFile()
             temp_file.open()
-            temp_file.write( data )
+            nbytes = save_uploaded_file( temp_file, data )
+            logger.info( "Analyzing VLOG (#bytes=%d): %s", nbytes, fname )
             temp_file.close( delete=False )
             save_fname = app.config.get( "ANALYZE_VLOG_INPUT" )
             if save_fname:
@@ -58,16 +65,37 @@ def analyze_vlogs(): #pylint: disable=too-many-locals
                     parts = os.path.splitext( save_fname )
                     temp_file.save_copy( "{}-{}".format(parts[0],1+vlog_no) + parts[1], logger, "VLOG data" )
             temp_files.append( temp_file )
+        vlogs = [ tf.name for tf in temp_files ]
 
-        # run the VASSAL shim to analyze the VLOG file(s)
-        with TempFile() as report_file:
-            report_file.close( delete=False )
-            vassal_shim = VassalShim()
-            fnames = [ tf.name for tf in temp_files ]
-            fnames.append( report_file.name )
-            vassal_shim.analyze_logfiles( *fnames )
-            report_file.save_copy( app.config.get("ANALYZE_VLOG_REPORT"), logger, "analysis report" )
-            report = parse_analysis_report( report_file.name, logger )
+        # check if we've already analyzed any of the VLOG file(s)
+        analyzer = app.config.get( "VLOG_ANALYZER", "python" )
+        if analyzer not in ( "python", "java" ):
+            raise SimpleError( "Invalid VLOG analyzer: {}".format( analyzer ) )
+        patterns = _get_lfa_patterns()
+        cache_keys = [
+            make_analysis_cache_key( "vlog", vlog, analyzer, patterns if analyzer == "python" else None )
+            for vlog in vlogs
+        ]
+        log_files = [ get_cached_analysis( cache_key ) for cache_key in cache_keys ]
+        uncached_vlog_nos = [ vlog_no for vlog_no, log_file in enumerate( log_files ) if log_file is None ]
+        if len( uncached_vlog_nos ) < len( vlogs ):
+            logger.debug( "Using cached analyses for %d VLOG file(s).", len(vlogs) - len(uncached_vlog_nos) )
+
+        # analyze the VLOG file(s)
+        # NOTE: We normally parse the log files ourself, which is much faster than starting up VASSAL,
+        # but we fall back to the VASSAL shim for any that we can't handle.
+        if analyzer == "python" and uncached_vlog_nos:
+            results = _analyze_vlogs_python( [ vlogs[vlog_no] for vlog_no in uncached_vlog_nos ], patterns, logger )
+            for vlog_no, log_file in zip( uncached_vlog_nos, results ):
+                log_files[ vlog_no ] = log_file
+        vlog_nos = [ vlog_no for vlog_no, log_file in enumerate( log_files ) if log_file is None ]
+        if vlog_nos:
+            results = _analyze_vlogs_java( [ vlogs[vlog_no] for vlog_no in vlog_nos ], logger )
+            for vlog_no, log_file in zip( vlog_nos, results ):
+                log_files[ vlog_no ] = log_file
+        for vlog_no in uncached_vlog_nos:
+            save_cached_analysis( cache_keys[vlog_no], log_files[vlog_no] )
+        report = make_analysis_report( log_files, logger )
 
     except Exception as ex: #pylint: disable=broad-except
 
@@ -87,74 +115,172 @@ def analyze_vlogs(): #pylint: disable=too-many-locals
     logger.info( "Analyzed the VLOG file(s) OK: elapsed=%.3fs", time.time()-start_time )
     return jsonify( report )
 
+def _get_lfa_patterns():
+    """Get the regex's used to identify events in VASL log files."""
+    patterns = {}
+    for key, default in DEFAULT_LFA_PATTERNS.items():
+        val = app.config.get( "LFA_PATTERN_" + key )
+        # NOTE: We accept patterns written for the VASSAL shim (i.e. with Java-style named groups).
+        patterns[ key ] = re.sub( r"\(\?<(?=[A-Za-z])", "(?P<", val ) if val else default
+    return patterns
+
+def _analyze_vlogs_python( vlogs, patterns, logger ):
+    """Analyze VASL log file(s) in Python.
+
+    Returns the analysis for each log file (or None, if it couldn't be analyzed).
+    """
+
+    # analyze each log file
+    # NOTE: The log files are independent of each other, so we analyze them in parallel. Parsing them
+    # is CPU-bound, so we use separate processes (threads would just take turns holding the GIL),
+    # but multiprocessing needs special support when we're frozen, so we fall back to threads there.
+    nworkers = min( len(vlogs),
+        parse_int( app.config.get( "ANALYZE_VLOG_WORKERS" ), min( os.cpu_count() or 1, 4 ) )
+    )
+    if nworkers <= 1:
+        results = [ _analyze_vlog( vlog, patterns ) for vlog in vlogs ]
+    else:
+        if getattr( sys, "frozen", False ):
+            executor_class = concurrent.futures.ThreadPoolExecutor
+        else:
+            executor_class = concurrent.futures.ProcessPoolExecutor
+        with executor_class( max_workers=nworkers ) as executor:
+            results = list( executor.map( _analyze_vlog, vlogs, [patterns] * len(vlogs) ) )
+
+    # check the results
+    log_files = []
+    for vlog_no, ( log_file, error ) in enumerate( results ):
+        if error:
+            logger.warning( "Couldn't analyze VLOG #%d, falling back to the VASSAL shim: %s", 1+vlog_no, error )
+        log_files.append( log_file )
+    return log_files
+
+def _analyze_vlog( fname, patterns ):
+    """Analyze a VASL log file in Python."""
+    # NOTE: This might run in a worker process, so we return any error as a string, rather than
+    # logging it or raising an exception (which might not be picklable).
+    try:
+        return analyze_logfile( fname, patterns ), None
+    except Exception as ex: #pylint: disable=broad-except
+        return None, str( ex )
+
+def _analyze_vlogs_java( vlogs, logger ):
+    """Analyze VASL log file(s) using the VASSAL shim."""
+    with TempFile() as report_file:
+        report_file.close( delete=False )
+        vassal_shim = VassalShim()
+        vassal_shim.analyze_logfiles( *vlogs, report_file.name )
+        report_file.save_copy( app.config.get("ANALYZE_VLOG_REPORT"), logger, "analysis report" )
+        return load_analysis_report( report_file.name )
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def parse_analysis_report( fname, logger=None ):
     """Parse the analysis report generated by the VASSAL shim."""
+    return make_analysis_report( load_analysis_report( fname ), logger )
 
-    # initialize
+def load_analysis_report( fname ):
+    """Load the analysis report generated by the VASSAL shim.
+
+    Returns the scenario details and events for each log file, in the same format as analyze_logfile().
+    """
     doc = ET.parse( fname )
+    log_files = []
+    for logFileElem in doc.findall( ".//logFile" ):
+
+        # extract the events
+        events = []
+        for elem in logFileElem.find( ".//events" ):
+            if elem.tag == "diceEvent":
+                events.append( {
+                    "type": elem.tag, "player": elem.attrib["player"],
+                    "rollType": elem.attrib["rollType"], "values": elem.text
+                } )
+            elif elem.tag == "turnTrackEvent":
+                events.append( {
+                    "type": elem.tag, "side": elem.attrib["side"],
+                    "turnNo": elem.attrib["turnNo"], "phase": elem.attrib["phase"]
+                } )
+            elif elem.tag == "customLabelEvent":
+                events.append( { "type": elem.tag, "label": elem.text } )
+            else:
+                events.append( { "type": elem.tag } )
+
+        # extract the scenario details
+        scenario = {}
+        elem = logFileElem.find( ".//scenario" )
+        if elem is not None:
+            scenario[ "scenarioName" ] = elem.text
+            if "id" in elem.attrib:
+                scenario[ "scenarioId" ] = elem.attrib["id"]
+
+        log_files.append( {
+            "filename": logFileElem.attrib[ "filename" ],
+            "scenario": scenario,
+            "events": events,
+        } )
+
+    return log_files
+
+def make_analysis_report( log_files, logger=None ):
+    """Generate the analysis report for the log file(s)."""
 
     # get the complete list of players across all the log files
     players = {}
-    for elem in doc.findall( ".//diceEvent" ):
-        player_name = elem.attrib[ "player" ]
-        if player_name not in players:
-            # NOTE: ChartJS (in the frontend Javascript) identifies datasets using a 0-based index,
-            # so to avoid accidentally mixing these up with player ID's, we generate non-numeric player ID's.
-            player_id = "p:{}".format( len(players) + 1 )
-            players[ player_name ] = player_id
+    for log_file in log_files:
+        for evt in log_file["events"]:
+            if evt["type"] != "diceEvent":
+                continue
+            player_name = evt[ "player" ]
+            if player_name not in players:
+                # NOTE: ChartJS (in the frontend Javascript) identifies datasets using a 0-based index,
+                # so to avoid accidentally mixing these up with player ID's, we generate non-numeric player ID's.
+                player_id = "p:{}".format( len(players) + 1 )
+                players[ player_name ] = player_id
 
     # generate the results for each log file
-    log_files = []
-    for logFileElem in doc.findall( ".//logFile" ):
+    results = []
+    for log_file in log_files:
 
         # process the events for the next log file
-        events, scenario = [], {}
-        for elem in logFileElem.find( ".//events" ):
+        events = []
+        for evt in log_file["events"]:
 
-            if elem.tag == "diceEvent":
+            if evt["type"] == "diceEvent":
                 # found a DICE ROLL event
-                player_id = players[ elem.attrib["player"] ]
-                values = [ int(v) for v in elem.text.split(",") ]
+                player_id = players[ evt["player"] ]
+                values = [ int(v) for v in evt["values"].split(",") ]
                 events.append( {
                     "eventType": "roll",
                     "playerId": player_id,
-                    "rollType": elem.attrib[ "rollType" ],
+                    "rollType": evt[ "rollType" ],
                     "rollValue": values[0] if len(values) == 1 else values
                 } )
-            elif elem.tag == "turnTrackEvent":
+            elif evt["type"] == "turnTrackEvent":
                 # found a TURN TRACK event
                 events.append( {
                     "eventType": "turnTrack",
-                    "side": elem.attrib[ "side" ],
-                    "turnNo": elem.attrib[ "turnNo" ],
-                    "phase": elem.attrib[ "phase" ]
+                    "side": evt[ "side" ],
+                    "turnNo": evt[ "turnNo" ],
+                    "phase": evt[ "phase" ]
                 } )
-            elif elem.tag == "customLabelEvent":
+            elif evt["type"] == "customLabelEvent":
                 # found a CUSTOM label
                 events.append( {
                     "eventType": "customLabel",
-                    "caption": elem.text
+                    "caption": evt[ "label" ]
                 } )
             else:
                 if logger:
-                    logger.warn( "Found an unknown analysis event: %s", elem.tag )
-
-        # extract the scenario details
-        elem = logFileElem.find( ".//scenario" )
-        if elem is not None:
-            scenario[ "scenarioName" ] = elem.text
-            if "id" in elem.attrib:
-                scenario[ "scenarioId" ] = elem.attrib["id"]
+                    logger.warn( "Found an unknown analysis event: %s", evt["type"] )
 
-        log_files.append( {
-            "filename": logFileElem.attrib[ "filename" ],
-            "scenario": scenario,
+        results.append( {
+            "filename": log_file.get( "filename" ),
+            "scenario": log_file[ "scenario" ],
             "events": events,
         } )
 
     return {
         "players": { v: k for k,v in players.items() },
-        "logFiles": log_files
+        "logFiles": results
     }
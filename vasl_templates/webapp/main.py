@@ -14,7 +14,8 @@ from flask import request, render_template, jsonify, send_file, redirect, url_fo
 
 from vasl_templates.webapp import app, shutdown_event
 from vasl_templates.webapp.vassal import VassalShim
-from vasl_templates.webapp.utils import MsgStore, get_java_version, parse_int
+from vasl_templates.webapp.webdriver import WebDriver
+from vasl_templates.webapp.utils import MsgStore, LruCache, get_java_version, parse_int
 import vasl_templates.webapp.config.constants
 from vasl_templates.webapp.config.constants import BASE_DIR, DATA_DIR, IS_FROZEN
 from vasl_templates.webapp import globvars
@@ -238,16 +239,15 @@ def get_program_info():
 
     # check the scenario index downloads
     def check_df( df ): #pylint: disable=missing-docstring
-        with df:
-            if not os.path.isfile( df.cache_fname ):
-                return
-            mtime = datetime.utcfromtimestamp( os.path.getmtime( df.cache_fname ) )
-            key = "LAST_{}_SCENARIO_INDEX_DOWNLOAD_TIME".format( df.key )
-            params[ key ] = datetime.strftime(to_localtime(mtime), "%H:%M (%d %b %Y)" )
-            generated_at = parse_timestamp( getattr( df, "generated_at", None ) )
-            if generated_at:
-                key =  "LAST_{}_SCENARIO_INDEX_GENERATED_AT".format( df.key )
-                params[ key ] = datetime.strftime( generated_at, "%H:%M %d %b %Y" )
+        if not os.path.isfile( df.cache_fname ):
+            return
+        mtime = datetime.utcfromtimestamp( os.path.getmtime( df.cache_fname ) )
+        key = "LAST_{}_SCENARIO_INDEX_DOWNLOAD_TIME".format( df.key )
+        params[ key ] = datetime.strftime(to_localtime(mtime), "%H:%M (%d %b %Y)" )
+        generated_at = parse_timestamp( getattr( df.snapshot, "generated_at", None ) )
+        if generated_at:
+            key =  "LAST_{}_SCENARIO_INDEX_GENERATED_AT".format( df.key )
+            params[ key ] = datetime.strftime( generated_at, "%H:%M %d %b %Y" )
     from vasl_templates.webapp.scenarios import _asa_scenarios, _roar_scenarios
     check_df( _asa_scenarios )
     check_df( _roar_scenarios )
@@ -256,6 +256,18 @@ def get_program_info():
 
 # ---------------------------------------------------------------------
 
+@app.route( "/cache-stats" )
+def get_cache_stats():
+    """Get statistics about our in-memory caches."""
+    return jsonify( LruCache.get_all_stats() )
+
+@app.route( "/webdriver-stats" )
+def get_webdriver_stats():
+    """Get statistics about the shared WebDriver pools."""
+    return jsonify( WebDriver.get_pool_stats() )
+
+# ---------------------------------------------------------------------
+
 @app.route( "/help" )
 def show_help():
     """Show the help page."""
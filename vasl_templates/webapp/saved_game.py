@@ -0,0 +1,321 @@
+""" Parse VASSAL saved game files. """
+
+import re
+import zipfile
+
+# NOTE: These are from VASSAL (GameModule, BasicCommandEncoder and ObfuscatingOutputStream).
+_COMMAND_SEPARATOR = "\x1b"
+_OBFUSCATION_HEADER = b"!VCSK"
+
+# NOTE: This must match the VASSAL shim's default LABEL_GPID setting.
+_LABEL_GPID = "6295"
+
+# NOTE: These must match the VASSAL shim's default LFA_PATTERN_xxx settings.
+DEFAULT_LFA_PATTERNS = {
+    "DICE_ROLL": r"^\*\*\* \((?P<rollType>.+?) (?P<drType>DR|dr)\) (?P<values>.+?) \*\*\*\s+\<(?P<player>.+?)\>",
+    "DICE3_ROLL": r"^\*\*\* 3d6 = (?P<d1>\d),(?P<d2>\d),(?P<d3>\d) \*\*\*\s+\<(?P<player>.+?)\>",
+    "TURN_TRACK": r"^\* (?!Phase Wheel)(New: )?(?P<side>.+?) Turn (?P<turn>\d+) - (?P<phase>\S+)",
+    "CUSTOM_LABEL": r"!!vt-label (?P<label>.+)$",
+}
+
+# ---------------------------------------------------------------------
+
+def load_saved_game( fname ):
+    """Load the commands from a VASSAL saved game (.vsav or .vlog file).
+
+    The file can be a filename, or a file-like object.
+    """
+    with zipfile.ZipFile( fname ) as zip_file:
+        data = zip_file.read( "savedGame" )
+    return decode_commands( deobfuscate( data ).decode( "utf-8" ) )
+
+def deobfuscate( data ):
+    """Deobfuscate saved game data."""
+    # NOTE: VASSAL obfuscates the data by XOR'ing each byte with a key, and writing it out as hex digits.
+    if not data.startswith( _OBFUSCATION_HEADER ):
+        return data
+    pos = len( _OBFUSCATION_HEADER )
+    key = int( data[ pos : pos+2 ], 16 )
+    xor_table = bytes( b ^ key for b in range(256) )
+    return bytes.fromhex( data[ pos+2 : ].decode( "ascii" ).strip() ).translate( xor_table )
+
+def decode_commands( val ):
+    """Decode a VASSAL command string into its individual commands.
+
+    This is a generator that yields each command, in the order they appear in the file.
+    """
+    # NOTE: This follows GameModule.decode(), which splits a command into its sub-commands,
+    # and recursively decodes each of them.
+    stack = [ val ]
+    while stack:
+        val = stack.pop()
+        tokens = decode_sequence( val, _COMMAND_SEPARATOR )
+        if len( tokens ) == 1 and tokens[0] == val:
+            yield val
+        else:
+            stack.extend( reversed( tokens ) )
+
+def decode_sequence( val, delim ):
+    """Split a string that was generated by VASSAL's SequenceEncoder."""
+    # NOTE: This follows SequenceEncoder.Decoder i.e. delimiters are escaped by a preceding backslash
+    # (except at the start of a token), and tokens wrapped in single quotes have them removed.
+    tokens = []
+    buf = []
+    pos = 0
+    while True:
+        i = val.find( delim, pos )
+        if i > pos and val[i-1] == "\\":
+            # found an escaped delimiter
+            buf.append( val[ pos : i-1 ] )
+            buf.append( delim )
+            pos = i + 1
+            continue
+        buf.append( val[pos:] if i < 0 else val[pos:i] )
+        token = "".join( buf )
+        if len( token ) > 1 and token.startswith( "'" ) and token.endswith( "'" ):
+            token = token[1:-1]
+        tokens.append( token )
+        if i < 0:
+            return tokens
+        buf = []
+        pos = i + 1
+
+def parse_piece( piece_type, piece_state ):
+    """Parse a game piece's type and state.
+
+    Returns a list of ( type, state ) for each of the piece's decorators, from the outermost
+    to the innermost (which should be the BasicPiece, or e.g. a Stack).
+    """
+    layers = []
+    while True:
+        types = decode_sequence( piece_type, "\t" )
+        states = decode_sequence( piece_state, "\t" )
+        layers.append( ( types[0], states[0] ) )
+        if len( types ) < 2:
+            return layers
+        piece_type = types[1]
+        piece_state = states[1] if len( states ) > 1 else ""
+
+# ---------------------------------------------------------------------
+
+def analyze_scenario( fname ):
+    """Analyze a VASSAL scenario file.
+
+    This generates the same report as the VASSAL shim's "analyze" command i.e. the name of each GPID
+    in the scenario, and how many times it appears.
+    """
+
+    # figure out which pieces are in the scenario
+    pieces = {}
+    for cmd in load_saved_game( fname ):
+        if cmd.startswith( "+/" ):
+            # AddPiece
+            args = decode_sequence( cmd[2:], "/" )
+            if len( args ) >= 2:
+                pieces[ args[0] ] = ( args[1], args[2] if len(args) > 2 else "" )
+        elif cmd.startswith( "-/" ):
+            # RemovePiece
+            pieces.pop( cmd[2:], None )
+        elif cmd.startswith( "D/" ):
+            # ChangePiece
+            args = decode_sequence( cmd[2:], "/" )
+            if len( args ) >= 2 and args[0] in pieces:
+                pieces[ args[0] ] = ( pieces[args[0]][0], args[1] )
+
+    # analyze the pieces
+    report = {}
+    for piece_type, piece_state in pieces.values():
+        layers = parse_piece( piece_type, piece_state )
+        if not layers[-1][0].startswith( "piece;" ):
+            continue # nb: this isn't a normal piece (e.g. it's a Stack)
+        # IMPORTANT: We ignore concealed and HIP pieces (see the comments in the VASSAL shim).
+        if any( _is_obscured( layer ) for layer in layers ):
+            continue
+        # check if this piece has a GPID
+        fields = decode_sequence( layers[-1][1], ";" )
+        gpid = fields[3] if len( fields ) > 3 else ""
+        if gpid in ( "", _LABEL_GPID ):
+            continue
+        # yup - add it to the results
+        # NOTE: The VASSAL shim reports the name of the full (decorated) piece, but we just use
+        # the BasicPiece's name, which is normally the same thing.
+        if gpid not in report:
+            fields = decode_sequence( layers[-1][0], ";" )
+            report[ gpid ] = { "name": fields[4] if len(fields) > 4 else "", "count": 1 }
+        else:
+            report[ gpid ][ "count" ] += 1
+
+    # NOTE: The VASSAL shim returns its report as XML, so the counts are strings.
+    for vals in report.values():
+        vals[ "count" ] = str( vals["count"] )
+    return report
+
+def _is_obscured( layer ):
+    """Check if a piece's decorator is concealing or hiding it."""
+    # NOTE: Obscurable (and VASL's Concealable, which is derived from it) and Hideable all store
+    # the player the piece is hidden from at the start of their state.
+    if not layer[0].startswith( ( "obs;", "conceal;", "hide;" ) ):
+        return False
+    owner = decode_sequence( layer[1], ";" )[0]
+    return owner not in ( "", "null" )
+
+# ---------------------------------------------------------------------
+
+def analyze_logfile( fname, patterns=None ):
+    """Analyze a VASL log file.
+
+    This extracts the same information as the VASSAL shim's "analyzeLogs" command i.e. the scenario details,
+    and the dice rolls, Turn Track changes and custom labels.
+    """
+
+    # initialize
+    if not patterns:
+        patterns = DEFAULT_LFA_PATTERNS
+    patterns = { k: re.compile(v) for k,v in patterns.items() }
+
+    # process each command in the log file
+    events = []
+    labels = {}
+    for cmd in load_saved_game( fname ):
+        if cmd.startswith( "LOG\tCHAT" ):
+            # NOTE: VASSAL doesn't store dice rolls and Turn Track changes as specific events in the log file,
+            # but as plain-text messages in the chat window (logged DisplayText commands).
+            events.extend( _match_log_event( cmd[8:], patterns ) )
+        elif cmd.startswith( "+/" ):
+            _check_for_label( cmd, labels )
+
+    # extract the scenario details
+    # NOTE: The VASSAL shim looks for the scenario name/ID in the raw label content, so we do the same.
+    scenario = {}
+    label = labels.get( "scenario" )
+    if label:
+        mo = re.search( r'<span class="scenario-name">(.*?)</span>', label )
+        if mo:
+            scenario[ "scenarioName" ] = mo.group( 1 ).strip()
+        mo = re.search( r'<span class="scenario-id">(.*?)</span>', label )
+        if mo:
+            scenario_id = mo.group( 1 ).strip()
+            if scenario_id.startswith( "(" ) and scenario_id.endswith( ")" ):
+                scenario_id = scenario_id[1:-1]
+            scenario[ "scenarioId" ] = scenario_id
+
+    return { "scenario": scenario, "events": events }
+
+def _match_log_event( msg, patterns ):
+    """Check if a chat message is an event we're interested in."""
+
+    # check if we've found a DR/dr roll
+    mo = patterns["DICE_ROLL"].search( msg )
+    if mo:
+        return [ {
+            "type": "diceEvent", "player": mo.group("player"),
+            "rollType": mo.groupdict().get( "rollType" ) or "Other", "values": mo.group("values")
+        } ]
+
+    # check if we've found a 3d6 roll
+    mo = patterns["DICE3_ROLL"].search( msg )
+    if mo:
+        # NOTE: We report these as two separate events (DR and dr).
+        return [
+            { "type": "diceEvent", "player": mo.group("player"),
+              "rollType": "3d6 (DR)", "values": mo.group("d1") + "," + mo.group("d2")
+            },
+            { "type": "diceEvent", "player": mo.group("player"),
+              "rollType": "3d6 (dr)", "values": mo.group("d3")
+            }
+        ]
+
+    # check if we've found a Turn Track change
+    mo = patterns["TURN_TRACK"].search( msg )
+    if mo:
+        return [ {
+            "type": "turnTrackEvent", "side": mo.group("side"), "turnNo": mo.group("turn"), "phase": mo.group("phase")
+        } ]
+
+    # check if we've found a custom label
+    mo = patterns["CUSTOM_LABEL"].search( msg )
+    if mo:
+        return [ { "type": "customLabelEvent", "label": mo.group("label") } ]
+
+    return []
+
+def _check_for_label( cmd, labels ):
+    """Check if an AddPiece command is adding one of our labels."""
+    args = decode_sequence( cmd[2:], "/" )
+    if len( args ) < 3:
+        return
+    fields = _get_label_fields( args[1], args[2] )
+    if fields:
+        snippet_id, field_no = _get_label_snippet_id( fields )
+        if snippet_id:
+            labels[ snippet_id ] = fields[ field_no ]
+
+# ---------------------------------------------------------------------
+
+def get_vasl_templates_labels( fname, players ):
+    """Get the labels in a VASSAL scenario file.
+
+    This finds the labels the same way the VASSAL shim's "update" command does, and returns:
+    - the content of each label that we created (keyed by snippet ID)
+    - the 2 label fields for all other labels (these may be legacy labels, created before we started
+      tagging labels with their snippet ID)
+    - whether any of our labels are owned by a player nationality.
+    """
+
+    # locate the labels in the scenario
+    pieces = {}
+    for cmd in load_saved_game( fname ):
+        if cmd.startswith( "+/" ):
+            # AddPiece
+            args = decode_sequence( cmd[2:], "/" )
+            if len( args ) >= 3:
+                pieces[ args[0] ] = ( args[1], args[2] )
+        elif cmd.startswith( "D/" ):
+            # ChangePiece
+            # NOTE: The VASSAL shim looks at the state of each label after the scenario has been loaded.
+            args = decode_sequence( cmd[2:], "/" )
+            if len( args ) >= 2 and args[0] in pieces:
+                pieces[ args[0] ] = ( pieces[args[0]][0], args[1] )
+        # NOTE: The VASSAL shim checks the AddPiece commands, so it will still see a label that was later removed.
+
+    # check each label
+    our_labels, other_labels = {}, []
+    has_player_owned_labels = False
+    for piece_type, piece_state in pieces.values():
+        fields = _get_label_fields( piece_type, piece_state )
+        if not fields:
+            continue
+        snippet_id, field_no = _get_label_snippet_id( fields )
+        if not snippet_id:
+            other_labels.append( tuple( fields[3:5] ) )
+            continue
+        # check if the label is associated with a player nationality
+        # NOTE: See the comments in the VASSAL shim's extractLabels() for why we check for "extras".
+        pos = snippet_id.find( "/" )
+        if pos >= 0:
+            nat = snippet_id[ :pos ]
+            if nat != "extras":
+                has_player_owned_labels = True
+            if players and nat not in players:
+                continue
+        our_labels[ snippet_id ] = fields[ field_no ]
+
+    return our_labels, other_labels, has_player_owned_labels
+
+def _get_label_fields( piece_type, piece_state ):
+    """Split a label's state into its fields."""
+    layers = parse_piece( piece_type, piece_state )
+    fields = decode_sequence( layers[-1][0], ";" )
+    if len( fields ) < 5 or fields[4] != "User-Labeled":
+        return None
+    # NOTE: The VASSAL shim splits the raw (escaped) state, and checks the 2 label fields.
+    return re.split( r"\\+\t", piece_state )
+
+def _get_label_snippet_id( fields ):
+    """Check if a label is one of ours."""
+    for field_no in ( 3, 4 ):
+        if field_no < len( fields ):
+            mo = re.search( r"<!-- vasl-templates:id (.+?) ", fields[field_no] )
+            if mo:
+                return mo.group( 1 ), field_no
+    return None, None
@@ -1,8 +1,5 @@
 """Provide access to the scenarios."""
 
-# NOTE: Disable "DownloadedFile has no 'index' member" warnings.
-#pylint: disable=no-member
-
 import os
 import json
 import urllib.request
@@ -10,10 +7,11 @@ import base64
 import re
 import time
 import math
-import hashlib
+import bisect
+import collections
 import logging
 
-from flask import request, render_template, make_response, jsonify, abort
+from flask import request, render_template, jsonify, abort
 from PIL import Image, ImageOps
 
 from vasl_templates.webapp import app
@@ -21,11 +19,21 @@ from vasl_templates.webapp.downloads import DownloadedFile
 from vasl_templates.webapp.vassal import VassalShim
 from vasl_templates.webapp.utils import TempFile, \
     get_month_name, make_formatted_day_of_month, friendly_fractions, parse_int, \
-    trim_image, get_image_data, remove_alpha_from_image
+    trim_image, get_image_data, remove_alpha_from_image, change_extn, get_request_params, get_uploaded_file, \
+    save_uploaded_file, PreparedResponse
+from vasl_templates.webapp.files import add_temp_download
 
 # ---------------------------------------------------------------------
 
-def _build_asa_scenario_index( df, new_data, logger ):
+class _AsaSnapshot:
+    """Snapshot of the ASL Scenario Archive index."""
+    def __init__( self ):
+        self.index = None
+        self.search_index = None
+        self.prepared_index = None
+        self.generated_at = None
+
+def _build_asa_scenario_index( snapshot, new_data, logger ):
     """Build the ASL Scenario Archive index."""
     # parse the scenario index
     index = {
@@ -33,49 +41,313 @@ def _build_asa_scenario_index( df, new_data, logger ):
         for scenario in new_data["scenarios"]
     }
     # install the results
-    df.index = index
-    df.generated_at = new_data.get( "_generatedAt_" )
+    snapshot.index = index
+    snapshot.generated_at = new_data.get( "_generatedAt_" )
+    # update the search index
+    # NOTE: Only scenarios that have changed since the last time the data was installed will be re-indexed.
+    # We work on a copy of the search index, since the current one may be in use.
+    start_time = time.time()
+    if snapshot.search_index is None:
+        snapshot.search_index = ScenarioSearchIndex()
+    else:
+        snapshot.search_index = snapshot.search_index.copy()
+    snapshot.search_index.update( index.values() )
+    # prepare the response for the scenario index
+    snapshot.prepared_index = _prepare_asa_scenario_index( index )
     if logger:
-        logger.debug( "Loaded the ASL Secenario Archive index: #scenarios=%d", len(df.index) )
+        logger.debug( "Loaded the ASL Secenario Archive index: #scenarios=%d", len(snapshot.index) )
         logger.debug( "- Generated at: %s", new_data.get( "_generatedAt_", "n/a" ) )
+        logger.debug( "- Updated the search index: #tokens=%d ; elapsed=%.3fs",
+            len(snapshot.search_index), time.time() - start_time
+        )
+
+def _apply_asa_journal_entry( data, scenario ):
+    """Apply a local change to the ASL Scenario Archive index."""
+    # NOTE: The downloaded index file contains a *list* of scenarios, so we append the new scenario info
+    # to the end of that list, and when it's read into a dict, the most-recent version is the one that gets used.
+    data["scenarios"].append( scenario )
 
 _asa_scenarios = DownloadedFile( "ASA", 6, # nb: TTL = #hours
     "asl-scenario-archive.json",
     "https://vasl-templates.org/services/asl-scenario-archive/scenario-index.json",
     _build_asa_scenario_index,
-    extra_args = { "index": None }
+    snapshot_class = _AsaSnapshot,
+    on_journal_entry = _apply_asa_journal_entry
 )
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def _build_roar_scenario_index( df, new_data, logger ):
+class ScenarioSearchIndex:
+    """Inverted index for searching the ASL Scenario Archive scenarios.
+
+    Each word in a scenario's title, ID, location, publication and publisher is indexed, and can be matched
+    by a prefix of the word. Scenarios are ranked by which fields matched (e.g. a title match scores higher
+    than a publisher match), with exact word matches scoring higher than prefix matches.
+    """
+
+    # NOTE: These are the fields that get indexed, and how important a match on each one is.
+    FIELD_WEIGHTS = [
+        ( "title", 10 ), ( "sc_id", 8 ), ( "scen_location", 4 ), ( "pub_name", 2 ), ( "publisher_name", 1 )
+    ]
+
+    def __init__( self ):
+        self._postings = {} # nb: token => { scenario_id: weight }
+        self._tokens = [] # nb: sorted, so that we can find tokens that start with a prefix
+        self._scenario_tokens = {} # nb: scenario_id => { token: weight }
+
+    def __len__( self ):
+        return len( self._tokens )
+
+    def copy( self ):
+        """Make a copy of the index."""
+        index = ScenarioSearchIndex()
+        index._postings = { k: dict(v) for k,v in self._postings.items() } #pylint: disable=protected-access
+        index._tokens = list( self._tokens ) #pylint: disable=protected-access
+        # NOTE: The token dicts are never modified, so they can be shared.
+        index._scenario_tokens = dict( self._scenario_tokens ) #pylint: disable=protected-access
+        return index
+
+    def update( self, scenarios ):
+        """Update the index with a new set of scenarios."""
+        scenario_ids = set()
+        for scenario in scenarios:
+            self.add( scenario )
+            scenario_ids.add( scenario["scenario_id"] )
+        for scenario_id in set( self._scenario_tokens ) - scenario_ids:
+            self.remove( scenario_id )
+
+    def add( self, scenario ):
+        """Add a scenario to the index (or update it, if it's already there)."""
+        scenario_id = scenario[ "scenario_id" ]
+        tokens = self._get_scenario_tokens( scenario )
+        prev_tokens = self._scenario_tokens.get( scenario_id )
+        if tokens == prev_tokens:
+            return # nb: nothing's changed
+        if prev_tokens is not None:
+            self.remove( scenario_id )
+        for token, weight in tokens.items():
+            postings = self._postings.get( token )
+            if postings is None:
+                postings = self._postings[ token ] = {}
+                bisect.insort( self._tokens, token )
+            postings[ scenario_id ] = weight
+        self._scenario_tokens[ scenario_id ] = tokens
+
+    def remove( self, scenario_id ):
+        """Remove a scenario from the index."""
+        tokens = self._scenario_tokens.pop( scenario_id, None )
+        for token in tokens or []:
+            postings = self._postings[ token ]
+            del postings[ scenario_id ]
+            if not postings:
+                del self._postings[ token ]
+                del self._tokens[ bisect.bisect_left( self._tokens, token ) ]
+
+    def search( self, query ):
+        """Search for scenarios.
+
+        Returns a dict of the matching scenario ID's and their scores. Every word in the query must match.
+        """
+        results = None
+        for query_token in set( self.tokenize( query ) ):
+            # find all the scenarios that have a word that starts with the next query word
+            scores = {}
+            pos = bisect.bisect_left( self._tokens, query_token )
+            while pos < len( self._tokens ) and self._tokens[ pos ].startswith( query_token ):
+                token = self._tokens[ pos ]
+                multiplier = 2 if token == query_token else 1
+                for scenario_id, weight in self._postings[ token ].items():
+                    scores[ scenario_id ] = max( scores.get( scenario_id, 0 ), weight * multiplier )
+                pos += 1
+            # combine the results with those for the other query words
+            if results is None:
+                results = scores
+            else:
+                results = {
+                    scenario_id: score + results[scenario_id]
+                    for scenario_id, score in scores.items()
+                    if scenario_id in results
+                }
+            if not results:
+                break
+        return results or {}
+
+    def _get_scenario_tokens( self, scenario ):
+        """Get the tokens to be indexed for a scenario."""
+        tokens = {}
+        def add_token( token, weight ): #pylint: disable=missing-docstring
+            tokens[ token ] = max( tokens.get( token, 0 ), weight )
+        for key, weight in self.FIELD_WEIGHTS:
+            val = scenario.get( key )
+            if not val:
+                continue
+            for token in self.tokenize( val ):
+                add_token( token, weight )
+            if key == "sc_id":
+                # NOTE: We also index the scenario ID with the punctuation removed e.g. "ASL-12" => "asl12".
+                add_token( _make_roar_matching_key( val ), weight )
+        return tokens
+
+    @staticmethod
+    def tokenize( val ):
+        """Split a string into tokens."""
+        return re.findall( "[a-z0-9]+", str( val ).lower() )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class _RoarSnapshot:
+    """Snapshot of the ROAR scenario index."""
+    def __init__( self ):
+        self.index = None
+        self.matcher = None
+        self.prepared_index = None
+        self.generated_at = None
+
+def _build_roar_scenario_index( snapshot, new_data, logger ):
     """Build the ROAR scenario index."""
     # parse the scenario index
-    index, title_matching, id_matching = {}, {}, {}
+    index = {}
     for roar_id,scenario in new_data.items():
         if roar_id.startswith( "_" ):
             continue
         scenario[ "roar_id" ] = roar_id
         index[ roar_id ] = scenario
-        _update_roar_matching_index( title_matching, scenario.get("name"), roar_id )
-        _update_roar_matching_index( id_matching, scenario.get("scenario_id"), roar_id )
     # install the results
-    df.index, df.title_matching, df.id_matching = index, title_matching, id_matching
-    df.generated_at = new_data.get( "_generatedAt_" )
+    snapshot.index = index
+    snapshot.matcher = RoarScenarioMatcher( index )
+    snapshot.generated_at = new_data.get( "_generatedAt_" )
+    # NOTE: The index is only ever replaced (never modified), so we can prepare the response now.
+    snapshot.prepared_index = PreparedResponse.from_json( index )
     if logger:
-        logger.debug( "Loaded the ROAR scenario index: #scenarios=%d", len(df.index) )
+        logger.debug( "Loaded the ROAR scenario index: #scenarios=%d", len(snapshot.index) )
         logger.debug( "- Generated at: %s", new_data.get( "_generatedAt_", "n/a" ) )
         logger.debug( "- Last updated: %s", new_data.get( "_lastUpdated_", "n/a" ) )
         logger.debug( "- # playings:   %s", str( new_data.get( "_nPlayings_", "n/a" ) ) )
 
-def _update_roar_matching_index( index, val, roar_id ):
-    """Update the index that will be used for matching ROAR scenarios."""
-    if not val:
-        return
-    key = _make_roar_matching_key( val )
-    if key not in index:
-        index[ key ] = set()
-    index[ key ].add( roar_id )
+class RoarScenarioMatcher:
+    """Match ASL Scenario Archive scenarios with ROAR scenarios.
+
+    Scenarios are matched by their (normalized) title, with the scenario ID being used to choose between
+    ROAR scenarios that have the same title. If there is no exact title match, we look for ROAR scenarios
+    with a very similar title (using n-gram similarity), as long as any numbers in the titles are the same.
+    """
+
+    NGRAM_SIZE = 3
+    FUZZY_THRESHOLD = 0.8
+
+    def __init__( self, index ):
+
+        # initialize
+        self._index = index
+        self._title_matching = {} # nb: title key => [ roar_id, ... ]
+        self._id_matching = {} # nb: scenario ID key => { roar_id, ... }
+        self._ngrams = {} # nb: n-gram => { title key, ... }
+        self._title_ngrams = {} # nb: title key => { n-gram, ... }
+
+        # index the ROAR scenarios by title and scenario ID
+        for roar_id, scenario in index.items():
+            key = _make_roar_matching_key( scenario.get( "name" ) )
+            if key:
+                self._title_matching.setdefault( key, [] ).append( roar_id )
+            key = _make_roar_matching_key( scenario.get( "scenario_id" ) )
+            if key:
+                self._id_matching.setdefault( key, set() ).add( roar_id )
+
+        # NOTE: If several ROAR scenarios have the same title, we return them in descending order
+        # of the number of playings, so we sort them now, rather than every time we match.
+        def get_result_count( roar_id ):
+            """Get the number of playings for a ROAR scenario."""
+            results = index[ roar_id ].get( "results" ) or []
+            return sum( r[1] for r in results )
+        for roar_ids in self._title_matching.values():
+            roar_ids.sort( key = lambda roar_id: ( -get_result_count( roar_id ), roar_id ) )
+
+        # index the titles by n-gram (for fuzzy matching)
+        for key in self._title_matching:
+            ngrams = self._make_ngrams( key )
+            self._title_ngrams[ key ] = ngrams
+            for ngram in ngrams:
+                self._ngrams.setdefault( ngram, set() ).add( key )
+
+    def match( self, scenario ):
+        """Find the ROAR scenarios that match an ASL Scenario Archive scenario."""
+
+        # try to match by scenario title
+        title = scenario.get( "title" )
+        if not title:
+            return None
+        title_key = _make_roar_matching_key( title )
+        id_key = _make_roar_matching_key( scenario.get( "sc_id" ) )
+        roar_ids = self._title_matching.get( title_key )
+        if not roar_ids:
+            roar_ids = self._fuzzy_match( title_key, id_key )
+            if not roar_ids:
+                return []
+
+        # check if we found multiple scenarios with the same title
+        if len( roar_ids ) > 1:
+            # yup - filter by ID
+            matches = self._id_matching.get( id_key )
+            if matches:
+                roar_ids = [ roar_id for roar_id in roar_ids if roar_id in matches ]
+
+        return [ self._index[ roar_id ] for roar_id in roar_ids ]
+
+    def match_all( self, scenarios ):
+        """Find the ROAR scenarios that match each of the specified ASL Scenario Archive scenarios.
+
+        Returns a list of matches, in the same order as the scenarios.
+        """
+        # NOTE: Scenarios with the same title and ID will always have the same matches, so we only look them up once.
+        results, cache = [], {}
+        for scenario in scenarios:
+            key = ( scenario.get( "title" ), scenario.get( "sc_id" ) )
+            if key not in cache:
+                cache[ key ] = self.match( scenario )
+            results.append( cache[ key ] )
+        return results
+
+    def _fuzzy_match( self, title_key, id_key ):
+        """Find ROAR scenarios with a title that is similar to the specified one."""
+
+        # find titles that share n-grams with the one we're looking for
+        ngrams = self._make_ngrams( title_key )
+        counts = collections.Counter()
+        for ngram in ngrams:
+            counts.update( self._ngrams.get( ngram, () ) )
+
+        # find the most similar titles
+        # NOTE: We don't match titles that only differ by a number e.g. "Hill 621" and "Hill 612",
+        # or a scenario's ID (if both scenarios have one).
+        numbers = re.findall( "[0-9]+", title_key )
+        def is_id_ok( roar_id ):
+            """Check if a ROAR scenario's ID is compatible with the one we're looking for."""
+            roar_id_key = _make_roar_matching_key( self._index[ roar_id ].get( "scenario_id" ) )
+            return not id_key or not roar_id_key or roar_id_key == id_key
+        best_score, roar_ids = None, []
+        for key, count in counts.items():
+            score = 2.0 * count / ( len(ngrams) + len(self._title_ngrams[key]) ) # nb: Dice coefficient
+            if score < self.FUZZY_THRESHOLD or ( best_score is not None and score < best_score ):
+                continue
+            if re.findall( "[0-9]+", key ) != numbers:
+                continue
+            matches = [ roar_id for roar_id in self._title_matching[key] if is_id_ok( roar_id ) ]
+            if not matches:
+                continue
+            if best_score is None or score > best_score:
+                best_score, roar_ids = score, matches
+            else:
+                roar_ids.extend( matches )
+
+        return roar_ids
+
+    @staticmethod
+    def _make_ngrams( key ):
+        """Split a title key into n-grams."""
+        size = RoarScenarioMatcher.NGRAM_SIZE
+        if len( key ) <= size:
+            return { key }
+        return { key[i:i+size] for i in range( len(key) - size + 1 ) }
 
 def _make_roar_matching_key( val ):
     """Generate a key value that will be used to match ROAR scenarios."""
@@ -87,7 +359,7 @@ _roar_scenarios = DownloadedFile( "ROAR", 6, # nb: TTL = #hours
     "roar-scenario-index.json",
     "https://vasl-templates.org/services/roar/scenario-index.json",
     _build_roar_scenario_index,
-    extra_args = { "index": None }
+    snapshot_class = _RoarSnapshot
 )
 
 # ---------------------------------------------------------------------
@@ -96,63 +368,130 @@ _roar_scenarios = DownloadedFile( "ROAR", 6, # nb: TTL = #hours
 def get_scenario_index():
     """Return the scenario index."""
 
-    def add_field( entry, key, val ): #pylint: disable=missing-docstring
+    # generate the scenario index
+    asa_scenarios = _asa_scenarios.snapshot
+    if asa_scenarios.index is None:
+        if  _asa_scenarios.error_msg:
+            return _make_not_available_response(
+                "Couldn't get the scenario index.", _asa_scenarios.error_msg
+            )
+        else:
+            return _make_not_available_response(
+                "Please wait, the scenario index is still downloading.", None
+            )
+
+    # NOTE: The response was prepared when the scenario index was installed (including its ETag,
+    # and compressed versions of it).
+    return asa_scenarios.prepared_index.make_response()
+
+def _prepare_asa_scenario_index( index ):
+    """Prepare the response for the scenario index."""
+    return PreparedResponse.from_json( [
+        _make_scenario_index_entry( scenario )
+        for scenario in index.values()
+    ] )
+
+def _make_scenario_index_entry( scenario ):
+    """Make an entry for the scenario index."""
+    def add_field( key, val ): #pylint: disable=missing-docstring
         if val:
             entry[ key ] = val
-    def make_entry( scenario ):
-        """Make an entry for the scenario index."""
-        entry = { "scenario_id": scenario["scenario_id"] }
-        add_field( entry, "scenario_name", _make_scenario_name( scenario ) )
-        add_field( entry, "scenario_display_id", scenario.get( "sc_id" ) )
-        add_field( entry, "scenario_location", scenario.get( "scen_location" ) )
-        add_field( entry, "scenario_date", _parse_date( scenario.get( "scen_date" ) ) )
-        add_field( entry, "publication_name", scenario.get( "pub_name" ) )
-        add_field( entry, "publication_id", scenario.get( "pub_id" ) )
-        add_field( entry, "publication_date", _parse_date( scenario.get( "published_date" ) ) )
-        add_field( entry, "publisher_name", scenario.get( "publisher_name" ) )
-        add_field( entry, "publisher_id", scenario.get( "publisher_id" ) )
-        return entry
+    entry = { "scenario_id": scenario["scenario_id"] }
+    add_field( "scenario_name", _make_scenario_name( scenario ) )
+    add_field( "scenario_display_id", scenario.get( "sc_id" ) )
+    add_field( "scenario_location", scenario.get( "scen_location" ) )
+    add_field( "scenario_date", _parse_date( scenario.get( "scen_date" ) ) )
+    add_field( "publication_name", scenario.get( "pub_name" ) )
+    add_field( "publication_id", scenario.get( "pub_id" ) )
+    add_field( "publication_date", _parse_date( scenario.get( "published_date" ) ) )
+    add_field( "publisher_name", scenario.get( "publisher_name" ) )
+    add_field( "publisher_id", scenario.get( "publisher_id" ) )
+    return entry
+
+@app.route( "/scenario-search" )
+def search_scenarios():
+    """Search the scenario index."""
 
-    # generate the scenario index
-    with _asa_scenarios:
-        if _asa_scenarios.index is None:
-            if  _asa_scenarios.error_msg:
-                return _make_not_available_response(
-                    "Couldn't get the scenario index.", _asa_scenarios.error_msg
-                )
-            else:
-                return _make_not_available_response(
-                    "Please wait, the scenario index is still downloading.", None
-                )
-        etag = hashlib.md5( json.dumps( _asa_scenarios.index ).encode( "utf-8" ) ).hexdigest()
-        if request.headers.get( "If-None-Match" ) == etag:
-            return "Not Modified", 304
-        resp = make_response( jsonify( [
-            make_entry( scenario )
-            for scenario in _asa_scenarios.index.values()
-        ] ) )
-        resp.headers["ETag"] = etag
-        return resp
+    # parse the request
+    query = request.args.get( "q", "" )
+    theater = request.args.get( "theater", "" ).strip().upper()
+    date_from = request.args.get( "date_from", "" ).strip()
+    date_to = request.args.get( "date_to", "" ).strip()
+    if len( date_to ) == 4:
+        date_to += "-12-31" # nb: so that e.g. "1944" includes all of 1944
+    elif len( date_to ) == 7:
+        date_to += "-31"
+    page = max( parse_int( request.args.get( "page" ), 1 ), 1 )
+    page_size = min( max( parse_int( request.args.get( "page_size" ), 50 ), 1 ), 500 )
+
+    def is_match( scenario ): #pylint: disable=missing-docstring
+        if theater and ( scenario.get( "theatre" ) or "" ).upper() != theater:
+            return False
+        if date_from or date_to:
+            scenario_date = _parse_date_iso( scenario.get( "scen_date" ) )
+            if not scenario_date:
+                return False
+            if date_from and scenario_date < date_from:
+                return False
+            if date_to and scenario_date > date_to:
+                return False
+        return True
+
+    # check that the scenario index is available
+    asa_scenarios = _asa_scenarios.snapshot
+    if asa_scenarios.index is None:
+        if  _asa_scenarios.error_msg:
+            return _make_not_available_response(
+                "Couldn't get the scenario index.", _asa_scenarios.error_msg
+            )
+        else:
+            return _make_not_available_response(
+                "Please wait, the scenario index is still downloading.", None
+            )
+
+    # search for matching scenarios
+    if ScenarioSearchIndex.tokenize( query ):
+        scores = asa_scenarios.search_index.search( query )
+    else:
+        # nb: no query was specified, so we return everything that passes the filters
+        scores = dict.fromkeys( asa_scenarios.index, 0 )
+    matches = [
+        ( score, asa_scenarios.index[scenario_id] )
+        for scenario_id, score in scores.items()
+        if is_match( asa_scenarios.index[scenario_id] )
+    ]
+    matches.sort( key = lambda m: (
+        -m[0], _make_scenario_name( m[1] ).lower(), m[1]["scenario_id"]
+    ) )
+
+    # return the requested page of results
+    start = ( page - 1 ) * page_size
+    results = []
+    for score, scenario in matches[ start : start+page_size ]:
+        results.append( _make_scenario_index_entry( scenario ) )
+        results[-1][ "score" ] = score
+
+    return jsonify( {
+        "total": len( matches ),
+        "page": page,
+        "page_size": page_size,
+        "scenarios": results,
+    } )
 
 @app.route( "/roar/scenario-index" )
 def get_roar_scenario_index():
     """Return the ROAR scenario index."""
-    with _roar_scenarios:
-        if _roar_scenarios.index is None:
-            if _roar_scenarios.error_msg:
-                return _make_not_available_response(
-                    "Couldn't get the ROAR scenarios.", _roar_scenarios.error_msg
-                )
-            else:
-                return _make_not_available_response(
-                    "Please wait, the ROAR scenarios are still downloading.", None
-                )
-        etag = hashlib.md5( json.dumps( _roar_scenarios.index ).encode( "utf-8" ) ).hexdigest()
-        if request.headers.get( "If-None-Match" ) == etag:
-            return "Not Modified", 304
-        resp = make_response( jsonify( _roar_scenarios.index ) )
-        resp.headers["ETag"] = etag
-        return resp
+    roar_scenarios = _roar_scenarios.snapshot
+    if roar_scenarios.index is None:
+        if _roar_scenarios.error_msg:
+            return _make_not_available_response(
+                "Couldn't get the ROAR scenarios.", _roar_scenarios.error_msg
+            )
+        else:
+            return _make_not_available_response(
+                "Please wait, the ROAR scenarios are still downloading.", None
+            )
+    return roar_scenarios.prepared_index.make_response()
 
 def _make_not_available_response( msg, msg2 ):
     """Generate a "not available" response."""
@@ -270,35 +609,18 @@ def _do_get_scenario( scenario_id ):
 
 def _match_roar_scenario( scenario ):
     """Try to match the scenario with a ROAR scenario."""
-
-    def get_result_count( scenario ):
-        """Get the number of playings for a ROAR scenario."""
-        results = scenario.get( "results", [] )
-        return sum( r[1] for r in results )
-
-    with _roar_scenarios:
-        if not getattr( _roar_scenarios, "index", None ):
-            # NOTE: We can get here if there was a problem downloading the ROAR scenarios.
-            return []
-        # try to match by scenario title
-        title = scenario.get( "title" )
-        if not title:
-            return None
-        matches = _roar_scenarios.title_matching.get( _make_roar_matching_key( title ) )
-        if not matches:
-            return []
-        elif len( matches ) == 1:
-            # there was exactly one match - return it
-            roar_id = next( iter( matches ) )
-            return [ _roar_scenarios.index[ roar_id ] ]
-        else:
-            # we found multiple scenarios with the same title, filter by ID
-            matches2 = _roar_scenarios.id_matching.get( _make_roar_matching_key( scenario.get("sc_id") ), set() )
-            if matches2:
-                matches = matches.intersection( matches2 )
-            matches = [ _roar_scenarios.index[m] for m in matches ]
-            matches.sort( key=get_result_count, reverse=True )
-            return matches
+    matcher = _roar_scenarios.snapshot.matcher
+    if not matcher:
+        # NOTE: We can get here if there was a problem downloading the ROAR scenarios.
+        return []
+    return matcher.match( scenario )
+
+def _match_roar_scenarios( scenarios ):
+    """Try to match each of the scenarios with a ROAR scenario."""
+    matcher = _roar_scenarios.snapshot.matcher
+    if not matcher:
+        return [ [] for _ in scenarios ]
+    return matcher.match_all( scenarios )
 
 def _get_roar_info( roar_id ):
     """Get the information for the specified ROAR scenario."""
@@ -315,27 +637,25 @@ def _get_roar_info( roar_id ):
             balance[ "percentage" ] = int( 100 * playings[player_no][1] / nGames + 0.5 )
         return balance
 
-    with _roar_scenarios:
+    # find the ROAR scenario
+    index = _roar_scenarios.snapshot.index or {}
+    scenario = index.get( roar_id )
+    if not scenario:
+        abort( 404 )
 
-        # find the ROAR scenario
-        index = _roar_scenarios.index or {}
-        scenario = index.get( roar_id )
-        if not scenario:
-            abort( 404 )
-
-        # return the scenario details
-        results = {
-            "scenario_id": roar_id,
-            "scenario_display_id": scenario.get( "scenario_id" ),
-            "name": scenario.get( "name" ),
-            "url": scenario.get( "url" )
-        }
-        playings = scenario.get( "results" )
-        if playings:
-            nGames = playings[0][1] + playings[1][1]
-            results[ "balance" ] = [ get_balance(0), get_balance(1) ]
+    # return the scenario details
+    results = {
+        "scenario_id": roar_id,
+        "scenario_display_id": scenario.get( "scenario_id" ),
+        "name": scenario.get( "name" ),
+        "url": scenario.get( "url" )
+    }
+    playings = scenario.get( "results" )
+    if playings:
+        nGames = playings[0][1] + playings[1][1]
+        results[ "balance" ] = [ get_balance(0), get_balance(1) ]
 
-        return results
+    return results
 
 # ---------------------------------------------------------------------
 
@@ -434,12 +754,11 @@ def _make_brief_overview( content ):
 
 def _get_scenario( scenario_id ):
     """Get the specified scenario."""
-    with _asa_scenarios:
-        index = _asa_scenarios.index or {}
-        scenario = index.get( scenario_id )
-        if not scenario:
-            abort( 404 )
-        return scenario
+    index = _asa_scenarios.snapshot.index or {}
+    scenario = index.get( scenario_id )
+    if not scenario:
+        abort( 404 )
+    return scenario
 
 def _make_scenario_name( scenario ):
     """Get the scenario's name."""
@@ -452,8 +771,10 @@ def prepare_asa_upload(): #pylint: disable=too-many-locals
     """Prepare files for upload to the ASL Scenario Archive."""
 
     # parse the request
-    vsav_data = request.json[ "vsav_data" ]
-    vsav_filename = request.json[ "filename" ]
+    # NOTE: The VSAV file can be uploaded as multipart/form-data, in which case the generated files
+    # are returned as download URL's, instead of base64-encoded in the response.
+    params, raw_files = get_request_params()
+    vsav_filename = params[ "filename" ]
 
     # initialize
     start_time = time.time()
@@ -461,21 +782,16 @@ def prepare_asa_upload(): #pylint: disable=too-many-locals
 
     try:
 
-        # get the VSAV data (we do this inside the try block so that the user gets shown
-        # a proper error dialog if there's a problem decoding the base64 data)
-        vsav_data = base64.b64decode( vsav_data )
-        logger.info( "Preparing VSAV (#bytes=%d): %s", len(vsav_data), vsav_filename )
-
         with TempFile() as input_file:
 
-            # save the VSAV data in a temp file
-            input_file.write( vsav_data )
+            # save the VSAV data in a temp file (we do this inside the try block so that the user gets shown
+            # a proper error dialog if there's a problem decoding the base64 data)
+            nbytes = save_uploaded_file( input_file, get_uploaded_file( params, "vsav_data" ) )
+            logger.info( "Preparing VSAV (#bytes=%d): %s", nbytes, vsav_filename )
             input_file.close( delete=False )
-            fname = app.config.get( "PREPARE_ASA_UPLOAD_INPUT" ) # nb: for diagnosing problems
-            if fname:
-                logger.debug( "Saving a copy of the VSAV data: %s", fname )
-                with open( fname, "wb" ) as fp:
-                    fp.write( vsav_data )
+            input_file.save_copy( # nb: for diagnosing problems
+                app.config.get( "PREPARE_ASA_UPLOAD_INPUT" ), logger, "VSAV data"
+            )
 
             # prepare the files to be uploaded
             with TempFile() as stripped_vsav_file, TempFile() as screenshot_file:
@@ -489,8 +805,13 @@ def prepare_asa_upload(): #pylint: disable=too-many-locals
                 )
 
                 # read the stripped VSAV data
-                with open( stripped_vsav_file.name, "rb" ) as fp:
-                    stripped_vsav = fp.read()
+                if raw_files:
+                    stripped_vsav, stripped_vsav_url = None, add_temp_download(
+                        os.path.split( vsav_filename )[1], fname=stripped_vsav_file.name
+                    )
+                else:
+                    with open( stripped_vsav_file.name, "rb" ) as fp:
+                        stripped_vsav, stripped_vsav_url = fp.read(), None
                 stripped_vsav_file.save_copy(
                     app.config.get( "PREPARE_ASA_UPLOAD_STRIPPED_VSAV" ),
                     logger, "stripped VSAV"
@@ -543,12 +864,19 @@ def prepare_asa_upload(): #pylint: disable=too-many-locals
 
     # return the results
     logger.info( "Prepared the VSAV file OK: elapsed=%.3fs", time.time()-start_time )
-    results = {
-        "filename": vsav_filename,
-        "stripped_vsav": base64.b64encode( stripped_vsav ).decode( "utf-8" ),
-    }
+    results = { "filename": vsav_filename }
+    if stripped_vsav_url:
+        results[ "stripped_vsav_url" ] = stripped_vsav_url
+    else:
+        results[ "stripped_vsav" ] = base64.b64encode( stripped_vsav ).decode( "utf-8" )
     if screenshot_data:
-        results[ "screenshot" ] = base64.b64encode( screenshot_data ).decode( "utf-8" )
+        if raw_files:
+            results[ "screenshot_url" ] = add_temp_download(
+                str( change_extn( os.path.split( vsav_filename )[1], ".jpg" ) ),
+                data=screenshot_data, mimetype="image/jpeg"
+            )
+        else:
+            results[ "screenshot" ] = base64.b64encode( screenshot_data ).decode( "utf-8" )
     return jsonify( results )
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -571,22 +899,22 @@ def on_successful_asa_upload( scenario_id ):
         msg = str( getattr(ex,"reason",None) or ex )
         return jsonify( { "status": "error", "message": msg } )
 
-    # update the local index
-    if os.path.isfile( _asa_scenarios.cache_fname ):
-        # NOTE: Since the downloaded index file contains a *list* of scenarios, we append the new scenario info
-        # to the end of that list, and then the next time the program starts and reads the list into a dict,
-        # the most-recent version is the one that will ultimately be used. This lets us identify these temporary changes
-        # that have been made to the cached index file (which will be overwritten when we download a fresh copy).
-        # This is not particularly efficient, but it won't happen too often.
-        with open( _asa_scenarios.cache_fname, "r", encoding="utf-8" ) as fp:
-            data = json.load( fp )
-        data["scenarios"].append( new_scenario )
-        with open( _asa_scenarios.cache_fname, "w", encoding="utf-8" ) as fp:
-            json.dump( data, fp )
-
-    # update the in-memory scenario index
-    with _asa_scenarios:
-        _asa_scenarios.index[ scenario_id ] = new_scenario
+    # update the local scenario index
+    # NOTE: Requests that are currently being handled will continue to see the previous snapshot,
+    # so we build a new version of the index, rather than modifying the existing one.
+    def update_index( snapshot ): #pylint: disable=missing-docstring
+        # NOTE: We record the new scenario in the journal, so that it will be re-applied if the program
+        # is restarted, or the scenario index is reloaded, until a freshly-downloaded index includes it.
+        _asa_scenarios.append_to_journal( new_scenario )
+        if snapshot.index is None:
+            return
+        snapshot.index = dict( snapshot.index )
+        snapshot.index[ scenario_id ] = new_scenario
+        if snapshot.search_index is not None:
+            snapshot.search_index = snapshot.search_index.copy()
+            snapshot.search_index.add( new_scenario )
+        snapshot.prepared_index = _prepare_asa_scenario_index( snapshot.index )
+    _asa_scenarios.update_snapshot( update_index )
 
     return jsonify( { "status": "ok" } )
 
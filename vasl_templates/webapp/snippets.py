@@ -14,7 +14,7 @@ from PIL import Image
 
 from vasl_templates.webapp import app, globvars
 from vasl_templates.webapp.config.constants import DATA_DIR
-from vasl_templates.webapp.webdriver import WebDriver
+from vasl_templates.webapp.webdriver import get_snippet_image
 from vasl_templates.webapp.utils import read_text_file
 
 default_template_pack = None
@@ -170,16 +170,11 @@ def make_snippet_image():
     # generate an image for the snippet
     snippet = request.data.decode( "utf-8" )
     try:
-        with WebDriver.get_instance() as webdriver:
-            img = webdriver.get_snippet_screenshot( None, snippet )
+        img_data, _ = get_snippet_image( None, snippet )
     except Exception as ex: #pylint: disable=broad-except
         return "ERROR: {}".format( ex )
 
-    # get the image data
-    buf = io.BytesIO()
-    img.save( buf, format="PNG" )
-    buf.seek( 0 )
-    img_data = buf.read()
+    # save the image data
     global last_snippet_image
     last_snippet_image = img_data
 
@@ -25,7 +25,7 @@ window.on_analyze_vlog = function()
             var data = $elem.val() ;
             var pos = data.indexOf( "|" ) ;
             var fname = data.substring( 0, pos ) ;
-            var vlog_data = data.substring( pos+1 ) ;
+            var vlog_data = makeBlob( atob( data.substring( pos+1 ) ) ) ;
             $elem.val( "" ) ; // nb: let the test suite know we've received the data
             addFileToUploadList( fname, vlog_data ) ;
         } else {
@@ -119,7 +119,7 @@ window.on_analyze_vlog = function()
                 // unload the files to be analyzed
                 var vlog_data = [] ;
                 $gLogFilesToUpload.children( "li" ).each( function() {
-                    vlog_data.push( [ $(this).attr("data-filename"), $(this).attr("data-vlog") ] ) ;
+                    vlog_data.push( [ $(this).attr("data-filename"), $(this).data("vlog") ] ) ;
                 } ) ;
                 // analyze the log files
                 $(this).dialog( "close" ) ;
@@ -139,27 +139,10 @@ window.on_load_vlog_file_selected = function() {
 
 function addFilesToUploadList( files )
 {
-    // initialize
-    var currFileNo = 0 ;
-    var fileReader = new FileReader() ;
-
     // add each log file to the list
-    function loadNextFile() {
-        if ( currFileNo >= files.length )
-            return ;
-        var currFile = files[ currFileNo ] ;
-        fileReader.onload = function() {
-            // get the file data
-            vlog_data = removeBase64Prefix( fileReader.result ) ;
-            // add the file to the list
-            addFileToUploadList( currFile.name, vlog_data ) ;
-            // read the next file
-            ++ currFileNo ;
-            loadNextFile() ;
-        } ;
-        fileReader.readAsDataURL( currFile ) ;
-    }
-    loadNextFile() ;
+    // NOTE: We upload the files as-is, so there's no need to read them in.
+    for ( var i=0 ; i < files.length ; ++i )
+        addFileToUploadList( files[i].name, files[i] ) ;
 }
 
 function addFileToUploadList( fname, vlog_data )
@@ -173,7 +156,7 @@ function addFileToUploadList( fname, vlog_data )
     ] ;
     var $item = $( buf.join("") ) ;
     $item.attr( "data-filename", fname ) ;
-    $item.attr( "data-vlog", vlog_data ) ;
+    $item.data( "vlog", vlog_data ) ;
     $gLogFilesToUpload.append( $item ) ;
     updateUi() ;
 
@@ -220,12 +203,10 @@ function analyzeLogFiles( vlog_data )
     // send a request to analyze the log files
     var objName = pluralString( vlog_data.length, "log file", "log files" ) ;
     var $pleaseWait = showPleaseWaitDialog( "Analyzing your " + objName + "...", { width: 255 } ) ;
-    $.ajax( {
-        url: gAnalyzeVlogsUrl,
-        type: "POST",
-        data: JSON.stringify( vlog_data ),
-        contentType: "application/json",
-    } ).done( function( data ) {
+    var formData = makeMultipartData( {}, vlog_data.map( function( vlog ) {
+        return [ "vlog_data", vlog[1], vlog[0] ] ;
+    } ) ) ;
+    runJob( "analyze-vlogs", formData, $pleaseWait ).done( function( data ) {
         $pleaseWait.dialog( "close" ) ;
         resp = checkResponse( data, objName ) ;
         if ( ! resp )
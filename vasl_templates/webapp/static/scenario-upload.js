@@ -19,7 +19,7 @@ window.uploadScenario = function() {
             // FOR TESTING PORPOISES! We can't control a file upload from Selenium (since
             // the browser will use native controls), so we get the data from a <textarea>).
             var $elem = $( "#_vsav-persistence_" ) ;
-            var vsavData = $elem.val() ;
+            var vsavData = makeBlob( atob( $elem.val() ) ) ;
             $elem.val( "" ) ; // nb: let the test suite know we've received the data
             doSelectVsavData( "test.vsav", vsavData ) ;
             return ;
@@ -30,29 +30,18 @@ window.uploadScenario = function() {
         return $gVsavContainer.find( ".hint" ).css( "display" ) !== "none" ;
     }
     function onSelectVsavFile( file ) {
-        // read the selected file
-        var fileReader = new FileReader() ;
-        fileReader.onload = function() {
-            var vsavData = fileReader.result ;
-            var fname = file.name ;
-            // check the file size
-            var maxBytes = gAppConfig.ASA_MAX_VASL_SETUP_SIZE ;
-            if ( maxBytes <= 0 )
-                doSelectVsavData( fname, vsavData ) ;
-            else {
-                var vsavDataDecoded = atob( removeBase64Prefix( vsavData ) ) ;
-                if ( vsavDataDecoded.length <= 1024*maxBytes )
-                    doSelectVsavData( fname, vsavData ) ;
-                else {
-                    ask( "ASL Scenario Archive upload",
-                        "VASL scenario files should be less than " + maxBytes + " KB.", {
-                        ok: function() { doSelectVsavData( fname, vsavData ) ; },
-                        ok_caption: "Continue",
-                    } ) ;
-                }
-            }
-        } ;
-        fileReader.readAsDataURL( file ) ;
+        // check the file size
+        // NOTE: We upload the file as-is, so there's no need to read it in.
+        var maxBytes = gAppConfig.ASA_MAX_VASL_SETUP_SIZE ;
+        if ( maxBytes <= 0 || file.size <= 1024*maxBytes )
+            doSelectVsavData( file.name, file ) ;
+        else {
+            ask( "ASL Scenario Archive upload",
+                "VASL scenario files should be less than " + maxBytes + " KB.", {
+                ok: function() { doSelectVsavData( file.name, file ) ; },
+                ok_caption: "Continue",
+            } ) ;
+        }
     }
     function doSelectVsavData( fname, vsavData ) {
         // show the file details in the UI
@@ -63,7 +52,6 @@ window.uploadScenario = function() {
         // prepare the upload
         // NOTE: We do this here (rather than when the user clicks the "Upload" button),
         // so that we can show the generated screenshot.
-        vsavData = removeBase64Prefix( vsavData ) ;
         prepareUploadFiles( fname, vsavData ) ;
     }
 
@@ -76,35 +64,22 @@ window.uploadScenario = function() {
         return $gScreenshotContainer.find( ".hint" ).css( "display" ) !== "none" ;
     }
     function onSelectScreenshotFile( file ) {
-        // read the selected image file
-        var fileReader = new FileReader() ;
-        fileReader.onload = function() {
-            var imageData = fileReader.result ;
-            var fname = file.name ;
-            // check the file size
-            var maxBytes = gAppConfig.ASA_MAX_SCREENSHOT_SIZE ;
-            if ( maxBytes <= 0 )
-                doSelectScreenshotFile() ;
-            else {
-                var imageDataDecoded = atob( removeBase64Prefix( imageData ) ) ;
-                if ( imageDataDecoded.length <= 1024*maxBytes )
-                    doSelectScreenshotFile() ;
-                else {
-                    ask( "ASL Scenario Archive upload",
-                        "Screenshots should be less than " + maxBytes + " KB.", {
-                        ok: doSelectScreenshotFile,
-                        ok_caption: "Continue",
-                    } ) ;
-                }
-            }
-            function doSelectScreenshotFile() {
-                // show the image preview
-                setScreenshotPreview( imageData, true ) ;
-                imageData = removeBase64Prefix( imageData ) ;
-                gScreenshotData = [ fname, atob(imageData) ] ;
-            }
-        } ;
-        fileReader.readAsDataURL( file ) ;
+        // check the file size
+        var maxBytes = gAppConfig.ASA_MAX_SCREENSHOT_SIZE ;
+        if ( maxBytes <= 0 || file.size <= 1024*maxBytes )
+            doSelectScreenshotFile() ;
+        else {
+            ask( "ASL Scenario Archive upload",
+                "Screenshots should be less than " + maxBytes + " KB.", {
+                ok: doSelectScreenshotFile,
+                ok_caption: "Continue",
+            } ) ;
+        }
+        function doSelectScreenshotFile() {
+            // show the image preview
+            setScreenshotPreview( file, true ) ;
+            gScreenshotData = [ file.name, file ] ;
+        }
     }
 
     function initExternalDragDrop() {
@@ -282,13 +257,13 @@ function uploadFiles( asaScenarioId )
         ) ;
         if ( gVsavData ) {
             formData.append( "vasl_setup",
-                makeBlob( gVsavData[1] ),
+                gVsavData[1],
                 prefix + "|" + gVsavData[0]
             ) ;
         }
         if ( gScreenshotData ) {
             formData.append( "screenshot",
-                makeBlob( gScreenshotData[1] ),
+                gScreenshotData[1],
                 prefix + "|" + gScreenshotData[0]
             ) ;
         }
@@ -371,31 +346,37 @@ function prepareUploadFiles( vsavFilename, vsavData )
     }
 
     // send a request to the backend to prepare the files
+    // NOTE: We upload the VSAV file as multipart/form-data, so the prepared files are returned as download URL's.
     setScreenshotPreview( gImagesBaseUrl + "/loader.gif", false ) ;
-    var data = {
-        filename: vsavFilename,
-        vsav_data: vsavData,
-    } ;
-    $.ajax( {
-        url: gPrepareAsaUploadUrl,
-        type: "POST",
-        data: JSON.stringify( data ),
-        contentType: "application/json",
-    } ).done( function( resp ) {
+    var formData = makeMultipartData( { filename: vsavFilename }, [ [ "vsav_data", vsavData, vsavFilename ] ] ) ;
+    runJob( "prepare-asa-upload", formData ).then( function( resp ) {
 
         // check the response
-        data = _check_vassal_shim_response( resp, "Can't prepare the VASL scenario." ) ;
-        if ( ! data ) {
+        if ( ! _check_vassal_shim_response( resp, "Can't prepare the VASL scenario." ) )
+            return $.Deferred().resolve( null ).promise() ;
+
+        // download the prepared files
+        return $.when(
+            getBlob( resp.stripped_vsav_url ),
+            resp.screenshot_url ? getBlob( resp.screenshot_url ) : null
+        ).then( function( strippedVsav, screenshot ) {
+            return { filename: resp.filename, strippedVsav: strippedVsav, screenshot: screenshot } ;
+        } ) ;
+
+    } ).done( function( files ) {
+
+        // check if the prepare failed
+        if ( ! files ) {
             removeLoadingSpinner() ;
             return ;
         }
 
         // save the prepared files
-        gVsavData = [ resp.filename, atob(resp.stripped_vsav) ] ;
+        gVsavData = [ files.filename, files.strippedVsav ] ;
         $gVsavContainer.find( ".remove" ).show() ;
-        if ( resp.screenshot ) {
-            gScreenshotData = [ "auto-generated.jpg", atob(resp.screenshot) ] ;
-            setScreenshotPreview( "data:image/png;base64,"+resp.screenshot, true ) ;
+        if ( files.screenshot ) {
+            gScreenshotData = [ "auto-generated.jpg", files.screenshot ] ;
+            setScreenshotPreview( files.screenshot, true ) ;
         } else {
             showMsgDialog( "Screenshot error",
                 "<p> <img src='" + gImagesBaseUrl+"/vassal-screenshot-hint.png" + "' style='height:12em;float:left;margin-right:1em;'>" +
@@ -419,6 +400,10 @@ function prepareUploadFiles( vsavFilename, vsavData )
 
 function setScreenshotPreview( imageData, isPreviewImage )
 {
+    // NOTE: The image can be specified as a URL, or a Blob.
+    if ( imageData instanceof Blob )
+        imageData = URL.createObjectURL( imageData ) ;
+
     // check if we should clear the current image preview
     if ( ! imageData ) {
         // yup - make it so
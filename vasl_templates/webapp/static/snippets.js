@@ -222,7 +222,7 @@ function make_snippet( $btn, params, extra_params, show_date_warnings )
     function set_vo_note( vo_type ) {
         var data = $btn.parent().parent().data( "sortable2-data" ) ;
         params.VO_NAME = data.vo_entry.name ;
-        if ( data.vo_note.substr( 0, 7 ) === "http://" ) {
+        if ( typeof data.vo_note === "string" ) {
             // the vehicle/ordnance note is an image - just include it directly
             params.VO_NOTE_HTML = '<img src="' + data.vo_note + '">' ;
             // FUDGE! People are asking to be able to load Chapter H images from an online server.
@@ -249,7 +249,7 @@ function make_snippet( $btn, params, extra_params, show_date_warnings )
                 params.VO_NOTE_HTML = '<img src="' + data.vo_note_image_url + '">' ;
             } else {
                 // insert the raw HTML into the snippet
-                params.VO_NOTE_HTML = data.vo_note ;
+                params.VO_NOTE_HTML = get_vo_note_content( data.vo_note ) ;
             }
         }
         snippet_save_name = data.vo_entry.name ;
@@ -570,7 +570,7 @@ function get_vo_note_key( vo_entry )
     return key ;
 }
 
-function get_vo_note( vo_type, nat, key )
+function get_vo_note( vo_type, nat, key, check_only )
 {
     if ( ! key )
         return null ;
@@ -592,12 +592,68 @@ function get_vo_note( vo_type, nat, key )
 
     // check if we have an image or HTML note
     var vo_note = gVehicleOrdnanceNotes[ vo_type ][ nat ][ key ] ;
-    if ( vo_note.content !== undefined )
-        return vo_note.content ;
+    if ( vo_note.html ) {
+        // NOTE: The content of HTML notes is not returned with the notes index, we load it on demand.
+        // We start loading it in the background as soon as the note is used (e.g. when a vehicle/ordnance
+        // is added to the OB), and return the note itself, so that the content can be retrieved later
+        // (via get_vo_note_content()), when a snippet is generated.
+        if ( check_only )
+            return true ;
+        if ( vo_note.content === undefined && ! vo_note.contentUrl ) {
+            vo_note.contentUrl = make_app_url( "/" + vo_type + "/" + nat + "/note/" + key + "?f=raw", false ) ;
+            load_vo_note_content( vo_note, true ) ;
+        }
+        return vo_note ;
+    }
     else
         return make_app_url( "/" + vo_type + "/" + nat + "/note/" + key, true ) ;
 }
 
+function get_vo_note_content( vo_note )
+{
+    // get the content for an HTML vehicle/ordnance note
+    // NOTE: The content will normally have already been loaded in the background (see get_vo_note()),
+    // but if the user generates a snippet before that has finished, we have no choice but to wait for it,
+    // since snippet generation is synchronous.
+    // NOTE: If the background load is still in progress, we abort it, rather than have 2 requests
+    // for the same content in flight.
+    if ( vo_note.content === undefined ) {
+        if ( vo_note.contentXhr ) {
+            vo_note.contentXhr.abort() ;
+            delete vo_note.contentXhr ;
+        }
+        load_vo_note_content( vo_note, false ) ;
+    }
+    return vo_note.content ;
+}
+
+function load_vo_note_content( vo_note, async )
+{
+    // load the content for an HTML vehicle/ordnance note
+    // NOTE: We remember background loads while they are in progress, so that we don't start another one.
+    if ( async && vo_note.contentXhr )
+        return ;
+    var xhr = $.ajax( {
+        url: vo_note.contentUrl,
+        dataType: "text",
+        async: async,
+        success: function( resp ) { vo_note.content = resp ; },
+        error: function( xhr, status, errorMsg ) {
+            // NOTE: We only report errors if we're loading the content for a snippet (background loads
+            // will be retried when the content is needed).
+            if ( ! async ) {
+                showErrorMsg( "Can't get the Chapter H note:<div class='pre'>" + escapeHTML(errorMsg) + "</div>" ) ;
+            }
+        },
+        complete: function() {
+            if ( async && vo_note.contentXhr === xhr )
+                delete vo_note.contentXhr ;
+        }
+    } ) ;
+    if ( async )
+        vo_note.contentXhr = xhr ;
+}
+
 function get_ma_notes_keys( nat, vo_entries, vo_type )
 {
     function translate_kfw_key( vo_entry, notes_index, regex, extn_id ) {
@@ -386,6 +386,50 @@ function makeBulletListMsg( caption, items, li_class )
 
 // --------------------------------------------------------------------
 
+function runJob( kind, data, $pleaseWait )
+{
+    // NOTE: Long-running operations are run as jobs on the server, and we poll for the result
+    // (rather than keeping a request open). The returned promise behaves like $.ajax() i.e. done()
+    // gets called with the handler's response, and fail() with ( xhr, status, errorMsg ).
+    // NOTE: If the job itself failed (i.e. the handler crashed, rather than returned an error response),
+    // there is no xhr, and errorMsg is the error reported by the server.
+    var deferred = $.Deferred() ;
+    var origMsg = $pleaseWait ? $pleaseWait.find( ".message .content" ).text() : null ;
+    function checkJob( jobId ) {
+        $.getJSON( gGetJobStatusUrl.replace( "ID", jobId ) ).done( function( resp ) {
+            if ( resp.status === "completed" ) {
+                deferred.resolve( resp.result ) ;
+                return ;
+            }
+            if ( resp.status === "failed" ) {
+                deferred.reject( null, "error", resp.result ? resp.result.error : "The job failed." ) ;
+                return ;
+            }
+            if ( $pleaseWait )
+                $pleaseWait.find( ".message .content" ).text( resp.progress || origMsg ) ;
+            setTimeout( function() { checkJob( jobId ) ; }, 500 ) ;
+        } ).fail( function( xhr, status, errorMsg ) {
+            deferred.reject( xhr, status, errorMsg ) ;
+        } ) ;
+    }
+    // NOTE: Requests that upload files are sent as multipart/form-data (see makeMultipartData()).
+    var isMultipart = data instanceof FormData ;
+    $.ajax( {
+        url: gSubmitJobUrl.replace( "KIND", kind ),
+        type: "POST",
+        data: isMultipart ? data : JSON.stringify( data ),
+        contentType: isMultipart ? false : "application/json",
+        processData: ! isMultipart,
+    } ).done( function( resp ) {
+        checkJob( resp.jobId ) ;
+    } ).fail( function( xhr, status, errorMsg ) {
+        deferred.reject( xhr, status, errorMsg ) ;
+    } ) ;
+    return deferred.promise() ;
+}
+
+// --------------------------------------------------------------------
+
 function init_select2( $sel, width, search_box, format )
 {
     // initialize the select2 droplist
@@ -629,6 +673,61 @@ function makeBlob( data, mimeType )
     } ) ;
 }
 
+function makeMultipartData( params, files )
+{
+    // create a multipart/form-data request to upload files
+    // NOTE: The server expects the other parameters to be JSON-encoded in a "params" field.
+    // Each file is specified as [ key, Blob, filename ].
+    var formData = new FormData() ;
+    formData.append( "params", JSON.stringify( params ) ) ;
+    files.forEach( function( file ) {
+        formData.append( file[0], file[1], file[2] ) ;
+    } ) ;
+    return formData ;
+}
+
+function getBlob( url )
+{
+    // download a file as a Blob
+    // NOTE: The returned promise behaves like $.ajax() i.e. done() gets called with the Blob,
+    // and fail() with ( xhr, status, errorMsg ).
+    var deferred = $.Deferred() ;
+    var xhr = new XMLHttpRequest() ;
+    xhr.open( "GET", url ) ;
+    xhr.responseType = "blob" ;
+    xhr.onload = function() {
+        if ( xhr.status === 200 )
+            deferred.resolve( xhr.response ) ;
+        else
+            deferred.reject( xhr, "error", xhr.statusText ) ;
+    } ;
+    xhr.onerror = function() {
+        deferred.reject( xhr, "error", "Can't download the file." ) ;
+    } ;
+    xhr.send() ;
+    return deferred.promise() ;
+}
+
+function readBlobAsBase64( blob, onLoad )
+{
+    // read a Blob as base64-encoded data
+    var fileReader = new FileReader() ;
+    fileReader.onload = function() {
+        onLoad( removeBase64Prefix( fileReader.result ) ) ;
+    } ;
+    fileReader.readAsDataURL( blob ) ;
+}
+
+function downloadUrl( url, fname )
+{
+    // download a file the server has made available
+    // NOTE: We use a link with a "download" attribute, so that the browser doesn't navigate away from the page.
+    var $link = $( "<a>" ).attr( { href: url, download: fname } ).css( "display", "none" ) ;
+    $( "body" ).append( $link ) ;
+    $link[0].click() ;
+    $link.remove() ;
+}
+
 function isIE()
 {
     // check if we're running in IE :-/
@@ -22,21 +22,15 @@ function _do_update_vsav( vsav_data, fname )
     var snippets = _generate_snippets() ;
 
     // send a request to update the VSAV
-    var data = {
+    var params = {
         filename: fname,
-        vsav_data: vsav_data,
         players: [ get_player_nat(1), get_player_nat(2) ],
         testMode: !! getUrlParam( "store_msgs" ),
         snippets: snippets
     } ;
-    $.ajax( {
-        url: gUpdateVsavUrl,
-        type: "POST",
-        data: JSON.stringify( data ),
-        contentType: "application/json",
-    } ).done( function( resp ) {
+    runJob( "update-vsav", _make_vsav_request( params, vsav_data ), $pleaseWait ).done( function( resp ) {
         $pleaseWait.dialog( "close" ) ;
-        data = _check_vassal_shim_response( resp, "Can't update the VASL scenario." ) ;
+        var data = _check_vassal_shim_response( resp, "Can't update the VASL scenario." ) ;
         if ( ! data )
             return ;
         // check if anything was changed
@@ -58,10 +52,23 @@ function _do_update_vsav( vsav_data, fname )
             // FOR TESTING PORPOISES! We can't control a file download from Selenium (since
             // the browser will use native controls), so we store the result in a <textarea>
             // and the test suite will collect it from there).
-            $("#_vsav-persistence_").val( data.vsav_data ) ;
+            if ( ! data.vsav_url ) {
+                $("#_vsav-persistence_").val( data.vsav_data ) ;
+                return ;
+            }
+            getBlob( data.vsav_url ).done( function( blob ) {
+                readBlobAsBase64( blob, function( vsav_data ) {
+                    $("#_vsav-persistence_").val( vsav_data ) ;
+                } ) ;
+            } ).fail( function( xhr, status, errorMsg ) {
+                $("#_vsav-persistence_").val( "ERROR: Can't download the updated VSAV: " + errorMsg ) ;
+            } ) ;
             return ;
         }
-        download( atob(data.vsav_data), data.filename, "application/octet-stream" ) ;
+        if ( data.vsav_url )
+            downloadUrl( data.vsav_url, data.filename ) ;
+        else
+            download( atob(data.vsav_data), data.filename, "application/octet-stream" ) ;
     } ).fail( function( xhr, status, errorMsg ) {
         $pleaseWait.dialog( "close" ) ;
         showErrorMsg( "Can't update the VASL scenario:<div class='pre'>" + escapeHTML(errorMsg) + "</div>" ) ;
@@ -329,15 +336,10 @@ function _do_analyze_vsav( vsav_data, fname )
     var $pleaseWait = showPleaseWaitDialog( "Analyzing the VASL scenario..." ) ;
 
     // send a request to analyze the VSAV
-    var data = { filename: fname, vsav_data: vsav_data } ;
-    $.ajax( {
-        url: gAnalyzeVsavUrl,
-        type: "POST",
-        data: JSON.stringify( data ),
-        contentType: "application/json",
-    } ).done( function( resp ) {
+    var params = { filename: fname } ;
+    runJob( "analyze-vsav", _make_vsav_request( params, vsav_data ), $pleaseWait ).done( function( resp ) {
         $pleaseWait.dialog( "close" ) ;
-        data = _check_vassal_shim_response( resp, "Can't analyze the VASL scenario." ) ;
+        var data = _check_vassal_shim_response( resp, "Can't analyze the VASL scenario." ) ;
         if ( ! data )
             return ;
         _create_vo_entries_from_analysis( data ) ;
@@ -468,7 +470,7 @@ function _load_and_process_vsav( handler )
         var $elem = $( "#_vsav-persistence_" ) ;
         var vsav_data = $elem.val() ;
         $elem.val( "" ) ; // nb: let the test suite know we've received the data
-        handler( vsav_data, "test.vsav" ) ;
+        handler( makeBlob( atob( vsav_data ) ), "test.vsav" ) ;
         return ;
     }
 
@@ -489,15 +491,23 @@ function _load_and_process_vsav( handler )
 
 function on_load_vsav_file_selected()
 {
-    // read the selected file
-    var fileReader = new FileReader() ;
+    // process the selected file
+    // NOTE: We upload the file as-is, so there's no need to read it in.
     var file = $("#load-vsav").prop( "files" )[0] ;
-    fileReader.onload = function() {
-        vsav_data = removeBase64Prefix( fileReader.result ) ;
-        gLoadVsavHandler( vsav_data, file.name ) ;
-        gLoadVsavHandler = null ;
-    } ;
-    fileReader.readAsDataURL( file ) ;
+    gLoadVsavHandler( file, file.name ) ;
+    gLoadVsavHandler = null ;
+}
+
+function _make_vsav_request( params, vsav_data )
+{
+    // prepare a request that uploads a VSAV file
+    // NOTE: If we have the file itself, we upload it as multipart/form-data. The PyQt wrapper gives us
+    // the file data base64-encoded, so we send that in a JSON request.
+    if ( typeof vsav_data === "string" ) {
+        params.vsav_data = vsav_data ;
+        return params ;
+    }
+    return makeMultipartData( params, [ [ "vsav_data", vsav_data, params.filename ] ] ) ;
 }
 
 // --------------------------------------------------------------------
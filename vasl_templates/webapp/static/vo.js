@@ -270,11 +270,11 @@ function do_add_vo( vo_type, player_no, vo_entry, vo_image_id, elite, custom_cap
     } ) ;
 }
 
-function make_vo_note_image_url( vo_type, nat, key )
+function make_vo_note_image_url( vo_type, nat, key, check_only )
 {
     // generate the URL to get a vehicle/ordnance note image
     var url = null ;
-    var vo_note = get_vo_note( vo_type, nat, key ) ;
+    var vo_note = get_vo_note( vo_type, nat, key, check_only ) ;
     if ( vo_note ) {
         var is_landing_craft = key ? key.substring( 0, 3 ) === "LC " : null ;
         if ( is_landing_craft )
@@ -291,7 +291,7 @@ function make_vo_note_image_url( vo_type, nat, key )
         else
             nat_type = gTemplatePack.nationalities[ nat ].type ;
         if ( [ "allied-minor", "axis-minor" ].indexOf( nat_type ) !== -1 ) {
-            vo_note = get_vo_note( vo_type, nat_type, key ) ;
+            vo_note = get_vo_note( vo_type, nat_type, key, check_only ) ;
             if ( vo_note )
                 url = make_app_url( "/" + vo_type + "/" + nat_type + "/note/" + key, true ) ;
         }
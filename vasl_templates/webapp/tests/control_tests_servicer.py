@@ -158,7 +158,15 @@ class ControlTestsServicer( BaseControlTestsServicer ): #pylint: disable=too-man
         self.setAppConfigVal( SetAppConfigValRequest( key="DISABLE_LFA_HOTNESS_FADEIN", boolVal=True ), ctx )
         self.deleteAppConfigVal( DeleteAppConfigValRequest( key="ASL_RULEBOOK2_BASE_URL" ), ctx )
         self.deleteAppConfigVal( DeleteAppConfigValRequest( key="ALTERNATE_WEBAPP_BASE_URL" ), ctx )
+        self.deleteAppConfigVal( DeleteAppConfigValRequest( key="VSAV_ANALYZER" ), ctx )
+        self.deleteAppConfigVal( DeleteAppConfigValRequest( key="VLOG_ANALYZER" ), ctx )
+        self.deleteAppConfigVal( DeleteAppConfigValRequest( key="DISABLE_INCREMENTAL_VSAV_UPDATE" ), ctx )
         self.setAppConfigVal( SetAppConfigValRequest( key="VO_NOTES_IMAGE_CACHE_DIR", strVal="disabled" ), ctx )
+        self.setAppConfigVal( SetAppConfigValRequest( key="VASL_MOD_CACHE_DIR", strVal="disabled" ), ctx )
+        self.setAppConfigVal( SetAppConfigValRequest( key="COMPILED_VO_LISTINGS_DIR", strVal="disabled" ), ctx )
+        self.setAppConfigVal( SetAppConfigValRequest( key="CHAPTER_H_INDEX_CACHE_DIR", strVal="disabled" ), ctx )
+        self.setAppConfigVal( SetAppConfigValRequest( key="SNIPPET_IMAGE_CACHE_DIR", strVal="disabled" ), ctx )
+        self.setAppConfigVal( SetAppConfigValRequest( key="ANALYSIS_CACHE_DIR", strVal="disabled" ), ctx )
         # NOTE: The webapp has been reconfigured, but the client must reloaed the home page
         # with "?force-reinit=1", to force it to re-initialize with the new settings.
 
@@ -4,12 +4,17 @@ import os
 import json
 import re
 import shutil
+import tempfile
+import zipfile
+import logging
 import urllib.request
 
 import pytest
 
 from vasl_templates.webapp.vassal import SUPPORTED_VASSAL_VERSIONS
-from vasl_templates.webapp.vasl_mod import get_vo_gpids, SUPPORTED_VASL_MOD_VERSIONS
+from vasl_templates.webapp import vasl_mod as webapp_vasl_mod
+from vasl_templates.webapp.vasl_mod import VaslMod, get_vo_gpids, SUPPORTED_VASL_MOD_VERSIONS
+from vasl_templates.webapp.config.constants import DATA_DIR
 from vasl_templates.webapp.utils import compare_version_strings
 from vasl_templates.webapp.tests import pytest_options
 from vasl_templates.webapp.tests.utils import init_webapp, select_tab, find_child, find_children
@@ -209,3 +214,48 @@ def test_compare_version_strings():
         assert compare_version_strings( vasl_version, vasl_version ) == 0
         if i < len(SUPPORTED_VASL_MOD_VERSIONS)-1:
             assert compare_version_strings( vasl_version, SUPPORTED_VASL_MOD_VERSIONS[i+1] ) < 0
+
+# ---------------------------------------------------------------------
+
+def test_piece_index_cache( monkeypatch, caplog ):
+    """Test caching the piece index."""
+
+    # initialize
+    # NOTE: We create a minimal VASL module, with a piece that has no images, so that warnings get issued.
+    build_info = '<VASSAL.launch.BasicModule version="6.6.4">' \
+        '<VASSAL.build.widget.PieceSlot gpid="11340" entryName=" M8 AC " height="60">piece;;;am/M8.gif;M8' \
+        '</VASSAL.build.widget.PieceSlot>' \
+        '<VASSAL.build.widget.PieceSlot gpid="11342" entryName="M20 AUV" height="60">piece;;;;M20' \
+        '</VASSAL.build.widget.PieceSlot>' \
+        '</VASSAL.launch.BasicModule>'
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vmod_fname = os.path.join( temp_dir, "test.vmod" )
+        with zipfile.ZipFile( vmod_fname, "w" ) as zip_file:
+            zip_file.writestr( "buildFile", build_info )
+        cache_dname = os.path.join( temp_dir, "cache" )
+        monkeypatch.setattr( webapp_vasl_mod, "_piece_index_cache_dname", cache_dname )
+
+        def load_vasl_mod(): #pylint: disable=missing-docstring
+            caplog.clear()
+            vasl_mod = VaslMod( vmod_fname, DATA_DIR, None )
+            warnings = [
+                rec.getMessage() for rec in caplog.records
+                if rec.name == "vasl_mod" and rec.levelno == logging.WARNING
+            ]
+            return vasl_mod, warnings
+
+        # load the VASL module
+        caplog.set_level( logging.INFO, logger="vasl_mod" )
+        vasl_mod, warnings = load_vasl_mod()
+        assert vasl_mod._pieces[ "11340" ][ "name" ] == "M8 AC" #pylint: disable=protected-access
+        assert "Couldn't find any image paths for gpid=11342." in warnings
+        assert any( w.startswith( "Couldn't find pieces: " ) for w in warnings )
+        assert len( os.listdir( cache_dname ) ) == 1
+
+        # load the VASL module again (the piece index should come from the cache)
+        def parse_zip_file( *args ): #pylint: disable=missing-docstring,unused-argument
+            assert False, "The piece index cache wasn't used."
+        monkeypatch.setattr( VaslMod, "_parse_zip_file", parse_zip_file )
+        vasl_mod2, warnings2 = load_vasl_mod()
+        assert vasl_mod2._pieces == vasl_mod._pieces #pylint: disable=protected-access
+        assert warnings2 == warnings
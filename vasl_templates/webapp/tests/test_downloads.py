@@ -0,0 +1,207 @@
+"""Test downloading files."""
+
+import os
+import threading
+import json
+import gzip
+import http.server
+import uuid
+import time
+import datetime
+
+from vasl_templates.webapp import app
+from vasl_templates.webapp.downloads import DownloadedFile, _registry
+
+# ---------------------------------------------------------------------
+
+def test_downloads():
+    """Test downloading files."""
+
+    # start a local HTTP server
+    responses = []
+    class RequestHandler( http.server.BaseHTTPRequestHandler ): #pylint: disable=missing-docstring
+        def do_GET( self ): #pylint: disable=invalid-name,missing-docstring
+            status, headers, body = responses.pop( 0 )
+            if status == 200 and self.headers.get( "If-None-Match" ) == headers.get( "ETag" ):
+                status, body = 304, b""
+            self.send_response( status )
+            for key, val in headers.items():
+                self.send_header( key, val )
+            self.send_header( "Content-Length", str( len(body) ) )
+            self.end_headers()
+            self.wfile.write( body )
+        def log_message( self, *args ): #pylint: disable=arguments-differ
+            pass
+    server = http.server.HTTPServer( ( "localhost", 0 ), RequestHandler )
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+
+    # create a DownloadedFile
+    class Snapshot: #pylint: disable=missing-docstring
+        def __init__( self ):
+            self.data = None
+    def on_data( snapshot, data, logger ): #pylint: disable=unused-argument,missing-docstring
+        snapshot.data = data
+    key = "TEST" + uuid.uuid4().hex[:8].upper()
+    url = "http://localhost:{}/test.json".format( server.server_address[1] )
+    df = DownloadedFile( key, 1, key.lower()+".json", url, on_data, snapshot_class=Snapshot )
+    prev_config = dict( app.config )
+    app.config[ "DOWNLOAD_RETRY_DELAY" ] = 60
+
+    try:
+
+        # download a gzip'ed file
+        data = { "hello": "world" }
+        responses.append( ( 200,
+            { "Content-Encoding": "gzip", "ETag": '"etag-1"' },
+            gzip.compress( json.dumps( data ).encode( "utf-8" ) )
+        ) )
+        df._check_for_update() #pylint: disable=protected-access
+        assert df.snapshot.data == data
+        with open( df.cache_fname, "r", encoding="utf-8" ) as fp:
+            assert json.load( fp ) == data
+        status = df.get_status()
+        assert status["size"] == len( json.dumps( data ) )
+        assert status["error"] is None and status["failures"] == 0
+        assert status["nextCheck"] > status["lastSuccess"] + 3000
+
+        # force a refresh (the file hasn't changed)
+        df.refresh_now()
+        assert df.get_status()["nextCheck"] is None
+        responses.append( ( 200, { "ETag": '"etag-1"' }, b"" ) )
+        df._check_for_update() #pylint: disable=protected-access
+        assert df.snapshot.data == data
+        assert not responses
+
+        # force a refresh (the download fails)
+        df.refresh_now()
+        responses.append( ( 500, {}, b"" ) )
+        df._check_for_update() #pylint: disable=protected-access
+        status = df.get_status()
+        assert status["error"] and status["failures"] == 1
+        assert status["nextCheck"] - status["lastAttempt"] <= 60 + 1
+        assert df.snapshot.data == data # nb: we keep the old data
+
+        # check that the retry delay backs off
+        responses.append( ( 500, {}, b"" ) )
+        df._check_for_update() #pylint: disable=protected-access
+        status = df.get_status()
+        assert status["failures"] == 2
+        assert 60 - 1 <= status["nextCheck"] - status["lastAttempt"] <= 120 + 1
+
+        # download an invalid file
+        responses.append( ( 200, { "ETag": '"etag-2"' }, b"this is not JSON" ) )
+        df._check_for_update() #pylint: disable=protected-access
+        assert df.get_status()["failures"] == 3
+        assert df.snapshot.data == data
+        with open( df.cache_fname, "r", encoding="utf-8" ) as fp:
+            assert json.load( fp ) == data # nb: the cached file doesn't get overwritten
+
+        # download a new version of the file
+        data = { "hello": "again" }
+        responses.append( ( 200, { "ETag": '"etag-3"' }, json.dumps( data ).encode( "utf-8" ) ) )
+        df._check_for_update() #pylint: disable=protected-access
+        assert df.snapshot.data == data
+        status = df.get_status()
+        assert status["error"] is None and status["failures"] == 0
+
+    finally:
+        server.shutdown()
+        _registry.discard( df )
+        app.config.clear()
+        app.config.update( prev_config )
+        if os.path.isfile( df.cache_fname ):
+            os.unlink( df.cache_fname )
+
+# ---------------------------------------------------------------------
+
+def test_download_journal():
+    """Test keeping local changes to a downloaded file in a journal."""
+
+    # initialize
+    class Snapshot: #pylint: disable=missing-docstring
+        def __init__( self ):
+            self.items = None
+    def on_data( snapshot, data, logger ): #pylint: disable=unused-argument,missing-docstring
+        snapshot.items = data["items"]
+    def on_journal_entry( data, entry ): #pylint: disable=missing-docstring
+        data["items"].append( entry )
+    key = "TEST" + uuid.uuid4().hex[:8].upper()
+    dfs = []
+    def make_downloaded_file(): #pylint: disable=missing-docstring
+        # NOTE: Creating a new instance is like restarting the program (the cached file and journal get reloaded).
+        dfs.append( DownloadedFile( key, 1, key.lower()+".json", "http://localhost:1/unused", on_data,
+            snapshot_class=Snapshot, on_journal_entry=on_journal_entry
+        ) )
+        return dfs[-1]
+    def add_item( df, item ): #pylint: disable=missing-docstring
+        def update( snapshot ): #pylint: disable=missing-docstring
+            df.append_to_journal( item )
+            snapshot.items = snapshot.items + [ item ]
+        df.update_snapshot( update )
+    def make_timestamp( ts ): #pylint: disable=missing-docstring
+        return datetime.datetime.fromtimestamp( ts, datetime.timezone.utc ).strftime( "%Y-%m-%d %H:%M:%S +00:00" )
+    def download( df, generated_at, items ): #pylint: disable=missing-docstring
+        data = json.dumps( { "_generatedAt_": generated_at, "items": items } )
+        assert df._set_data( data, fresh_download=True ) #pylint: disable=protected-access
+        with open( df.cache_fname, "w", encoding="utf-8" ) as fp:
+            fp.write( data )
+
+    # create a cached copy of the file
+    df = make_downloaded_file()
+    with open( df.cache_fname, "w", encoding="utf-8" ) as fp:
+        json.dump( { "_generatedAt_": make_timestamp( time.time() - 60 ), "items": [ "a" ] }, fp )
+
+    try:
+
+        # load the cached file, and make some local changes
+        # NOTE: The timestamps in downloaded files only have a resolution of 1 second, so we wait between changes.
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a" ]
+        add_item( df, "b" )
+        with open( df.journal_fname, "r", encoding="utf-8" ) as fp:
+            b_time = json.loads( fp.readline() )["time"]
+        time.sleep( 1.1 )
+        add_item( df, "c" )
+        assert df.snapshot.items == [ "a", "b", "c" ]
+
+        # reload the cached file (the local changes should get replayed)
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a", "b", "c" ]
+
+        # simulate a crash while writing to the journal (the partial line should be ignored)
+        with open( df.journal_fname, "a", encoding="utf-8" ) as fp:
+            fp.write( '{"time": 1234, "entry": "x' )
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a", "b", "c" ]
+        add_item( df, "d" )
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a", "b", "c", "d" ]
+
+        # download a fresh copy of the file that includes some of the local changes
+        # NOTE: Entries made after the file was generated are kept, and replayed.
+        download( df, make_timestamp( int( b_time ) + 1 ), [ "a", "b" ] )
+        assert df.snapshot.items == [ "a", "b", "c", "d" ]
+        with open( df.journal_fname, "r", encoding="utf-8" ) as fp:
+            assert [ json.loads( line )["entry"] for line in fp ] == [ "c", "d" ]
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a", "b", "c", "d" ]
+
+        # download a fresh copy of the file that includes all the local changes
+        download( df, make_timestamp( time.time() + 1 ), [ "a", "b", "c", "d", "e" ] )
+        assert df.snapshot.items == [ "a", "b", "c", "d", "e" ]
+        assert not os.path.isfile( df.journal_fname )
+        df = make_downloaded_file()
+        assert df.snapshot.items == [ "a", "b", "c", "d", "e" ]
+
+        # download a fresh copy of the file that doesn't have a valid timestamp (all entries should be dropped)
+        add_item( df, "f" )
+        download( df, "(just now)", [ "x" ] )
+        assert df.snapshot.items == [ "x" ]
+        assert not os.path.isfile( df.journal_fname )
+
+    finally:
+        for df2 in dfs:
+            _registry.discard( df2 )
+        for fname in ( df.cache_fname, df.journal_fname ):
+            if os.path.isfile( fname ):
+                os.unlink( fname )
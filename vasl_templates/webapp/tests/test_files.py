@@ -2,12 +2,15 @@
 
 import os
 import re
+import time
 import urllib.request
 
 import pytest
 import werkzeug.exceptions
 
-from vasl_templates.webapp.files import FileServer
+from vasl_templates.webapp import app
+from vasl_templates.webapp.files import FileServer, add_temp_download, _temp_downloads
+from vasl_templates.webapp.utils import TempFile
 from vasl_templates.webapp.tests.utils import init_webapp, find_child, wait_for_clipboard
 
 # ---------------------------------------------------------------------
@@ -75,6 +78,51 @@ def _get_response_data( resp ):
 
 # ---------------------------------------------------------------------
 
+def test_temp_downloads():
+    """Test making generated files available for download."""
+
+    # initialize
+    prev_config = dict( app.config )
+    app.config[ "TEMP_DOWNLOADS_TTL" ] = 1
+    client = app.test_client()
+
+    try:
+
+        # add some downloads
+        with app.test_request_context():
+            url = add_temp_download( "hello.txt", data=b"Hello, world!", mimetype="text/plain" )
+            with TempFile() as temp_file:
+                temp_file.write( b"\x00\x01\x02" )
+                temp_file.close( delete=False )
+                url2 = add_temp_download( "test.bin", fname=temp_file.name )
+        # NOTE: The downloads are copies, so they're still available after the original file has gone.
+
+        # download the files (more than once)
+        for _ in range( 2 ):
+            resp = client.get( url )
+            assert resp.status_code == 200
+            assert resp.data == b"Hello, world!"
+            assert resp.mimetype == "text/plain"
+            assert resp.headers[ "Content-Disposition" ] == "attachment; filename=hello.txt"
+            resp = client.get( url2 )
+            assert resp.status_code == 200
+            assert resp.data == b"\x00\x01\x02"
+            assert resp.headers[ "Content-Disposition" ] == "attachment; filename=test.bin"
+
+        # wait for the downloads to expire
+        fnames = [ _temp_downloads[ u.split( "/" )[-1] ][0] for u in ( url, url2 ) ]
+        time.sleep( 1.1 )
+        assert client.get( url ).status_code == 404
+        assert client.get( url2 ).status_code == 404
+        assert not any( os.path.isfile( fname ) for fname in fnames )
+        assert client.get( "/temp-download/unknown" ).status_code == 404
+
+    finally:
+        app.config.clear()
+        app.config.update( prev_config )
+
+# ---------------------------------------------------------------------
+
 def test_local_user_files( webapp, webdriver ):
     """Test serving user files from the local file system."""
 
@@ -0,0 +1,120 @@
+"""Test running background jobs."""
+
+import threading
+
+from flask import request, jsonify
+
+from vasl_templates.webapp import app
+from vasl_templates.webapp import jobs as webapp_jobs
+from vasl_templates.webapp.jobs import set_job_progress, shutdown_jobs
+from vasl_templates.webapp.tests.utils import wait_for
+
+# ---------------------------------------------------------------------
+
+def test_jobs( monkeypatch ):
+    """Test running background jobs."""
+
+    # initialize
+    # NOTE: We install a stub request handler, that runs until we tell it to finish.
+    events = {}
+    def handler(): #pylint: disable=missing-docstring
+        params = request.json
+        set_job_progress( "Working on {}...".format( params["id"] ) )
+        events[ params["id"] ] = threading.Event()
+        assert events[ params["id"] ].wait( 10 )
+        if params.get( "raise" ):
+            raise RuntimeError( "Something went wrong." )
+        if params.get( "status" ):
+            return "Bad request.", params["status"]
+        return jsonify( { "id": params["id"], "ok": True } )
+    monkeypatch.setitem( webapp_jobs._JOB_KINDS, "test", ( "_test_job_handler", 1 ) ) #pylint: disable=protected-access
+    monkeypatch.setitem( app.view_functions, "_test_job_handler", handler )
+    prev_config = dict( app.config )
+    client = app.test_client()
+
+    def submit_job( params ): #pylint: disable=missing-docstring
+        resp = client.post( "/jobs/test", json=params )
+        assert resp.status_code == 200
+        status = resp.get_json()
+        assert status["kind"] == "test" and status["status"] in ( "queued", "running" )
+        return status["jobId"]
+    def get_job_status( job_id ): #pylint: disable=missing-docstring
+        resp = client.get( "/jobs/" + job_id )
+        assert resp.status_code == 200
+        return resp.get_json()
+    def wait_for_job( job_id ): #pylint: disable=missing-docstring
+        return wait_for( 5, lambda: _is_job_finished( get_job_status( job_id ) ) )
+
+    try:
+
+        # run a job
+        job_id = submit_job( { "id": "job1" } )
+        wait_for( 5, lambda: "job1" in events )
+        status = get_job_status( job_id )
+        assert status["status"] == "running"
+        assert status["progress"] == "Working on job1..."
+        assert "result" not in status
+        events["job1"].set()
+        status = wait_for_job( job_id )
+        assert status["status"] == "completed"
+        assert status["result"] == { "id": "job1", "ok": True }
+        assert "progress" not in status
+        assert status["elapsed"] >= 0
+
+        # check the list of jobs
+        resp = client.get( "/jobs" )
+        assert resp.status_code == 200
+        statuses = { s["jobId"]: s for s in resp.get_json() }
+        assert statuses[ job_id ]["status"] == "completed"
+        assert "result" not in statuses[ job_id ]
+
+        # submit 2 jobs (only 1 should run at a time)
+        job_id2 = submit_job( { "id": "job2" } )
+        job_id3 = submit_job( { "id": "job3" } )
+        wait_for( 5, lambda: "job2" in events )
+        assert get_job_status( job_id2 )["status"] == "running"
+        assert get_job_status( job_id3 )["status"] == "queued"
+        events["job2"].set()
+        assert wait_for_job( job_id2 )["status"] == "completed"
+        wait_for( 5, lambda: "job3" in events )
+        assert get_job_status( job_id3 )["status"] == "running"
+        events["job3"].set()
+        assert wait_for_job( job_id3 )["status"] == "completed"
+
+        # run a job that fails
+        job_id = submit_job( { "id": "job4", "raise": True } )
+        wait_for( 5, lambda: "job4" in events )
+        events["job4"].set()
+        status = wait_for_job( job_id )
+        assert status["status"] == "failed"
+        assert status["result"] == { "error": "Something went wrong." }
+
+        # run a job that returns an error response
+        job_id = submit_job( { "id": "job5", "status": 400 } )
+        wait_for( 5, lambda: "job5" in events )
+        events["job5"].set()
+        status = wait_for_job( job_id )
+        assert status["status"] == "failed"
+        assert "400" in status["result"]["error"]
+
+        # check that the results of finished jobs get purged
+        app.config[ "JOB_RESULTS_TTL" ] = 0
+        assert client.get( "/jobs/" + job_id ).status_code == 404
+        assert not client.get( "/jobs" ).get_json()
+
+        # try to submit an unknown kind of job
+        assert client.post( "/jobs/unknown", json={} ).status_code == 404
+
+        # try to get the status of an unknown job
+        assert client.get( "/jobs/unknown" ).status_code == 404
+
+    finally:
+        for event in events.values():
+            event.set()
+        shutdown_jobs()
+        app.config.clear()
+        app.config.update( prev_config )
+
+def _is_job_finished( status ):
+    """Check if a job has finished."""
+    return status if status["status"] in ( "completed", "failed" ) else None
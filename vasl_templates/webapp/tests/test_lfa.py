@@ -1,8 +1,10 @@
 """ Test log file analysis. """
 
 import os
+import json
 import base64
 import csv
+import urllib.request
 
 from selenium.webdriver.support.ui import Select
 
@@ -605,6 +607,38 @@ def test_custom_labels( webapp, webdriver ):
 
 # ---------------------------------------------------------------------
 
+def test_vlog_analyzers( webapp, webdriver ):
+    """Check that the Python and VASSAL shim log file analyzers generate the same results."""
+
+    def do_test(): #pylint: disable=missing-docstring
+
+        # initialize
+        init_webapp( webapp, webdriver )
+
+        # analyze the test log files using each analyzer
+        dname = os.path.join( os.path.split(__file__)[0], "fixtures/analyze-vlog/" )
+        vlog_data = []
+        for fname in sorted( os.listdir( dname ) ):
+            with open( os.path.join( dname, fname ), "rb" ) as fp:
+                vlog_data.append( [ fname, base64.b64encode( fp.read() ).decode( "ascii" ) ] )
+        reports = []
+        for analyzer in ( "python", "java" ):
+            webapp.control_tests.set_app_config_val( "VLOG_ANALYZER", analyzer )
+            req = urllib.request.Request( webapp.url_for( "analyze_vlogs" ),
+                data = json.dumps( vlog_data ).encode( "utf-8" ),
+                headers = { "Content-Type": "application/json" }
+            )
+            with urllib.request.urlopen( req ) as resp:
+                report = json.load( resp )
+            assert "error" not in report
+            reports.append( report )
+        assert reports[0] == reports[1]
+
+    # run the test against all versions of VASSAL+VASL
+    run_vassal_tests( webapp, do_test )
+
+# ---------------------------------------------------------------------
+
 def _analyze_vlogs( fnames ):
     """Analyze log file(s)."""
 
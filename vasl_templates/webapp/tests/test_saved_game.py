@@ -0,0 +1,80 @@
+"""Test parsing saved games and log files in Python."""
+
+import os
+import collections
+import logging
+
+from vasl_templates.webapp import app
+from vasl_templates.webapp.lfa import _analyze_vlogs_python
+from vasl_templates.webapp.saved_game import analyze_logfile, analyze_scenario, DEFAULT_LFA_PATTERNS
+
+_FIXTURES_DIR = os.path.join( os.path.split(__file__)[0], "fixtures" )
+
+# ---------------------------------------------------------------------
+
+def test_analyze_logfile():
+    """Test analyzing log files."""
+
+    def do_test( fname, expected ): #pylint: disable=missing-docstring
+        analysis = analyze_logfile( os.path.join( _FIXTURES_DIR, "analyze-vlog", fname ) )
+        counts = collections.Counter( evt["type"] for evt in analysis["events"] )
+        assert counts == expected
+        return analysis
+
+    # analyze some log files
+    analysis = do_test( "full.vlog", { "diceEvent": 23, "turnTrackEvent": 3 } )
+    assert analysis["events"][0] == {
+        "type": "diceEvent", "player": "Alice", "rollType": "Other", "values": "5,4"
+    }
+    do_test( "4players.vlog", { "diceEvent": 35, "turnTrackEvent": 3 } )
+    do_test( "3d6.vlog", { "diceEvent": 8 } )
+    do_test( "custom-labels.vlog", { "diceEvent": 8, "customLabelEvent": 2, "turnTrackEvent": 2 } )
+    do_test( "hotness-report-1.vlog", { "diceEvent": 99 } )
+    do_test( "empty.vlog", {} )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def test_analyze_vlogs_parallel():
+    """Test analyzing multiple log files in parallel."""
+
+    # analyze the log files one at a time
+    fnames = [
+        os.path.join( _FIXTURES_DIR, "analyze-vlog", fname )
+        for fname in sorted( os.listdir( os.path.join( _FIXTURES_DIR, "analyze-vlog" ) ) )
+    ]
+    expected = [ analyze_logfile( fname ) for fname in fnames ]
+
+    # analyze them in parallel, and check that we get the same results (in the same order)
+    prev_config = dict( app.config )
+    try:
+        app.config[ "ANALYZE_VLOG_WORKERS" ] = 4
+        logger = logging.getLogger( "analyze_vlogs" )
+        assert _analyze_vlogs_python( fnames, DEFAULT_LFA_PATTERNS, logger ) == expected
+        # check that a log file that can't be analyzed is handled
+        results = _analyze_vlogs_python( [ fnames[0], "/unknown.vlog" ], DEFAULT_LFA_PATTERNS, logger )
+        assert results == [ expected[0], None ]
+    finally:
+        app.config.clear()
+        app.config.update( prev_config )
+
+# ---------------------------------------------------------------------
+
+def test_analyze_scenario():
+    """Test analyzing scenarios."""
+
+    def do_test( fname, expected_gpids, expected_pieces ): #pylint: disable=missing-docstring
+        report = analyze_scenario( os.path.join( _FIXTURES_DIR, "analyze-vsav", fname ) )
+        assert len( report ) == expected_gpids
+        assert sum( int( vals["count"] ) for vals in report.values() ) == expected_pieces
+        return report
+
+    # analyze some scenarios
+    report = do_test( "basic.vsav", 16, 22 )
+    assert report["687"] == { "name": "Komsomolets", "count": "2" }
+    assert report["212"] == { "name": "Foxhole", "count": "3" }
+    report = do_test( "landing-craft.vsav", 6, 6 )
+    assert report["413"] == { "name": "LCT(4) <7/43", "count": "1" }
+    do_test( "common-vo.vsav", 12, 12 )
+
+    # NOTE: HIP and concealed pieces should be ignored.
+    do_test( "hip-concealed.vsav", 0, 0 )
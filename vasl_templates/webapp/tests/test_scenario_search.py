@@ -1,8 +1,11 @@
 """" Test scenario search. """
 
 import os
+import json
 import base64
 import time
+import urllib.request
+import urllib.error
 
 import pytest
 from selenium.webdriver.common.action_chains import ActionChains
@@ -377,10 +380,10 @@ def test_roar_matching2( webapp, webdriver ):
     # initialize
     init_webapp( webapp, webdriver )
 
-    from vasl_templates.webapp.scenarios import _asa_scenarios, _match_roar_scenario
+    from vasl_templates.webapp.scenarios import _asa_scenarios, _match_roar_scenario, _match_roar_scenarios
     def do_test( scenario_name, expected ): #pylint: disable=missing-docstring
         scenarios = [
-            s for s in _asa_scenarios.index.values() #pylint: disable=no-member
+            s for s in _asa_scenarios.snapshot.index.values() #pylint: disable=no-member
             if s.get( "title" ) == scenario_name
         ]
         assert len(scenarios) == 1
@@ -389,22 +392,35 @@ def test_roar_matching2( webapp, webdriver ):
             expected = [ expected ]
         assert [ ( m["roar_id"], m["name"] ) for m in matches ] == expected
 
-    with _asa_scenarios:
+    # check for no match
+    do_test( "Full content scenario", [] )
 
-        # check for no match
-        do_test( "Full content scenario", [] )
+    # check for an exact match
+    do_test( "ROAR Exact Match", ("200","!! ROAR exact-match !!") )
 
-        # check for an exact match
-        do_test( "ROAR Exact Match", ("200","!! ROAR exact-match !!") )
+    # check for multiple matches, resolved by the scenario ID
+    do_test( "ROAR Exact Match 2", ("211","ROAR Exact Match 2") )
 
-        # check for multiple matches, resolved by the scenario ID
-        do_test( "ROAR Exact Match 2", ("211","ROAR Exact Match 2") )
+    # check for multiple matches
+    # NOTE: These should be sorted in descending order of number of playings.
+    do_test( "ROAR Multiple Matches", [
+        ("222","ROAR Multiple Matches"), ("220","ROAR Multiple Matches"), ("221","ROAR Multiple Matches")
+    ] )
 
-        # check for multiple matches
-        # NOTE: These should be sorted in descending order of number of playings.
-        do_test( "ROAR Multiple Matches", [
-            ("222","ROAR Multiple Matches"), ("220","ROAR Multiple Matches"), ("221","ROAR Multiple Matches")
-        ] )
+    # check for near-miss titles
+    def do_fuzzy_test( title, sc_id, expected ): #pylint: disable=missing-docstring
+        matches = _match_roar_scenario( { "title": title, "sc_id": sc_id } )
+        assert [ m["roar_id"] for m in matches ] == expected
+    do_fuzzy_test( "Fighting Withdrawl", "FW", ["100"] )
+    do_fuzzy_test( "Fighting Withdrawl", None, ["100"] )
+    do_fuzzy_test( "Fighting Withdrawl", "XYZ", [] ) # nb: the scenario ID doesn't match
+    do_fuzzy_test( "Another ROAR Scenarios", None, ["101"] )
+    do_fuzzy_test( "ROAR Exact Match 3", None, [] ) # nb: titles that differ by a number don't match
+    do_fuzzy_test( "Something else entirely", None, [] )
+
+    # check matching all the scenarios at once
+    scenarios = list( _asa_scenarios.snapshot.index.values() ) #pylint: disable=no-member
+    assert _match_roar_scenarios( scenarios ) == [ _match_roar_scenario( s ) for s in scenarios ]
 
 # ---------------------------------------------------------------------
 
@@ -701,6 +717,69 @@ def test_scenario_downloads( webapp, webdriver ):
 
 # ---------------------------------------------------------------------
 
+def test_server_side_search( webapp, webdriver ):
+    """Test searching for scenarios on the server."""
+
+    # initialize
+    init_webapp( webapp, webdriver )
+
+    def do_search( expected, expected_total=None, **kwargs ): #pylint: disable=missing-docstring
+        url = webapp.url_for( "search_scenarios", **kwargs )
+        with urllib.request.urlopen( url ) as resp:
+            results = json.load( resp )
+        assert [ r["scenario_id"] for r in results["scenarios"] ] == expected
+        assert results["total"] == ( len(expected) if expected_total is None else expected_total )
+
+    # search for scenarios
+    do_search( [ "1" ], q="full" )
+    do_search( [ "1" ], q="FCS-1" )
+    do_search( [ "1" ], q="fcs1" )
+    do_search( [ "3b", "1", "3a" ], q="scen" )
+    do_search( [], q="xyz" )
+
+    # check that exact matches are ranked higher than prefix matches
+    do_search( [ "6a", "6b" ], q="roar exact" )
+    do_search( [ "6a", "6b" ], q="exactmatch" )
+    do_search( [ "6b" ], q="exactmatch2" )
+
+    # check filtering and pagination
+    do_search( [ "5c", "5b" ], 3, theater="eto", page_size=2 )
+    do_search( [ "5a" ], 3, theater="eto", page_size=2, page=2 )
+    do_search( [ "1", "5a" ], date_from="1940-02", date_to="1945" )
+    do_search( [ "5a" ], q="oba", date_from="1940-02" )
+
+# ---------------------------------------------------------------------
+
+def test_scenario_index_etags( webapp, webdriver ):
+    """Test conditional requests for the scenario indexes."""
+
+    # initialize
+    init_webapp( webapp, webdriver )
+
+    for endpoint in ( "get_scenario_index", "get_roar_scenario_index" ):
+
+        # get the scenario index
+        url = webapp.url_for( endpoint )
+        with urllib.request.urlopen( url ) as resp:
+            etag = resp.headers[ "ETag" ]
+            assert json.load( resp )
+        assert etag
+
+        # check that we get a 304 if we already have the current version
+        req = urllib.request.Request( url, headers={ "If-None-Match": etag } )
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            with urllib.request.urlopen( req ):
+                pass
+        assert exc_info.value.code == 304
+
+        # check that we get the data if we have an old version
+        req = urllib.request.Request( url, headers={ "If-None-Match": '"xyz"' } )
+        with urllib.request.urlopen( req ) as resp:
+            assert resp.headers[ "ETag" ] == etag
+            assert json.load( resp )
+
+# ---------------------------------------------------------------------
+
 def _do_scenario_search( query, expected, webdriver ):
     """Do a scenario search."""
 
@@ -1,6 +1,10 @@
 """Test utility functions."""
 
-from vasl_templates.webapp.utils import friendly_fractions
+import os
+import tempfile
+import threading
+
+from vasl_templates.webapp.utils import LruCache, DiskLruCache, friendly_fractions
 
 # ---------------------------------------------------------------------
 
@@ -35,3 +39,95 @@ def test_friendly_fractions():
     do_test( 2.125, "2&frac14;" )
     do_test( 2.5, "2&frac12;" )
     do_test( 2.75, "2&frac34;" )
+
+# ---------------------------------------------------------------------
+
+def test_lru_cache():
+    """Test the LRU cache."""
+
+    # initialize
+    cache = LruCache( "test", 10 )
+
+    # add some entries
+    cache.put( "a", b"1234" )
+    cache.put( "b", b"5678" )
+    assert cache.get( "a" ) == b"1234"
+    assert cache.get( "b" ) == b"5678"
+    assert cache.get( "c" ) is None
+
+    # add another entry (that will force the least-recently used one out)
+    assert cache.get( "a" ) == b"1234"
+    cache.put( "c", b"90" * 2 )
+    assert cache.get( "b" ) is None
+    assert cache.get( "a" ) == b"1234"
+    assert cache.get( "c" ) == b"9090"
+
+    # try to add an entry that is too big
+    cache.put( "d", b"x" * 11 )
+    assert cache.get( "d" ) is None
+    assert cache.get( "a" ) == b"1234"
+
+    # check the stats
+    stats = cache.get_stats()
+    assert stats[ "entries" ] == 2 and stats[ "size" ] == 8
+    assert stats[ "hits" ] == 6 and stats[ "misses" ] == 3
+    assert stats[ "evictions" ] == 1
+    assert LruCache.get_all_stats()[ "test" ] == stats
+
+# ---------------------------------------------------------------------
+
+def test_disk_lru_cache():
+    """Test the on-disk LRU cache."""
+
+    with tempfile.TemporaryDirectory() as dname:
+
+        # add some entries
+        cache = DiskLruCache( "test-disk", dname, 10, extn=".dat" )
+        cache.put( "a", b"1234" )
+        cache.put( "b", b"5678" )
+        assert cache.get( "a" ) == b"1234"
+        assert cache.get( "b" ) == b"5678"
+        assert cache.get( "c" ) is None
+        assert sorted( os.listdir( dname ) ) == [ "a.dat", "b.dat" ]
+
+        # add another entry (that will force the least-recently used one out)
+        assert cache.get( "a" ) == b"1234"
+        cache.put( "c", b"90" * 2 )
+        assert cache.get( "b" ) is None
+        assert sorted( os.listdir( dname ) ) == [ "a.dat", "c.dat" ]
+
+        # check the stats
+        stats = cache.get_stats()
+        assert stats[ "entries" ] == 2 and stats[ "size" ] == 8
+        assert stats[ "hits" ] == 3 and stats[ "misses" ] == 2
+        assert stats[ "evictions" ] == 1
+
+        # check that the entries are still there after a restart
+        cache = DiskLruCache( "test-disk", dname, 10, extn=".dat" )
+        assert cache.get( "a" ) == b"1234"
+        assert cache.get( "c" ) == b"9090"
+
+        # check that a file that has disappeared is handled
+        os.unlink( os.path.join( dname, "a.dat" ) )
+        assert cache.get( "a" ) is None
+        assert cache.get_stats()[ "size" ] == 4
+
+        # hammer the cache from multiple threads (entries will be evicted while other threads are reading them)
+        def worker( thread_no ): #pylint: disable=missing-docstring
+            for i in range( 200 ):
+                key = "k{}".format( (thread_no + i) % 7 )
+                val = cache.get( key )
+                if val is None:
+                    cache.put( key, key.encode() * 2 )
+                else:
+                    assert val == key.encode() * 2
+        threads = [ threading.Thread( target=worker, args=(i,) ) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.get_stats()
+        fnames = os.listdir( dname )
+        assert stats[ "entries" ] == len( fnames )
+        assert stats[ "size" ] == sum( os.path.getsize( os.path.join( dname, f ) ) for f in fnames )
+        assert stats[ "size" ] <= 10
@@ -1,12 +1,18 @@
 """ Test VASSAL integration. """
 
 import os
+import io
 import re
 import json
 import base64
 import random
+import tempfile
+import urllib.request
 import typing.re #pylint: disable=import-error
 
+from vasl_templates.webapp import app
+from vasl_templates.webapp import vassal as webapp_vassal
+from vasl_templates.webapp import lfa as webapp_lfa
 from vasl_templates.webapp.vassal import VassalShim
 from vasl_templates.webapp.utils import TempFile, change_extn, compare_version_strings
 from vasl_templates.webapp.tests import pytest_options
@@ -194,6 +200,12 @@ def test_full_update( webapp, webdriver ):
             updated_vsav_data = _update_vsav( temp_file.name, {} )
             assert updated_vsav_data == b"No changes."
 
+            # make sure the VASSAL shim agrees that nothing needs to be changed
+            webapp.control_tests.set_app_config_val( "DISABLE_INCREMENTAL_VSAV_UPDATE", True )
+            updated_vsav_data = _update_vsav( temp_file.name, {} )
+            assert updated_vsav_data == b"No changes."
+            webapp.control_tests.set_app_config_val( "DISABLE_INCREMENTAL_VSAV_UPDATE", False )
+
     # run the test against all versions of VASSAL+VASL
     run_vassal_tests( webapp, lambda: do_test(True) )
 
@@ -685,6 +697,40 @@ def test_analyze_vsav_hip_concealed( webapp, webdriver ):
     # run the test against all versions of VASSAL+VASL
     run_vassal_tests( webapp, do_test )
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def test_vsav_analyzers( webapp, webdriver ):
+    """Check that the Python and VASSAL shim VSAV analyzers generate the same results."""
+
+    def do_test(): #pylint: disable=missing-docstring
+
+        # initialize
+        init_webapp( webapp, webdriver )
+
+        # analyze each test scenario using each analyzer
+        dname = os.path.join( os.path.split(__file__)[0], "fixtures/analyze-vsav/" )
+        for fname in os.listdir( dname ):
+            with open( os.path.join( dname, fname ), "rb" ) as fp:
+                vsav_data = base64.b64encode( fp.read() ).decode( "ascii" )
+            reports = []
+            for analyzer in ( "python", "java" ):
+                webapp.control_tests.set_app_config_val( "VSAV_ANALYZER", analyzer )
+                req = urllib.request.Request( webapp.url_for( "analyze_vsav" ),
+                    data = json.dumps( { "filename": fname, "vsav_data": vsav_data } ).encode( "utf-8" ),
+                    headers = { "Content-Type": "application/json" }
+                )
+                with urllib.request.urlopen( req ) as resp:
+                    report = json.load( resp )
+                assert "error" not in report
+                # NOTE: The names of the pieces may be slightly different (see analyze_scenario()).
+                reports.append( {
+                    gpid: vals["count"] for gpid,vals in report["pieces"].items()
+                } )
+            assert reports[0] == reports[1], fname
+
+    # run the test against all versions of VASSAL+VASL
+    run_vassal_tests( webapp, do_test )
+
 # ---------------------------------------------------------------------
 
 def test_reverse_remapped_gpids( webapp, webdriver ):
@@ -755,6 +801,140 @@ def test_vo_entry_selection_for_theater( webapp, webdriver ):
 
 # ---------------------------------------------------------------------
 
+def test_multipart_update_vsav():
+    """Test uploading a VASL scenario as multipart/form-data."""
+
+    # initialize
+    # NOTE: The scenario doesn't have any labels, and we don't send any snippets, so the VASSAL shim doesn't
+    # need to be run, and we can test the multipart request handling without a VASSAL installation.
+    fname = os.path.join( os.path.split(__file__)[0], "fixtures/update-vsav/empty.vsav" )
+    with open( fname, "rb" ) as fp:
+        vsav_data = fp.read()
+    params = json.dumps( { "filename": "test.vsav", "players": [ "german", "russian" ], "snippets": {} } )
+    client = app.test_client()
+
+    def check_response( resp ): #pylint: disable=missing-docstring
+        assert resp[ "filename" ] == "test.vsav"
+        assert "vsav_data" not in resp
+        # check that we can download the updated scenario file
+        resp2 = client.get( resp[ "vsav_url" ] )
+        assert resp2.status_code == 200
+        assert resp2.data == vsav_data
+        assert resp2.headers[ "Content-Disposition" ] == "attachment; filename=test.vsav"
+
+    # upload the scenario file
+    # NOTE: A file uploaded without a filename is falsey, so we check that it's still found.
+    for upload_fname in ( "test.vsav", "" ):
+        resp = client.post( "/update-vsav",
+            data = { "params": params, "vsav_data": ( io.BytesIO( vsav_data ), upload_fname ) },
+            content_type = "multipart/form-data"
+        )
+        assert resp.status_code == 200
+        check_response( resp.get_json() )
+
+    # upload the scenario file as a job
+    resp = client.post( "/jobs/update-vsav",
+        data = { "params": params, "vsav_data": ( io.BytesIO( vsav_data ), "test.vsav" ) },
+        content_type = "multipart/form-data"
+    )
+    assert resp.status_code == 200
+    job_id = resp.get_json()[ "jobId" ]
+    def get_job_status(): #pylint: disable=missing-docstring
+        status = client.get( "/jobs/" + job_id ).get_json()
+        return status if status[ "status" ] in ( "completed", "failed" ) else None
+    status = wait_for( 10, get_job_status )
+    assert status[ "status" ] == "completed"
+    check_response( status[ "result" ] )
+
+# ---------------------------------------------------------------------
+
+def test_analysis_cache( monkeypatch ): #pylint: disable=too-many-locals
+    """Test caching the analysis of VASL scenarios and log files."""
+
+    # initialize
+    # NOTE: We wrap the analyzers, so that we can see when they actually get called.
+    analyzed = []
+    def wrap_analyzer( module, func_name ): #pylint: disable=missing-docstring
+        func = getattr( module, func_name )
+        def wrapper( fname, *args ): #pylint: disable=missing-docstring
+            with open( fname, "rb" ) as fp:
+                analyzed.append( fp.read() )
+            return func( fname, *args )
+        monkeypatch.setattr( module, func_name, wrapper )
+    wrap_analyzer( webapp_vassal, "analyze_saved_game" )
+    wrap_analyzer( webapp_lfa, "analyze_logfile" )
+    def read_fixture( fname ): #pylint: disable=missing-docstring
+        fname = os.path.join( os.path.split(__file__)[0], "fixtures", fname )
+        with open( fname, "rb" ) as fp:
+            return fp.read()
+    vsav_data = read_fixture( "analyze-vsav/basic.vsav" )
+    vlog_data = read_fixture( "analyze-vlog/full.vlog" )
+    vlog_data2 = read_fixture( "analyze-vlog/multiple-1.vlog" )
+    prev_config = dict( app.config )
+    client = app.test_client()
+
+    def do_analyze_vsav(): #pylint: disable=missing-docstring
+        del analyzed[:]
+        resp = client.post( "/analyze-vsav", json={
+            "filename": "test.vsav", "vsav_data": base64.b64encode( vsav_data ).decode( "ascii" )
+        } )
+        assert resp.status_code == 200
+        return resp.get_json()
+    def do_analyze_vlogs( vlogs ): #pylint: disable=missing-docstring
+        del analyzed[:]
+        resp = client.post( "/analyze-vlogs", json=[
+            [ "test{}.vlog".format( 1+vlog_no ), base64.b64encode( vlog ).decode( "ascii" ) ]
+            for vlog_no, vlog in enumerate( vlogs )
+        ] )
+        assert resp.status_code == 200
+        return resp.get_json()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        app.config[ "ANALYSIS_CACHE_DIR" ] = cache_dir
+        webapp_vassal.init_analysis_cache()
+
+        try:
+
+            # analyze a VASL scenario (twice)
+            report = do_analyze_vsav()
+            assert analyzed == [ vsav_data ]
+            assert do_analyze_vsav() == report
+            assert not analyzed
+
+            # analyze a VASL log file (twice)
+            report = do_analyze_vlogs( [ vlog_data ] )
+            assert analyzed == [ vlog_data ]
+            assert do_analyze_vlogs( [ vlog_data ] ) == report
+            assert not analyzed
+
+            # add another log file (only the new file should get analyzed)
+            report2 = do_analyze_vlogs( [ vlog_data, vlog_data2 ] )
+            assert analyzed == [ vlog_data2 ]
+            assert report2[ "logFiles" ][0] == report[ "logFiles" ][0]
+            assert do_analyze_vlogs( [ vlog_data2, vlog_data ] ) and not analyzed
+
+            # change the LFA patterns (the log file should get re-analyzed)
+            app.config[ "LFA_PATTERN_CUSTOM_LABEL" ] = r"!!vt-label2 (?P<label>.+)$"
+            do_analyze_vlogs( [ vlog_data ] )
+            assert analyzed == [ vlog_data ]
+            do_analyze_vlogs( [ vlog_data ] )
+            assert not analyzed
+
+            # check that the analyzer is included in the cache key
+            with TempFile() as temp_file:
+                temp_file.write( vlog_data )
+                temp_file.close( delete=False )
+                for analysis_type in ( "vsav", "vlog" ):
+                    assert webapp_vassal.make_analysis_cache_key( analysis_type, temp_file.name, "python" ) \
+                        != webapp_vassal.make_analysis_cache_key( analysis_type, temp_file.name, "java" )
+
+        finally:
+            app.config.clear()
+            app.config.update( prev_config )
+            webapp_vassal.init_analysis_cache()
+
+# ---------------------------------------------------------------------
+
 def run_vassal_tests( webapp, func, vasl_extns_type=None,
     all_combos=None, min_vasl_version=None, max_vasl_version=None, ignore_vasl_versions=None
 ):
@@ -0,0 +1,179 @@
+"""Test running the VASSAL shim in daemon mode."""
+
+import sys
+import os
+import subprocess
+import logging
+
+import pytest
+
+from vasl_templates.webapp import app
+from vasl_templates.webapp.vassal import _VassalShimDaemon, VassalShimError, \
+    _run_vassal_shim_daemon, shutdown_vassal_shim_daemons, _DAEMON_RESPONSE_MARKER
+from vasl_templates.webapp.utils import TempFile
+
+# NOTE: This stands in for the Java VASSAL shim, and talks the same protocol (commands on stdin,
+# one per line with the arguments separated by tabs, and a marker line on stdout after each one).
+_STAND_IN_DAEMON = """
+import sys, time
+MARKER = {marker!r}
+def respond( msg ):
+    print( MARKER + " " + msg, flush=True )
+assert sys.argv[1] == "daemon"
+respond( "ready" )
+for line in sys.stdin:
+    args = line.rstrip( "\\n" ).split( "\\t" )
+    if args[0] == "quit":
+        break
+    if args[0] == "echo":
+        print( "|".join( args[1:] ) )
+        respond( "rc=0" )
+    elif args[0] == "fail":
+        print( "Something went wrong." )
+        print( "Error details.", file=sys.stderr, flush=True )
+        time.sleep( 0.1 ) # nb: give the stderr reader a chance to see this
+        respond( "rc=2" )
+    elif args[0] == "restart":
+        print( "Can't reset the game state." )
+        respond( "rc=0 restart" )
+        sys.exit( 3 )
+    elif args[0] == "bogus":
+        respond( "bogus response" )
+    elif args[0] == "crash":
+        print( "Crashing..." )
+        sys.exit( 5 )
+    elif args[0] == "hang":
+        time.sleep( 60 )
+"""
+
+# ---------------------------------------------------------------------
+
+def test_vassal_shim_daemon():
+    """Test talking to a VASSAL shim daemon."""
+
+    with TempFile( mode="w", extn=".py" ) as temp_file:
+
+        # start a stand-in daemon
+        temp_file.write( _STAND_IN_DAEMON.format( marker=_DAEMON_RESPONSE_MARKER ) )
+        temp_file.close( delete=False )
+        java_cmd = [ sys.executable, temp_file.name ]
+        daemon = _VassalShimDaemon( java_cmd, "test.vmod", 10 )
+        assert daemon.is_alive()
+
+        # run some commands
+        assert daemon.run( [ "echo", "a b", "c" ], 10 ) == ( 0, "a b|c\n", "" )
+        assert daemon.run( [ "echo" ], 10 ) == ( 0, "\n", "" )
+        assert daemon.run( [ "fail" ], 10 ) == ( 2, "Something went wrong.\n", "Error details." )
+        assert daemon.is_alive()
+
+        # ask the daemon to restart itself
+        assert daemon.run( [ "restart" ], 10 ) == ( 0, "Can't reset the game state.\n", "" )
+        assert not daemon.is_alive()
+
+        # send an invalid response
+        daemon = _VassalShimDaemon( java_cmd, "test.vmod", 10 )
+        with pytest.raises( VassalShimError ) as exc_info:
+            daemon.run( [ "bogus" ], 10 )
+        assert "bogus response" in exc_info.value.stderr
+        assert not daemon.is_alive()
+
+        # crash the daemon
+        daemon = _VassalShimDaemon( java_cmd, "test.vmod", 10 )
+        assert daemon.run( [ "crash" ], 10 ) == ( 5, "Crashing...\n", "" )
+        assert not daemon.is_alive()
+        with pytest.raises( VassalShimError ):
+            daemon.run( [ "echo" ], 10 )
+
+        # time out a command
+        daemon = _VassalShimDaemon( java_cmd, "test.vmod", 10 )
+        with pytest.raises( subprocess.TimeoutExpired ):
+            daemon.run( [ "hang" ], 0.5 )
+        assert not daemon.is_alive()
+
+        # stop a daemon
+        daemon = _VassalShimDaemon( java_cmd, "test.vmod", 10 )
+        daemon.stop()
+        assert not daemon.is_alive()
+
+        # try to start a daemon that doesn't respond properly
+        with pytest.raises( VassalShimError ):
+            _VassalShimDaemon( [ sys.executable, "-c", "print( 'not a daemon' )" ], "test.vmod", 10 )
+
+# ---------------------------------------------------------------------
+
+def test_vassal_shim_daemon_pool():
+    """Test running commands via the pool of VASSAL shim daemons."""
+
+    with TempFile( mode="w", extn=".py" ) as temp_file:
+
+        # initialize
+        temp_file.write( _STAND_IN_DAEMON.format( marker=_DAEMON_RESPONSE_MARKER ) )
+        temp_file.close( delete=False )
+        java_cmd = [ sys.executable, temp_file.name ]
+        vmod_fname = temp_file.name # nb: this just needs to be a file that exists
+        config_fname = temp_file.name + ".properties"
+        logger = logging.getLogger( "test" )
+        prev_config = dict( app.config )
+        app.config[ "VASSAL_SHIM_DAEMONS" ] = 1
+
+        try:
+
+            # run some commands (they should all go to the same daemon)
+            pids = set()
+            for _ in range( 3 ):
+                stdout = _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "echo", "hello" ], 10, logger )
+                assert stdout == "hello\n"
+                pids.add( _get_idle_daemon_pids()[0] )
+            assert len( pids ) == 1
+
+            # run a command that fails
+            with pytest.raises( VassalShimError ) as exc_info:
+                _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "fail" ], 10, logger )
+            assert exc_info.value.retcode == 2
+            assert _get_idle_daemon_pids() == list( pids )
+
+            # ask the daemon to restart, and check that a new one is started for the next command
+            assert _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "restart" ], 10, logger ) \
+                == "Can't reset the game state.\n"
+            assert not _get_idle_daemon_pids()
+            assert _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "echo", "again" ], 10, logger ) \
+                == "again\n"
+            new_pids = _get_idle_daemon_pids()
+            assert len( new_pids ) == 1 and new_pids[0] not in pids
+
+            # change the boards directory (a new daemon should be started, and the old one stopped)
+            pids = set( new_pids )
+            app.config[ "BOARDS_DIR" ] = "/boards/new"
+            assert _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "echo" ], 10, logger ) == "\n"
+            new_pids = _get_idle_daemon_pids()
+            assert len( new_pids ) == 1 and new_pids[0] not in pids
+
+            # create a config file (a new daemon should be started, and the old one stopped)
+            pids = set( new_pids )
+            with open( config_fname, "w", encoding="utf-8" ) as fp:
+                fp.write( "LABEL_GPID = 123\n" )
+            assert _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, [ "echo" ], 10, logger ) == "\n"
+            new_pids = _get_idle_daemon_pids()
+            assert len( new_pids ) == 1 and new_pids[0] not in pids
+
+            # check that we fall back to normal mode if a daemon can't be started
+            bad_java_cmd = [ sys.executable, "-c", "print( 'not a daemon' )" ]
+            assert _run_vassal_shim_daemon( bad_java_cmd, vmod_fname, config_fname, [ "echo" ], 10, logger ) is None
+            assert _run_vassal_shim_daemon( bad_java_cmd, vmod_fname, config_fname, [ "echo" ], 10, logger ) is None
+
+        finally:
+            shutdown_vassal_shim_daemons()
+            if os.path.isfile( config_fname ):
+                os.unlink( config_fname )
+            app.config.clear()
+            app.config.update( prev_config )
+
+def _get_idle_daemon_pids():
+    """Get the process ID's of the idle VASSAL shim daemons."""
+    from vasl_templates.webapp.vassal import _vassal_shim_daemons
+    return [
+        daemon.proc.pid
+        for pool in _vassal_shim_daemons.values()
+        for daemon in pool["idle"]
+        if daemon.is_alive()
+    ]
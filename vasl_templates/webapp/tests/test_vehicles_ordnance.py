@@ -1,13 +1,20 @@
 """ Test generating vehicle/ordnance snippets. """
 
 import os
+import shutil
+import tempfile
 import re
 import json
+import gzip
+import urllib.request
 
 import pytest
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 
+from vasl_templates.webapp import app
+from vasl_templates.webapp.vo import compile_vo_listings, get_vo_listings, \
+    _do_get_vo_listings, _load_compiled_vo_listings
 from vasl_templates.webapp.tests import pytest_options
 from vasl_templates.webapp.tests.test_scenario_persistence import load_scenario, save_scenario
 from vasl_templates.webapp.tests.utils import \
@@ -760,6 +767,99 @@ def test_invalid_vo_image_ids( webapp, webdriver ):
 
 # ---------------------------------------------------------------------
 
+def test_nat_listings( webapp, webdriver ):
+    """Test getting the vehicle/ordnance listings for specific nationalities."""
+
+    # initialize
+    init_webapp( webapp, webdriver )
+
+    def get_listings( vo_type, **kwargs ): #pylint: disable=missing-docstring
+        url = webapp.url_for( "get_{}_listings".format( "vehicle" if vo_type == "vehicles" else "ordnance" ),
+            merge_common=1, **kwargs
+        )
+        req = urllib.request.Request( url, headers={ "Accept-Encoding": "gzip" } )
+        with urllib.request.urlopen( req ) as resp:
+            assert resp.headers[ "Content-Encoding" ] == "gzip"
+            assert resp.headers[ "ETag" ]
+            return json.loads( gzip.decompress( resp.read() ) )
+
+    for vo_type in ( "vehicles", "ordnance" ):
+
+        # get the full listings
+        all_listings = get_listings( vo_type )
+
+        # get the listings for some nationalities
+        listings = get_listings( vo_type, nat="german,american,romanian,unknown" )
+        assert set( listings.keys() ) == { "german", "american", "romanian" }
+        for nat, vo_entries in listings.items():
+            assert vo_entries == all_listings[ nat ]
+        # nb: make sure the common Axis Minor vehicles/ordnance were included
+        assert any( e["id"].startswith( "axc/" ) for e in listings["romanian"] )
+
+        # check that the K:FW vehicles/ordnance are dropped if they're not needed
+        listings = get_listings( vo_type, nat="american", theater="ETO", year=1944 )
+        assert listings[ "american" ] == [
+            e for e in all_listings["american"] if not e["id"].startswith( "kfw-" )
+        ]
+        listings = get_listings( vo_type, nat="american", theater="Korea", year=1951 )
+        assert listings[ "american" ] == all_listings[ "american" ]
+        assert any( e["id"].startswith( "kfw-" ) for e in listings["american"] )
+
+# ---------------------------------------------------------------------
+
+def test_compiled_vo_listings():
+    """Test compiling the vehicle/ordnance listings."""
+
+    # initialize
+    # NOTE: We work on a copy of the data files, so that we can change them.
+    prev_config = dict( app.config )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = os.path.join( temp_dir, "data" )
+        for vo_type in ( "vehicles", "ordnance" ):
+            shutil.copytree( os.path.join( DATA_DIR, vo_type ), os.path.join( data_dir, vo_type ) )
+        shutil.copy( os.path.join( DATA_DIR, "vo-comments.json" ), data_dir )
+        compiled_dir = os.path.join( temp_dir, "compiled" )
+        app.config[ "DATA_DIR" ] = data_dir
+        app.config[ "COMPILED_VO_LISTINGS_DIR" ] = compiled_dir
+
+        try:
+
+            # compile the listings
+            fname = compile_vo_listings( None, compiled_dir )
+            assert os.listdir( compiled_dir ) == [ os.path.split( fname )[1] ] # nb: no temp files left behind
+            expected = _do_get_vo_listings( None, None )
+
+            # load the compiled listings
+            listings = _load_compiled_vo_listings( None, None )
+            assert listings == json.loads( json.dumps( expected ) )
+            assert get_vo_listings( None, None ) == listings
+
+            # change one of the data files
+            fname2 = os.path.join( data_dir, "vehicles", "german.json" )
+            with open( fname2, "r", encoding="utf-8" ) as fp:
+                vo_entries = json.load( fp )
+            vo_entries[0][ "name" ] = "Compiled Listings Test"
+            with open( fname2, "w", encoding="utf-8" ) as fp:
+                json.dump( vo_entries, fp )
+
+            # check that the compiled listings are now ignored, and we load the listings from the data files
+            assert _load_compiled_vo_listings( None, None ) is None
+            listings = get_vo_listings( None, None )
+            assert any(
+                vo_entry[ "name" ] == "Compiled Listings Test"
+                for vo_entry in listings[ "vehicles" ][ "german" ]
+            )
+
+            # re-compile the listings, and check that they get used again
+            compile_vo_listings( None, compiled_dir )
+            assert _load_compiled_vo_listings( None, None ) == json.loads( json.dumps( listings ) )
+
+        finally:
+            app.config.clear()
+            app.config.update( prev_config )
+
+# ---------------------------------------------------------------------
+
 def add_vo( webdriver, vo_type, player_no, name ): #pylint: disable=unused-argument
     """Add a vehicle/ordnance."""
 
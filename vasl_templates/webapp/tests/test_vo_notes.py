@@ -2,6 +2,7 @@
 
 import os
 import shutil
+import tempfile
 import urllib.request
 import io
 import re
@@ -11,6 +12,9 @@ import lxml.html
 import lxml.etree
 import tabulate
 
+from vasl_templates.webapp import app, globvars
+from vasl_templates.webapp import vo_notes as webapp_vo_notes
+from vasl_templates.webapp.vo_notes import ChapterHIndex
 from vasl_templates.webapp.tests import pytest_options
 from vasl_templates.webapp.tests.utils import \
     init_webapp, get_nationalities, select_tab, set_player, select_menu_option, click_dialog_button, \
@@ -648,6 +652,111 @@ def test_vo_notes_reports( webapp, webdriver ): #pylint: disable=too-many-locals
 
     assert not failed
 
+# ---------------------------------------------------------------------
+
+def test_chapter_h_index( monkeypatch ):
+    """Test indexing the Chapter H directory."""
+
+    # initialize
+    # NOTE: We work on a copy of the test notes, so that we can change them.
+    prev_config = dict( app.config )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dname = os.path.join( temp_dir, "vo-notes" )
+        shutil.copytree( os.path.join( os.path.split(__file__)[0], "fixtures/vo-notes" ), dname )
+        monkeypatch.setattr( webapp_vo_notes, "_chapter_h_index_cache_dname", os.path.join( temp_dir, "cache" ) )
+        app.config[ "CHAPTER_H_NOTES_DIR" ] = dname
+
+        try:
+
+            # build the index
+            index = ChapterHIndex( dname )
+            assert index._nscanned == len( index.dirs ) > 1 #pylint: disable=protected-access
+            assert "a.html" in index.dirs[ "german/vehicles" ][ "files" ]
+            index.save()
+
+            # load the index again (nothing should get re-scanned)
+            index = ChapterHIndex( dname )
+            assert index._nscanned == 0 #pylint: disable=protected-access
+            index.save()
+
+            # add a new note (only that directory should get re-scanned)
+            with open( os.path.join( dname, "german", "vehicles", "99.html" ), "w", encoding="utf-8" ) as fp:
+                fp.write( "<p> A new note." )
+            index = ChapterHIndex( dname )
+            assert index._nscanned == 1 #pylint: disable=protected-access
+            assert "99.html" in index.dirs[ "german/vehicles" ][ "files" ]
+            index.save()
+
+            # check that the new note gets loaded
+            webapp_vo_notes.load_vo_notes( None )
+            vo_note = globvars.vo_notes[ "vehicles" ][ "german" ][ "99" ]
+            assert vo_note[ "filename" ] == "german/vehicles/99.html"
+            assert "<p> A new note." in webapp_vo_notes.get_vo_note_content( vo_note )
+
+            # change a multi-applicable note in-place
+            # NOTE: We restore the directory's mtime, in case changing the file updated it.
+            dname2 = os.path.join( dname, "german", "vehicles" )
+            dir_stat = os.stat( dname2 )
+            with open( os.path.join( dname2, "a.html" ), "w", encoding="utf-8" ) as fp:
+                fp.write( "<p> An updated multi-applicable note." )
+            os.utime( dname2, ns=( dir_stat.st_atime_ns, dir_stat.st_mtime_ns ) )
+            index = ChapterHIndex( dname )
+            assert index._nscanned == 0 #pylint: disable=protected-access
+            webapp_vo_notes.load_vo_notes( None )
+            ma_notes = globvars.vo_notes[ "vehicles" ][ "german" ][ "multi-applicable" ]
+            assert ma_notes[ "A" ] == "An updated multi-applicable note."
+
+        finally:
+            app.config.clear()
+            app.config.update( prev_config )
+            webapp_vo_notes.load_vo_notes( None )
+
+def test_vo_note_content( monkeypatch ):
+    """Test getting the content of HTML vehicle/ordnance notes."""
+
+    # initialize
+    # NOTE: We work on a copy of the test notes, so that we can change them.
+    prev_config = dict( app.config )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dname = os.path.join( temp_dir, "vo-notes" )
+        shutil.copytree( os.path.join( os.path.split(__file__)[0], "fixtures/vo-notes" ), dname )
+        monkeypatch.setattr( webapp_vo_notes, "_chapter_h_index_cache_dname", None )
+        app.config[ "CHAPTER_H_NOTES_DIR" ] = dname
+        client = app.test_client()
+        url = "/vehicles/greek/note/202?f=raw"
+        fname = os.path.join( dname, "greek", "vehicles", "202.html" )
+
+        try:
+
+            # get the content of a note
+            webapp_vo_notes.load_vo_notes( None )
+            resp = client.get( url )
+            assert resp.status_code == 200 and resp.mimetype == "text/html"
+            assert resp.get_data( as_text=True ) \
+                == "<table width='500'><tr><td>\nThis is an HTML vehicle note (202).\n</table>"
+
+            # change the note (the new content should be returned)
+            with open( fname, "w", encoding="utf-8" ) as fp:
+                fp.write( "<p> An updated note. <img src='image.png'>" )
+            mtime = os.path.getmtime( fname ) + 10 # nb: make sure the mtime changes
+            os.utime( fname, ( mtime, mtime ) )
+            resp = client.get( url )
+            assert resp.status_code == 200
+            assert resp.get_data( as_text=True ) == "<table width='500'><tr><td>\n" \
+                "<p> An updated note. <img src='{{CHAPTER_H}}/greek/vehicles/image.png'>\n</table>"
+
+            # delete the note
+            os.unlink( fname )
+            assert client.get( url ).status_code == 404
+
+            # try to get a note that doesn't exist
+            assert client.get( "/vehicles/greek/note/999?f=raw" ).status_code == 404
+
+        finally:
+            app.config.clear()
+            app.config.update( prev_config )
+            webapp_vo_notes.load_vo_notes( None )
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def get_vo_notes_report( webapp, webdriver, nat, vo_type ):
@@ -0,0 +1,97 @@
+"""Test the WebDriver pool."""
+
+import threading
+
+import pytest
+
+from vasl_templates.webapp.webdriver import WebDriver, WebDriverPool
+from vasl_templates.webapp.utils import SimpleError
+
+# ---------------------------------------------------------------------
+
+def test_webdriver_pool( monkeypatch ):
+    """Test the WebDriver pool."""
+
+    # initialize
+    # NOTE: We stub out starting/stopping the webdriver processes, so that we can test the pool logic.
+    started, stopped, unhealthy = [], [], set()
+    fail_start = [ False ]
+    def do_start( self ): #pylint: disable=missing-docstring
+        if fail_start[0]:
+            raise SimpleError( "Can't start the WebDriver." )
+        started.append( self )
+    monkeypatch.setattr( WebDriver, "_do_start", do_start )
+    monkeypatch.setattr( WebDriver, "_do_stop", lambda self: stopped.append( self ) ) #pylint: disable=unnecessary-lambda
+    monkeypatch.setattr( WebDriver, "is_healthy", lambda self: self not in unhealthy )
+    pool = WebDriverPool( "test", 2, 3 )
+
+    # check out the maximum number of WebDrivers
+    wdriver1 = pool.checkout()
+    wdriver2 = pool.checkout()
+    assert wdriver1 is not wdriver2
+    assert len( started ) == 2
+    assert pool.get_stats()[ "running" ] == 2
+
+    # try to check out another one (it should block until one is returned)
+    results = []
+    thread = threading.Thread( target=lambda: results.append( pool.checkout() ) )
+    thread.start()
+    thread.join( 0.2 )
+    assert thread.is_alive() and not results
+    pool.checkin( wdriver2 )
+    thread.join( 2 )
+    assert results == [ wdriver2 ]
+    assert len( started ) == 2
+    stats = pool.get_stats()
+    assert stats[ "running" ] == 2 and stats[ "waits" ] == 1
+    pool.checkin( wdriver2 )
+
+    # use a WebDriver until it gets recycled
+    # NOTE: wdriver2 has been used twice, so it will be recycled after its next use.
+    assert pool.checkout() is wdriver2
+    pool.checkin( wdriver2 )
+    assert stopped == [ wdriver2 ]
+    stats = pool.get_stats()
+    assert stats[ "running" ] == 1 and stats[ "idle" ] == 0 and stats[ "recycled" ] == 1
+
+    # check that a new WebDriver is started to replace it
+    wdriver3 = pool.checkout()
+    assert wdriver3 not in ( wdriver1, wdriver2 )
+    assert len( started ) == 3
+    assert pool.get_stats()[ "running" ] == 2
+
+    # make an idle WebDriver unhealthy, and check that it gets replaced
+    pool.checkin( wdriver3 )
+    unhealthy.add( wdriver3 )
+    wdriver4 = pool.checkout()
+    assert wdriver4 not in ( wdriver1, wdriver2, wdriver3 )
+    assert stopped == [ wdriver2, wdriver3 ]
+    stats = pool.get_stats()
+    assert stats[ "running" ] == 2 and stats[ "unhealthy" ] == 1 and stats[ "started" ] == 4
+
+    # check that we still can't exceed the maximum number of WebDrivers
+    thread = threading.Thread( target=lambda: results.append( pool.checkout() ) )
+    thread.start()
+    thread.join( 0.2 )
+    assert thread.is_alive()
+    pool.checkin( wdriver4 )
+    thread.join( 2 )
+    assert results[-1] is wdriver4
+    assert pool.get_stats()[ "running" ] == 2
+
+    # make an idle WebDriver unhealthy, and its replacement fail to start
+    pool.checkin( wdriver4 )
+    unhealthy.add( wdriver4 )
+    fail_start[0] = True
+    with pytest.raises( SimpleError ):
+        pool.checkout()
+    assert pool.get_stats()[ "running" ] == 1
+    fail_start[0] = False
+
+    # shutdown the pool
+    pool.checkin( wdriver1 )
+    pool.shutdown()
+    assert stopped[-1] is wdriver1
+    assert pool.get_stats()[ "running" ] == 0
+    with pytest.raises( SimpleError ):
+        pool.checkout()
@@ -4,12 +4,18 @@ import os
 import shutil
 import subprocess
 import io
+import base64
 import tempfile
 import pathlib
 import math
 import re
+import json
+import gzip
+import zlib
+import hashlib
+import threading
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from flask import request, Response, send_file
 from PIL import Image, ImageChops
@@ -110,6 +116,297 @@ class TempFile:
         """Exit the context manager."""
         self.close( delete=True )
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def get_request_params():
+    """Get the parameters for a request that uploads files.
+
+    Files can be uploaded base64-encoded in a JSON request (the original API), or as multipart/form-data,
+    with the other parameters in a JSON-encoded "params" field. Returns the parameters, and a flag
+    indicating if the request was multipart (in which case, files should also be returned in raw form).
+    """
+    if request.mimetype == "multipart/form-data":
+        return json.loads( request.form.get( "params" ) or "{}" ), True
+    return request.json, False
+
+def get_uploaded_file( params, key ):
+    """Get an uploaded file (either a multipart upload, or base64-encoded data in the request parameters)."""
+    # NOTE: FileStorage objects are falsey if they don't have a filename, so we can't just use "or" here.
+    upload = request.files.get( key )
+    return upload if upload is not None else params[ key ]
+
+def save_uploaded_file( temp_file, upload ):
+    """Save an uploaded file to a temp file.
+
+    The file can be either a multipart upload (which gets streamed to the temp file), or base64-encoded data.
+    Returns the number of bytes saved.
+    """
+    if isinstance( upload, str ):
+        temp_file.write( base64.b64decode( upload ) )
+    else:
+        upload.save( temp_file.temp_file )
+    return temp_file.temp_file.tell()
+
+# ---------------------------------------------------------------------
+
+class LruCache:
+    """Thread-safe LRU cache, limited by the total size of the values stored in it."""
+
+    # NOTE: Caches register themselves here (by name), so that we can report on them.
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__( self, name, max_size, get_size=len ):
+        self.name = name
+        self.max_size = max_size
+        self._get_size = get_size
+        self._entries = OrderedDict()
+        self._curr_size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        with LruCache._registry_lock:
+            LruCache._registry[ name ] = self
+
+    def get( self, key, default=None ):
+        """Get a value from the cache."""
+        with self._lock:
+            entry = self._entries.get( key )
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end( key )
+            self.hits += 1
+            return entry[0]
+
+    def put( self, key, val ):
+        """Add a value to the cache."""
+        size = self._get_size( val )
+        if size > self.max_size:
+            return # nb: the value would never fit
+        with self._lock:
+            if key in self._entries:
+                self._curr_size -= self._entries.pop( key )[1]
+            self._entries[ key ] = ( val, size )
+            self._curr_size += size
+            # evict the least-recently used entries
+            while self._curr_size > self.max_size:
+                _, entry = self._entries.popitem( last=False )
+                self._curr_size -= entry[1]
+                self.evictions += 1
+
+    def remove( self, key ):
+        """Remove a value from the cache."""
+        with self._lock:
+            entry = self._entries.pop( key, None )
+            if entry:
+                self._curr_size -= entry[1]
+
+    def clear( self ):
+        """Clear the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._curr_size = 0
+
+    def get_stats( self ):
+        """Get statistics about the cache."""
+        with self._lock:
+            nlookups = self.hits + self.misses
+            return {
+                "entries": len( self._entries ),
+                "size": self._curr_size,
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": float( self.hits ) / nlookups if nlookups > 0 else None,
+                "evictions": self.evictions,
+            }
+
+    @staticmethod
+    def get_all_stats():
+        """Get statistics about all the caches."""
+        with LruCache._registry_lock:
+            caches = list( LruCache._registry.values() )
+        return { cache.name: cache.get_stats() for cache in caches }
+
+class DiskLruCache( LruCache ):
+    """Thread-safe LRU cache, whose values are stored in files.
+
+    Values must be bytes, and keys must be usable as filenames (e.g. a hash).
+    The cache survives restarts (entries are ordered by their file's timestamp, which we update on each hit).
+    """
+
+    def __init__( self, name, dname, max_size, extn="" ):
+        super().__init__( name, max_size )
+        self.dname = dname
+        self._extn = extn
+        os.makedirs( dname, exist_ok=True )
+        # load the existing entries
+        entries = []
+        for fname in os.listdir( dname ):
+            if not fname.endswith( extn ) or fname.endswith( ".tmp" ):
+                continue
+            try:
+                stat = os.stat( os.path.join( dname, fname ) )
+            except OSError:
+                continue
+            key = fname[ : len(fname)-len(extn) ] if extn else fname
+            entries.append( ( stat.st_mtime, key, stat.st_size ) )
+        for _, key, size in sorted( entries ):
+            self._entries[ key ] = ( None, size )
+            self._curr_size += size
+        self._evict()
+
+    def get( self, key, default=None ):
+        """Get a value from the cache."""
+        # NOTE: We only hold the lock while we update the in-memory entry, and read the file without it,
+        # so that other threads don't have to wait for the disk.
+        with self._lock:
+            entry = self._entries.get( key )
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end( key )
+            self.hits += 1
+        fname = self._make_fname( key )
+        try:
+            with open( fname, "rb" ) as fp:
+                val = fp.read()
+            os.utime( fname )
+        except OSError:
+            # NOTE: The file has disappeared from under us (e.g. it was evicted by another thread),
+            # or can't be read, so we treat this as a miss.
+            with self._lock:
+                if self._entries.get( key ) is entry:
+                    self._curr_size -= self._entries.pop( key )[1]
+                self.hits -= 1
+                self.misses += 1
+            return default
+        return val
+
+    def put( self, key, val ):
+        """Add a value to the cache."""
+        size = len( val )
+        if size > self.max_size:
+            return # nb: the value would never fit
+        fname = self._make_fname( key )
+        # NOTE: We write to a temp file, then rename it into place, so that a concurrent (or crashed)
+        # instance of the program will never see a partially-written file. The rename is done
+        # while we have the lock, so that the files on disk always match what's in the cache.
+        temp_fname = "{}.{}.{}.tmp".format( fname, os.getpid(), threading.get_ident() )
+        try:
+            with open( temp_fname, "wb" ) as fp:
+                fp.write( val )
+        except OSError as ex:
+            logging.warning( "Can't save cache file: %s\n- %s", fname, ex )
+            return
+        with self._lock:
+            try:
+                os.replace( temp_fname, fname )
+            except OSError as ex:
+                logging.warning( "Can't save cache file: %s\n- %s", fname, ex )
+                try:
+                    os.unlink( temp_fname )
+                except OSError:
+                    pass
+                return
+            if key in self._entries:
+                self._curr_size -= self._entries.pop( key )[1]
+            self._entries[ key ] = ( None, size )
+            self._curr_size += size
+            self._evict()
+
+    def remove( self, key ):
+        """Remove a value from the cache."""
+        with self._lock:
+            entry = self._entries.pop( key, None )
+            if entry:
+                self._curr_size -= entry[1]
+                self._remove_file( key )
+
+    def clear( self ):
+        """Clear the cache."""
+        with self._lock:
+            for key in self._entries:
+                self._remove_file( key )
+            self._entries.clear()
+            self._curr_size = 0
+
+    def _evict( self ):
+        """Evict the least-recently used entries."""
+        # NOTE: The caller must have the lock.
+        while self._curr_size > self.max_size:
+            key, entry = self._entries.popitem( last=False )
+            self._curr_size -= entry[1]
+            self.evictions += 1
+            self._remove_file( key )
+
+    def _remove_file( self, key ):
+        """Remove a cache file."""
+        try:
+            os.unlink( self._make_fname( key ) )
+        except OSError:
+            pass
+
+    def _make_fname( self, key ):
+        """Generate the filename for a cache entry."""
+        return os.path.join( self.dname, key + self._extn )
+
+    def get_stats( self ):
+        """Get statistics about the cache."""
+        stats = super().get_stats()
+        stats[ "dir" ] = self.dname
+        return stats
+
+# ---------------------------------------------------------------------
+
+class PreparedResponse:
+    """A response whose payload has been serialized (and compressed) in advance."""
+
+    def __init__( self, data, mimetype="application/json" ):
+        self.mimetype = mimetype
+        # NOTE: Each content encoding is a different representation of the payload, so it gets its own ETag.
+        etag = hashlib.md5( data ).hexdigest()
+        self._variants = {
+            None: ( data, etag ),
+            "gzip": ( gzip.compress( data ), etag+"-gzip" ),
+            "deflate": ( zlib.compress( data ), etag+"-deflate" ),
+        }
+        self.etag = etag
+
+    @staticmethod
+    def from_json( data ):
+        """Prepare a JSON response."""
+        # NOTE: We serialize the data the same way that jsonify() does.
+        data = json.dumps( data, sort_keys=True, separators=(",",":") ).encode( "utf-8" )
+        return PreparedResponse( data, "application/json" )
+
+    @property
+    def size( self ):
+        """Return the total size of the prepared data."""
+        return sum( len( v[0] ) for v in self._variants.values() )
+
+    def make_response( self ):
+        """Make a Flask response for the current request."""
+
+        # figure out which content encoding to use
+        encoding = None
+        for enc in ( "gzip", "deflate" ):
+            if request.accept_encodings[ enc ] > 0:
+                encoding = enc
+                break
+        data, etag = self._variants[ encoding ]
+
+        # check if the client already has the data
+        if request.if_none_match.contains( etag ):
+            resp = Response( status=304 )
+        else:
+            resp = Response( data, mimetype=self.mimetype )
+            if encoding:
+                resp.headers[ "Content-Encoding" ] = encoding
+        resp.set_etag( etag )
+        resp.vary.add( "Accept-Encoding" )
+        return resp
+
 # ---------------------------------------------------------------------
 
 def read_text_file( fname ):
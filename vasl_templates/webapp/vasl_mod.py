@@ -6,6 +6,8 @@ import json
 import glob
 import zipfile
 import re
+import hashlib
+import weakref
 import xml.etree.ElementTree
 
 import logging
@@ -19,7 +21,8 @@ from vasl_templates.webapp.utils import compare_version_strings
 SUPPORTED_VASL_MOD_VERSIONS = [ "6.6.0", "6.6.1", "6.6.2", "6.6.3", "6.6.3.1", "6.6.4" ]
 SUPPORTED_VASL_MOD_VERSIONS_DISPLAY = "6.6.0-.3, 6.6.3.1, 6.6.4"
 
-_zip_file_lock = threading.Lock()
+_piece_index_cache_dname = None
+_PIECE_INDEX_CACHE_VERSION = 2
 
 _warnings = [] # nb: for the test suite
 
@@ -102,17 +105,16 @@ def _load_vasl_extns( extn_dir, msg_store ): #pylint: disable=too-many-locals,to
 
         # try to load the extension
         _logger.debug( "Checking VASL extension: %s", extn_fname )
+        # NOTE: We only need the root node of the build file, so we don't parse the whole thing.
         try:
             with zipfile.ZipFile( extn_fname, "r" ) as zf:
-                build_info = zf.read( "buildFile" )
+                node = _get_build_file_root( zf )
         except zipfile.BadZipFile:
             log_warning( "Can't check VASL extension (not a ZIP file): {}", extn_fname )
             continue
         except KeyError:
             log_warning( "Missing buildFile: {}", extn_fname )
             continue
-        doc = xml.etree.ElementTree.fromstring( build_info )
-        node = doc.findall( "." )[0]
         if node.tag != "VASSAL.build.module.ModuleExtension":
             log_warning( "Unexpected root node ({}) for VASL extension: {}", node.tag, extn_fname )
             continue
@@ -162,7 +164,11 @@ class VaslMod:
 
         # initialize
         self._pieces = {}
+        self._load_warnings = []
         self._files = [ ( zipfile.ZipFile(fname,"r"), None ) ] #pylint: disable=consider-using-with
+        self._thread_local = threading.local()
+        self._thread_zip_files = weakref.WeakSet()
+        self._thread_zip_files_lock = threading.Lock()
         if extns:
             for extn in extns:
                 self._files.append(
@@ -181,11 +187,37 @@ class VaslMod:
         if hasattr( self, "_files" ):
             for f in self._files:
                 f[0].close()
+        if hasattr( self, "_thread_zip_files" ):
+            with self._thread_zip_files_lock:
+                for zip_file in list( self._thread_zip_files ):
+                    zip_file.close()
 
     def get_piece_image( self, gpid, side, index ):
         """Get the image for the specified piece."""
 
         # get the image path
+        archive_index, image_path = self._get_piece_image_path( gpid, side, index )
+        if not image_path:
+            return None, None
+
+        # load the image data
+        image_data = self._get_thread_zip_file( archive_index ).read( image_path )
+
+        return image_path, image_data
+
+    def get_piece_image_info( self, gpid, side, index ):
+        """Get the ZIP file entry for the specified piece's image (without reading it)."""
+        archive_index, image_path = self._get_piece_image_path( gpid, side, index )
+        if not image_path:
+            return None, None
+        try:
+            zip_info = self._files[ archive_index ][0].getinfo( image_path )
+        except KeyError:
+            return None, None
+        return image_path, zip_info
+
+    def _get_piece_image_path( self, gpid, side, index ):
+        """Get the path of the specified piece's image in its ZIP file."""
         gpid = get_remapped_gpid( self, gpid )
         if gpid not in self._pieces:
             return None, None
@@ -197,22 +229,30 @@ class VaslMod:
         if not isinstance( image_paths, list ):
             image_paths = [ image_paths ]
         image_path = image_paths[ index ]
-
-        # load the image data
         image_path = os.path.join( "images", image_path )
         image_path = re.sub( r"[\\/]+", "/", image_path ) # nb: in case we're on Windows :-/
+        return piece["archive"], image_path
+
+    def _get_thread_zip_file( self, archive_index ):
+        """Get the calling thread's handle for the specified ZIP file."""
         # FUDGE! Reading ZIP file should be thread-safe, but there appears to be a bug in Python 3.7 and 3.8
-        # that causes intermittent decompression errors:
+        # that causes intermittent decompression errors when multiple threads read from the same ZipFile:
         #   https://bugs.python.org/issue42369
-        # We work around this by only allowing 1 thread to read from a ZIP file at any time. Strictly speaking,
-        # we should do this everywhere we read from a ZIP file, but this is the only place where multiple threads
-        # come into play. It's also overkill to have a single lock for *all* ZIP files, but it won't kill us
-        # to do things this way, and trying to do things "properly" is problematic (i.e. when do we clean up
-        # these locks?).
-        with _zip_file_lock:
-            image_data = piece[ "zip_file" ].read( image_path )
-
-        return image_path, image_data
+        # We used to work around this by only allowing 1 thread to read from *any* ZIP file at a time, but this
+        # meant that a VASSAL client requesting lots of counter images at once would have its requests serialized.
+        # Instead, each thread now opens its own handle for each ZIP file, so reads can proceed in parallel.
+        # NOTE: These are closed when the thread (or this object) goes away, since ZipFile closes itself
+        # when it gets garbage-collected, but we also track them, so that we can close them explicitly.
+        zip_files = getattr( self._thread_local, "zip_files", None )
+        if zip_files is None:
+            zip_files = self._thread_local.zip_files = {}
+        zip_file = zip_files.get( archive_index )
+        if zip_file is None:
+            fname = self._files[ archive_index ][0].filename
+            zip_file = zip_files[ archive_index ] = zipfile.ZipFile( fname, "r" ) #pylint: disable=consider-using-with
+            with self._thread_zip_files_lock:
+                self._thread_zip_files.add( zip_file )
+        return zip_file
 
     def get_piece_info( self ):
         """Get information about each piece."""
@@ -251,15 +291,20 @@ class VaslMod:
     def _load_vmod( self, data_dir ): #pylint: disable=too-many-branches,too-many-locals
         """Load a VASL module file and any extensions."""
 
+        # check if we have a cached piece index for these files
+        cache_fname = self._get_piece_index_cache_fname()
+        cached_index = _load_piece_index_cache( cache_fname ) if cache_fname else None
+
         # get the VASL version
-        build_info = self._files[0][0].read( "buildFile" )
-        doc = xml.etree.ElementTree.fromstring( build_info )
+        if cached_index:
+            self.vasl_real_version = cached_index[ "vasl_real_version" ]
+        else:
+            self.vasl_real_version = _get_build_file_root( self._files[0][0] ).attrib.get( "version" )
         # NOTE: We have data files for each version of VASL, mostly for tracking things like changed GPID's,
         # expected image URL problems, etc. These don't always change between releases, so to avoid
         # having to create a new set of identical data files, we allow VASL versions to be aliased.
         # This also helps in the case of emergency releases e.g. 6.6.3.1 is treated the same as 6.6.3,
         # and beta releases (e.g. 6.6.4-beta5 = 6.6.3).
-        self.vasl_real_version = doc.attrib.get( "version" )
         fname = os.path.join( data_dir, "vasl-version-aliases.json" )
         with open( fname, "r", encoding="utf-8" ) as fp:
             aliases = json.load( fp )
@@ -276,10 +321,29 @@ class VaslMod:
         # figure out which pieces we're interested in
         target_gpids = get_vo_gpids( self )
 
+        # check if we can use the cached piece index
+        # NOTE: The cache file is keyed by the VASL module and extension files, but the pieces we extract
+        # from them also depend on our data files, so we check a signature of those as well.
+        data_sig = hashlib.sha1( json.dumps( {
+            "vasl_real_version": self.vasl_real_version,
+            "vasl_version": self.vasl_version,
+            "vasl_overrides": vasl_overrides,
+            "expected_multiple_images": expected_multiple_images,
+            "target_gpids": sorted( target_gpids ),
+            "gpid_remappings": GPID_REMAPPINGS,
+        }, sort_keys=True ).encode( "utf-8" ) ).hexdigest()
+        if cached_index and cached_index.get( "data_sig" ) == data_sig:
+            self._pieces = cached_index[ "pieces" ]
+            _logger.info( "Loaded %d pieces from the cache: %s", len(self._pieces), cache_fname )
+            # re-issue any warnings that were issued when the piece index was built
+            for msg in cached_index[ "warnings" ]:
+                self._log_load_warning( "%s", msg )
+            return
+
         # parse the VASL module and any extensions
         for i,files in enumerate( self._files ):
             _logger.info( "Loading VASL %s: %s", ("module" if i == 0 else "extension"), files[0].filename )
-            self._parse_zip_file( files[0], target_gpids, vasl_overrides, expected_multiple_images )
+            self._parse_zip_file( i, target_gpids, vasl_overrides, expected_multiple_images )
 
         # NOTE: The code below may log warnings if we're using an older version of VASL (because we know
         # about pieces that were added in a later version, but, of course, aren't in the older version).
@@ -289,28 +353,80 @@ class VaslMod:
         # make sure we found all the pieces we need
         _logger.info( "Loaded %d pieces.", len(self._pieces) )
         if target_gpids:
-            _logger.warning( "Couldn't find pieces: %s", target_gpids )
+            self._log_load_warning( "Couldn't find pieces: %s", target_gpids )
 
         # make sure all the overrides defined were used
         if vasl_overrides:
             gpids = ", ".join( vasl_overrides.keys() )
-            _logger.warning( "Unused VASL overrides: %s", gpids )
+            self._log_load_warning( "Unused VASL overrides: %s", gpids )
         if expected_multiple_images:
             gpids = ", ".join( expected_multiple_images.keys() )
-            _logger.warning( "Expected multiple images but didn't find them: %s", gpids )
+            self._log_load_warning( "Expected multiple images but didn't find them: %s", gpids )
+
+        # save the piece index, so that we can start up faster next time
+        # NOTE: We also save any warnings that were issued, so that they can be re-issued when the cache is used.
+        if cache_fname:
+            self._save_piece_index_cache( cache_fname, data_sig )
+
+    def _log_load_warning( self, fmt, *args ):
+        """Log a warning while loading the VASL module."""
+        msg = fmt % args
+        self._load_warnings.append( msg )
+        _logger.warning( "%s", msg )
+
+    def _get_piece_index_cache_fname( self ):
+        """Get the name of the file we cache the piece index in."""
+        if not _piece_index_cache_dname:
+            return None
+        # NOTE: We identify each file by its name, size and timestamp, plus the CRC of its build file,
+        # so that the cache gets invalidated if anything changes.
+        files_sig = [ _PIECE_INDEX_CACHE_VERSION ]
+        for files in self._files:
+            fname = os.path.abspath( files[0].filename )
+            stat = os.stat( fname )
+            files_sig.append( [
+                fname, stat.st_size, stat.st_mtime, files[0].getinfo( "buildFile" ).CRC,
+                ( files[1] or {} ).get( "extensionId" )
+            ] )
+        key = hashlib.sha1( json.dumps( files_sig ).encode( "utf-8" ) ).hexdigest()
+        return os.path.join( _piece_index_cache_dname, key+".json" )
+
+    def _save_piece_index_cache( self, cache_fname, data_sig ):
+        """Save the piece index to the cache."""
+        cached_index = {
+            "version": _PIECE_INDEX_CACHE_VERSION,
+            "vasl_real_version": self.vasl_real_version,
+            "data_sig": data_sig,
+            "pieces": self._pieces,
+            "warnings": self._load_warnings,
+        }
+        # NOTE: We write to a temp file, then rename it into place, so that a concurrent (or crashed)
+        # instance of the program will never see a partially-written file.
+        try:
+            os.makedirs( os.path.dirname( cache_fname ), exist_ok=True )
+            temp_fname = "{}.{}.tmp".format( cache_fname, os.getpid() )
+            with open( temp_fname, "w", encoding="utf-8" ) as fp:
+                json.dump( cached_index, fp )
+            os.replace( temp_fname, cache_fname )
+        except Exception as ex: #pylint: disable=broad-except
+            _logger.warning( "Can't save the piece index cache: %s\n- %s", cache_fname, ex )
+            return
+        _logger.debug( "Saved the piece index cache: %s", cache_fname )
 
-    def _parse_zip_file( self, zip_file, target_gpids, vasl_overrides, expected_multiple_images ): #pylint: disable=too-many-locals
+    def _parse_zip_file( self, archive_index, target_gpids, vasl_overrides, expected_multiple_images ): #pylint: disable=too-many-locals
         """Parse a VASL module or extension."""
 
         # load the build file
-        build_info = zip_file.read( "buildFile" )
+        build_info = self._files[ archive_index ][0].read( "buildFile" )
         doc = xml.etree.ElementTree.fromstring( build_info )
 
         def check_override( gpid, piece, override ):
             """Check that the values in an override entry match what we have."""
             for key in override:
                 if piece[key] != override[key]:
-                    _logger.warning( "Unexpected value in VASL override for '%s' (gpid=%s): %s", key, gpid, piece[key] )
+                    self._log_load_warning( "Unexpected value in VASL override for '%s' (gpid=%s): %s",
+                        key, gpid, piece[key]
+                    )
                     return False
             return True
 
@@ -322,7 +438,7 @@ class VaslMod:
             if gpid not in target_gpids:
                 continue
             if gpid in self._pieces:
-                _logger.warning( "Found duplicate GPID: %s", gpid )
+                self._log_load_warning( "Found duplicate GPID: %s", gpid )
             front_images, back_images = self._get_image_paths( gpid, node.text )
             piece = {
                 "gpid": gpid,
@@ -330,7 +446,7 @@ class VaslMod:
                 "front_images": front_images,
                 "back_images": back_images,
                 "is_small": int(node.attrib["height"]) <= 48,
-                "zip_file": zip_file,
+                "archive": archive_index,
             }
 
             # check if we want to override any values
@@ -356,12 +472,11 @@ class VaslMod:
                     check_override( gpid, piece, expected )
                     del expected_multiple_images[ gpid ]
                 else:
-                    _logger.warning( "Found multiple images: %s", piece )
+                    self._log_load_warning( "Found multiple images: %s", piece )
 
         return doc.attrib.get( "version" )
 
-    @staticmethod
-    def _get_image_paths( gpid, val ): #pylint: disable=too-many-branches
+    def _get_image_paths( self, gpid, val ): #pylint: disable=too-many-branches
         """Get the image path(s) for a piece."""
 
         # FUDGE! The data in the build file looks like a serialized object, so we use
@@ -395,7 +510,7 @@ class VaslMod:
             fields = [ f for f in fields if f ]
             return fields
         if not fields:
-            _logger.warning( "Couldn't find any image paths for gpid=%s.", gpid )
+            self._log_load_warning( "Couldn't find any image paths for gpid=%s.", gpid )
             return None, None
         if len(fields) == 1:
             # the piece only has front image(s)
@@ -464,6 +579,30 @@ class VaslMod:
 
 # ---------------------------------------------------------------------
 
+def _get_build_file_root( zip_file ):
+    """Get the root node of a VASL module/extension's build file."""
+    # NOTE: Build files can be large, so we stop parsing as soon as we have the root node.
+    with zip_file.open( "buildFile" ) as fp:
+        for _, node in xml.etree.ElementTree.iterparse( fp, events=("start",) ):
+            return node
+    return None
+
+def _load_piece_index_cache( cache_fname ):
+    """Load a cached piece index."""
+    if not os.path.isfile( cache_fname ):
+        return None
+    try:
+        with open( cache_fname, "r", encoding="utf-8" ) as fp:
+            cached_index = json.load( fp )
+    except Exception as ex: #pylint: disable=broad-except
+        _logger.warning( "Can't load the piece index cache: %s\n- %s", cache_fname, ex )
+        return None
+    if cached_index.get( "version" ) != _PIECE_INDEX_CACHE_VERSION:
+        return None
+    return cached_index
+
+# ---------------------------------------------------------------------
+
 def get_vo_gpids( vasl_mod ):
     """Get the GPID's for the vehicles/ordnance."""
 
@@ -14,15 +14,26 @@ import base64
 import time
 import io
 import zipfile
+import json
+import hashlib
+import tempfile
+import threading
+import queue
+import atexit
+import concurrent.futures
 import xml.etree.cElementTree as ET
 
-from flask import request, jsonify
+from flask import jsonify
 
 from vasl_templates.webapp import app, globvars
 from vasl_templates.webapp.config.constants import BASE_DIR, IS_FROZEN
-from vasl_templates.webapp.utils import TempFile, SimpleError, get_java_path, compare_version_strings
-from vasl_templates.webapp.webdriver import WebDriver
+from vasl_templates.webapp.utils import TempFile, SimpleError, DiskLruCache, get_java_path, compare_version_strings, \
+    parse_int, get_request_params, get_uploaded_file, save_uploaded_file
+from vasl_templates.webapp.files import add_temp_download
+from vasl_templates.webapp.webdriver import get_snippet_image
 from vasl_templates.webapp.vasl_mod import get_reverse_remapped_gpid
+from vasl_templates.webapp.saved_game import analyze_scenario as analyze_saved_game, get_vasl_templates_labels
+from vasl_templates.webapp.jobs import set_job_progress
 
 # NOTE: VASSAL dropped support for Java 8 from 3.3.0. The first version of VASL that supported
 # the later versions of Java was 6.6.0, but it was compiled against VASSAL 3.4.2, so we don't
@@ -48,6 +59,9 @@ SUPPORTED_VASSAL_VERSIONS = {
 }
 SUPPORTED_VASSAL_VERSIONS_DISPLAY = "3.4.2, 3.4.6, 3.5.5, 3.5.8"
 
+_analysis_cache = None
+_ANALYSIS_CACHE_VERSION = 1
+
 # ---------------------------------------------------------------------
 
 @app.route( "/update-vsav", methods=["POST"] )
@@ -55,12 +69,14 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
     """Update labels in a VASL scenario file."""
 
     # parse the request
+    # NOTE: The VSAV file can be uploaded as multipart/form-data, in which case the updated file
+    # is returned as a download URL, instead of base64-encoded in the response.
     start_time = time.time()
-    vsav_data = request.json[ "vsav_data" ]
-    vsav_filename = request.json[ "filename" ]
-    players = request.json[ "players" ]
-    snippets = request.json[ "snippets" ]
-    test_mode = request.json.get( "testMode" )
+    params, raw_files = get_request_params()
+    vsav_filename = params[ "filename" ]
+    players = params[ "players" ]
+    snippets = params[ "snippets" ]
+    test_mode = params.get( "testMode" )
 
     # initialize
     logger = logging.getLogger( "update_vsav" )
@@ -68,25 +84,39 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
     # update the VASL scenario file
     try:
 
-        # get the VSAV data (we do this inside the try block so that the user gets shown
-        # a proper error dialog if there's a problem decoding the base64 data)
-        vsav_data = base64.b64decode( vsav_data )
-        logger.info( "Updating VSAV (#bytes=%d): %s", len(vsav_data), vsav_filename )
-
         with TempFile() as input_file:
 
-            # save the VSAV data in a temp file
-            input_file.write( vsav_data )
+            # save the VSAV data in a temp file (we do this inside the try block so that the user gets shown
+            # a proper error dialog if there's a problem decoding the base64 data)
+            nbytes = save_uploaded_file( input_file, get_uploaded_file( params, "vsav_data" ) )
+            logger.info( "Updating VSAV (#bytes=%d): %s", nbytes, vsav_filename )
             input_file.close( delete=False )
-            fname = app.config.get( "UPDATE_VSAV_INPUT" ) # nb: for diagnosing problems
-            if fname:
-                logger.debug( "Saving a copy of the VSAV data: %s", fname )
-                with open( fname, "wb" ) as fp:
-                    fp.write( vsav_data )
+            input_file.save_copy( # nb: for diagnosing problems
+                app.config.get( "UPDATE_VSAV_INPUT" ), logger, "VSAV data"
+            )
+
+            # check which labels are already in the scenario
+            # NOTE: Updating a scenario is slow (we have to take a screenshot of every snippet, then run VASSAL),
+            # so we first check the labels ourself. We only need screenshots for snippets that don't already
+            # have a label (since the size is only used when creating new labels), and if none of the labels
+            # need to be changed, we don't need to run VASSAL at all.
+            new_snippet_ids, unchanged_labels = _check_existing_labels(
+                input_file.name, snippets, players, test_mode, logger
+            )
+            if unchanged_labels is not None:
+                logger.info( "No labels need to be updated: elapsed=%.3fs", time.time()-start_time )
+                vsav_filename = os.path.split( vsav_filename )[1]
+                vsav_data, vsav_url = _read_vsav_data( input_file.name, vsav_filename, raw_files )
+                report = {
+                    "was_modified": False,
+                    "created": [], "updated": [], "deleted": [], "failed": [],
+                    "unchanged": [ { "id": snippet_id } for snippet_id in unchanged_labels ],
+                }
+                return _make_update_vsav_response( vsav_filename, vsav_data, vsav_url, report )
 
             with TempFile() as snippets_file:
                 # save the snippets in a temp file
-                xml = _save_snippets( snippets, players, snippets_file, test_mode, logger )
+                xml = _save_snippets( snippets, players, snippets_file, test_mode, new_snippet_ids, logger )
                 snippets_file.close( delete=False )
                 fname = app.config.get( "UPDATE_VSAV_SNIPPETS" ) # nb: for diagnosing problems
                 if fname:
@@ -95,6 +125,7 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
                         ET.ElementTree( xml ).write( fp )
 
                 # run the VASSAL shim to update the VSAV file
+                set_job_progress( "Updating the VASL scenario..." )
                 with TempFile() as output_file, TempFile() as report_file:
                     output_file.close( delete=False )
                     report_file.close( delete=False )
@@ -103,13 +134,11 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
                         input_file.name, snippets_file.name, output_file.name, report_file.name
                     )
                     # read the updated VSAV data
-                    with open( output_file.name, "rb" ) as fp:
-                        vsav_data = fp.read()
-                    fname = app.config.get( "UPDATE_VSAV_RESULT" ) # nb: for diagnosing problems
-                    if fname:
-                        logger.debug( "Saving a copy of the updated VSAV: %s", fname )
-                        with open( fname, "wb" ) as fp:
-                            fp.write( vsav_data )
+                    vsav_filename = os.path.split( vsav_filename )[1]
+                    vsav_data, vsav_url = _read_vsav_data( output_file.name, vsav_filename, raw_files )
+                    output_file.save_copy( # nb: for diagnosing problems
+                        app.config.get( "UPDATE_VSAV_RESULT" ), logger, "updated VSAV"
+                    )
                     # read the report
                     report = _parse_label_report( report_file.name )
 
@@ -119,15 +148,24 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
 
     # return the results
     logger.info( "Updated the VSAV file OK: elapsed=%.3fs", time.time()-start_time )
-    vsav_filename = os.path.split( vsav_filename )[1]
+    return _make_update_vsav_response( vsav_filename, vsav_data, vsav_url, report )
+
+def _read_vsav_data( fname, vsav_filename, raw_files ):
+    """Read the VSAV data to be returned to the caller (or make it available as a download)."""
+    if raw_files:
+        return None, add_temp_download( vsav_filename, fname=fname )
+    with open( fname, "rb" ) as fp:
+        return fp.read(), None
+
+def _make_update_vsav_response( vsav_filename, vsav_data, vsav_url, report ):
+    """Generate the response for an update VSAV request."""
     errors = []
     for fail in report["failed"]:
         if fail.get("message"):
             errors.append( "{} <div class='pre'> {} </div>".format( fail["caption"], fail["message"] ) )
         else:
             errors.append( fail["caption"] )
-    return jsonify( {
-        "vsav_data": base64.b64encode(vsav_data).decode( "utf-8" ),
+    results = {
         "filename": vsav_filename,
         "report": {
             "was_modified": report["was_modified"],
@@ -137,9 +175,93 @@ def update_vsav(): #pylint: disable=too-many-statements,too-many-locals
             "labels_unchanged": len(report["unchanged"]),
             "errors": errors,
         },
-    } )
+    }
+    if vsav_url:
+        results[ "vsav_url" ] = vsav_url
+    else:
+        results[ "vsav_data" ] = base64.b64encode( vsav_data ).decode( "utf-8" )
+    return jsonify( results )
+
+def _check_existing_labels( fname, snippets, players, test_mode, logger ): #pylint: disable=too-many-locals
+    """Check the labels already in a scenario against the snippets we've been given.
+
+    Returns the snippet ID's that might need a new label to be created for them (None if all of them might),
+    and if none of the labels need to be changed, the snippet ID's of the (unchanged) labels.
+
+    NOTE: This must match the logic in the VASSAL shim's updateScenario() and processSnippets().
+    """
+
+    # check if we should do this
+    if app.config.get( "DISABLE_INCREMENTAL_VSAV_UPDATE" ):
+        return None, None
+
+    # get the labels already in the scenario
+    start_time = time.time()
+    try:
+        our_labels, other_labels, has_player_owned_labels = get_vasl_templates_labels( fname, players )
+    except Exception as ex: #pylint: disable=broad-except
+        # NOTE: Don't let an error here stop the process, we just let the VASSAL shim do everything.
+        logger.warning( "Couldn't check the existing labels: %s", ex )
+        return None, None
+
+    def adjust_content( val ):
+        # NOTE: The VASSAL shim replaces newlines when it stores content in a label.
+        val = val.replace( "\n", " " )
+        if test_mode:
+            # NOTE: See the comments in _save_snippets() about "fuzzy" label comparisons.
+            val = re.sub( r"<style>.*?</style>", "{{{STYLE}}}", val )
+        return val
+
+    def find_legacy_label( raw_content ):
+        # NOTE: Legacy labels are matched using the raw content the user entered (see findLegacyLabel()).
+        if not raw_content:
+            return False
+        nmatches = 0
+        for label_fields in other_labels:
+            if all(
+                any( phrase.replace( "\n", " " ) in field for field in label_fields )
+                for phrase in raw_content
+            ):
+                nmatches += 1
+        return nmatches == 1
+
+    # check each snippet
+    new_snippet_ids = set()
+    unchanged_labels = []
+    is_changed = False
+    for snippet_id, snippet_info in snippets.items():
+        # NOTE: If the scenario doesn't have any player-owned labels, it was created by an older version
+        # of vasl-templates, and the VASSAL shim reverts the snippet ID's back to the old format.
+        label_id = snippet_id
+        if not has_player_owned_labels and "/" in label_id:
+            label_id = label_id[ label_id.find("/")+1: ]
+        if not label_id.startswith( "extras/" ):
+            label_content = our_labels.pop( label_id, None )
+            if label_content is not None:
+                # the snippet has a label - check if its content needs to be updated
+                if adjust_content( label_content ) == adjust_content( snippet_info["content"] ):
+                    unchanged_labels.append( label_id )
+                else:
+                    is_changed = True
+                continue
+            if find_legacy_label( snippet_info.get( "raw_content" ) ):
+                is_changed = True
+                continue
+        # the snippet doesn't have a label - check if one will be created for it
+        if snippet_info["auto_create"] and snippet_info["content"]:
+            new_snippet_ids.add( snippet_id )
+            is_changed = True
+
+    # check if any labels will be deleted
+    if any( not label_id.startswith( "extras/" ) for label_id in our_labels ):
+        is_changed = True
+
+    logger.debug( "Checked the existing labels (%.3fs): #new=%d ; #unchanged=%d ; changed=%s",
+        time.time() - start_time, len(new_snippet_ids), len(unchanged_labels), is_changed
+    )
+    return new_snippet_ids, None if is_changed else unchanged_labels
 
-def _save_snippets( snippets, players, fp, test_mode, logger ): #pylint: disable=too-many-locals
+def _save_snippets( snippets, players, fp, test_mode, new_snippet_ids, logger ): #pylint: disable=too-many-locals,too-many-arguments
     """Save the snippets in a file.
 
     NOTE: We save the snippets as XML because Java :-/
@@ -154,6 +276,19 @@ def _save_snippets( snippets, players, fp, test_mode, logger ): #pylint: disable
     # it down. The downside is that if the user has to disable the shared WebDriver, things
     # will run ridiculously slowly, since we will be launching a new webdriver for each snippet.
     # We optimize for the case where things work properly... :-/
+    # NOTE: The screenshots are taken in parallel, using the WebDriver pool, while we generate the XML.
+    # We then fill in each snippet's size, in order, once all the elements have been created.
+
+    def get_snippet_size( snippet_id, snippet ):
+        """Take a screenshot of a snippet, and return its size."""
+        # NOTE: Screenshots are cached, so if a snippet hasn't changed since last time, we won't need a WebDriver.
+        start_time = time.time()
+        _, img_size = get_snippet_image( snippet_id, snippet )
+        elapsed_time = time.time() - start_time
+        logger.debug( "Generated screenshot for %s (%.3fs): %dx%d",
+            snippet_id, elapsed_time, img_size[0], img_size[1]
+        )
+        return img_size
 
     # add the player details
     root = ET.Element( "snippets" )
@@ -168,43 +303,58 @@ def _save_snippets( snippets, players, fp, test_mode, logger ): #pylint: disable
         root.set( "fuzzyLabelCompares", "true" )
 
     # add the snippets
-    for snippet_id,snippet_info in snippets.items():
-
-        # add the next snippet
-        auto_create = "true" if snippet_info["auto_create"] else "false"
-        elem = ET.SubElement( root, "snippet", id=snippet_id, autoCreate=auto_create )
-        elem.text = snippet_info["content"]
-        label_area = snippet_info.get( "label_area" )
-        if label_area:
-            elem.set( "labelArea", label_area )
-
-        # add the raw content
-        elem2 = ET.SubElement( elem, "rawContent" )
-        for node in snippet_info.get( "raw_content", [] ):
-            ET.SubElement( elem2, "phrase" ).text = node
-
-        # include the size of the snippet
-        if not app.config.get( "DISABLE_UPDATE_VSAV_SCREENSHOTS" ):
-            with WebDriver.get_instance() as webdriver:
-                try:
-                    start_time = time.time()
-                    img = webdriver.get_snippet_screenshot( snippet_id, snippet_info["content"] )
-                    width, height = img.size
-                    elapsed_time = time.time() - start_time
-                    logger.debug( "Generated screenshot for %s (%.3fs): %dx%d",
-                        snippet_id, elapsed_time, width, height
-                    )
-                    # FUDGE! There's something weird going on in VASSAL e.g. "<table width=300>" gives us something
-                    # very different to "<table style='width:300px;'>" :-/ Changing the font size also causes problems.
-                    # The following fudging seems to give us something that's somewhat reasonable... :-/
-                    if re.search( r"width:\s*?\d+?px", snippet_info["content"] ):
-                        width = int( width * 140 / 100 )
-                    elem.set( "width", str(width) )
-                    elem.set( "height", str(height) )
-                except Exception as ex: #pylint: disable=broad-except
-                    # NOTE: Don't let an error here stop the process.
-                    logging.error( "Can't get snippet screenshot: %s", ex )
-                    logging.error( traceback.format_exc() )
+    take_screenshots = not app.config.get( "DISABLE_UPDATE_VSAV_SCREENSHOTS" )
+    nthreads = parse_int( app.config.get( "UPDATE_VSAV_SCREENSHOT_THREADS" ),
+        parse_int( app.config.get( "WEBDRIVER_POOL_SIZE" ), 2 )
+    )
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max( nthreads, 1 ), thread_name_prefix="snippet-screenshot"
+    ) if take_screenshots else None
+    try:
+        snippet_sizes = []
+        for snippet_id,snippet_info in snippets.items():
+
+            # add the next snippet
+            auto_create = "true" if snippet_info["auto_create"] else "false"
+            elem = ET.SubElement( root, "snippet", id=snippet_id, autoCreate=auto_create )
+            elem.text = snippet_info["content"]
+            label_area = snippet_info.get( "label_area" )
+            if label_area:
+                elem.set( "labelArea", label_area )
+
+            # add the raw content
+            elem2 = ET.SubElement( elem, "rawContent" )
+            for node in snippet_info.get( "raw_content", [] ):
+                ET.SubElement( elem2, "phrase" ).text = node
+
+            # start getting the size of the snippet
+            # NOTE: The VASSAL shim only uses this when it creates a new label, so we don't bother
+            # taking screenshots of snippets that already have a label in the scenario.
+            if executor and ( new_snippet_ids is None or snippet_id in new_snippet_ids ):
+                snippet_sizes.append( (
+                    elem, snippet_id, snippet_info,
+                    executor.submit( get_snippet_size, snippet_id, snippet_info["content"] )
+                ) )
+
+        # include the size of each snippet
+        for snippet_no, ( elem, snippet_id, snippet_info, future ) in enumerate( snippet_sizes ):
+            set_job_progress( "Generating snippet images ({}/{})...".format( 1+snippet_no, len(snippet_sizes) ) )
+            try:
+                width, height = future.result()
+                # FUDGE! There's something weird going on in VASSAL e.g. "<table width=300>" gives us something
+                # very different to "<table style='width:300px;'>" :-/ Changing the font size also causes problems.
+                # The following fudging seems to give us something that's somewhat reasonable... :-/
+                if re.search( r"width:\s*?\d+?px", snippet_info["content"] ):
+                    width = int( width * 140 / 100 )
+                elem.set( "width", str(width) )
+                elem.set( "height", str(height) )
+            except Exception as ex: #pylint: disable=broad-except
+                # NOTE: Don't let an error here stop the process.
+                logging.error( "Can't get snippet screenshot (%s): %s", snippet_id, ex )
+                logging.error( "".join( traceback.format_exception( type(ex), ex, ex.__traceback__ ) ) )
+    finally:
+        if executor:
+            executor.shutdown()
 
     ET.ElementTree( root ).write( fp )
     return root
@@ -236,36 +386,49 @@ def analyze_vsav(): #pylint: disable=too-many-locals
 
     # parse the request
     start_time = time.time()
-    vsav_data = request.json[ "vsav_data" ]
-    vsav_filename = request.json[ "filename" ]
+    params, _ = get_request_params()
+    vsav_filename = params[ "filename" ]
 
     # initialize
     logger = logging.getLogger( "analyze_vsav" )
 
     try:
 
-        # get the VSAV data (we do this inside the try block so that the user gets shown
-        # a proper error dialog if there's a problem decoding the base64 data)
-        vsav_data = base64.b64decode( vsav_data )
-        logger.info( "Analyzing VSAV (#bytes=%d): %s", len(vsav_data), vsav_filename )
-
         with TempFile() as input_file:
 
-            # save the VSAV data in a temp file
-            input_file.write( vsav_data )
+            # save the VSAV data in a temp file (we do this inside the try block so that the user gets shown
+            # a proper error dialog if there's a problem decoding the base64 data)
+            nbytes = save_uploaded_file( input_file, get_uploaded_file( params, "vsav_data" ) )
+            logger.info( "Analyzing VSAV (#bytes=%d): %s", nbytes, vsav_filename )
             input_file.close( delete=False )
-            fname = app.config.get( "ANALYZE_VSAV_INPUT" ) # nb: for diagnosing problems
-            if fname:
-                logger.debug( "Saving a copy of the VSAV data: %s", fname )
-                with open( fname, "wb" ) as fp:
-                    fp.write( vsav_data )
-
-            # run the VASSAL shim to analyze the VSAV file
-            with TempFile() as report_file:
-                report_file.close( delete=False )
-                vassal_shim = VassalShim()
-                vassal_shim.analyze_scenario( input_file.name, report_file.name )
-                report = _parse_analyze_report( report_file.name )
+            input_file.save_copy( # nb: for diagnosing problems
+                app.config.get( "ANALYZE_VSAV_INPUT" ), logger, "VSAV data"
+            )
+
+            # analyze the VSAV file
+            # NOTE: We normally parse the VSAV file ourself, which is much faster than starting up VASSAL,
+            # but the VASSAL shim can still be used (e.g. if there's a problem with our analysis).
+            analyzer = app.config.get( "VSAV_ANALYZER", "python" )
+            if analyzer not in ( "python", "java" ):
+                raise SimpleError( "Invalid VSAV analyzer: {}".format( analyzer ) )
+            cache_key = make_analysis_cache_key( "vsav", input_file.name, analyzer )
+            report = get_cached_analysis( cache_key )
+            if report is not None:
+                logger.debug( "Using the cached analysis: %s", cache_key )
+            else:
+                if analyzer == "python":
+                    report = analyze_saved_game( input_file.name )
+                else:
+                    with TempFile() as report_file:
+                        report_file.close( delete=False )
+                        vassal_shim = VassalShim()
+                        vassal_shim.analyze_scenario( input_file.name, report_file.name )
+                        report = _parse_analyze_report( report_file.name )
+                save_cached_analysis( cache_key, report )
+
+            # get the VSAV's module data
+            with zipfile.ZipFile( input_file.name ) as zfile:
+                module_data = zfile.read( "moduledata" )
 
     except Exception as ex: #pylint: disable=broad-except
 
@@ -289,11 +452,9 @@ def analyze_vsav(): #pylint: disable=too-many-locals
         elem = doc.find( "./{}".format( node_name ) )
         if elem is not None:
             report2[ key ] = elem.text
-    with zipfile.ZipFile( io.BytesIO( vsav_data ) ) as zfile:
-        module_data = zfile.read( "moduledata" )
-        doc = ET.parse( io.BytesIO( module_data ) )
-        get_node_text( "vassal_version", "VassalVersion" )
-        get_node_text( "vasl_version", "version" )
+    doc = ET.parse( io.BytesIO( module_data ) )
+    get_node_text( "vassal_version", "VassalVersion" )
+    get_node_text( "vasl_version", "version" )
 
     # return the results
     logger.info( "Analyzed the VSAV file OK: elapsed=%.3fs\n%s",
@@ -313,6 +474,71 @@ def _parse_analyze_report( fname ):
 
 # ---------------------------------------------------------------------
 
+def init_analysis_cache():
+    """Initialize the analysis cache."""
+    global _analysis_cache
+    _analysis_cache = None
+    dname = app.config.get( "ANALYSIS_CACHE_DIR" )
+    if dname in ( "disable", "disabled" ):
+        return
+    if not dname:
+        dname = os.path.join( tempfile.gettempdir(), "vasl-templates", "analysis-cache" )
+    max_size = parse_int( app.config.get( "ANALYSIS_CACHE_SIZE" ), 20 ) * 1024*1024
+    if max_size <= 0:
+        return
+    try:
+        _analysis_cache = DiskLruCache( "analysis", dname, max_size, extn=".json" )
+    except OSError as ex:
+        logging.getLogger( "vassal_shim" ).warning( "Can't initialize the analysis cache: %s\n- %s", dname, ex )
+
+def make_analysis_cache_key( analysis_type, fname, analyzer, extra=None ):
+    """Generate the cache key for the analysis of a VASL scenario or log file.
+
+    Returns None if the cache is not enabled.
+    """
+    if not _analysis_cache:
+        return None
+    # NOTE: As well as the file content, we include the VASL module/extensions and the VASSAL shim
+    # (since these can affect the results).
+    sha = hashlib.sha256()
+    with open( fname, "rb" ) as fp:
+        for buf in iter( lambda: fp.read( 64*1024 ), b"" ):
+            sha.update( buf )
+    def get_file_info( fname ): #pylint: disable=missing-docstring
+        if not fname or not os.path.isfile( fname ):
+            return fname
+        return [ fname, os.path.getmtime( fname ) ]
+    vasl_mod = globvars.vasl_mod
+    key_info = [
+        _ANALYSIS_CACHE_VERSION, analysis_type, analyzer, sha.hexdigest(), extra,
+        [
+            get_file_info( vasl_mod.filename ),
+            vasl_mod.vasl_real_version,
+            [ extn[0] for extn in vasl_mod.extns ]
+        ] if vasl_mod else None,
+        app.config.get( "VASSAL_DIR" ),
+        get_file_info( app.config.get( "VASSAL_SHIM" ) or VassalShim.get_default_shim_jar() ),
+        get_file_info( os.path.join( BASE_DIR, "config", "vassal-shim.properties" ) ),
+    ]
+    return hashlib.sha256( json.dumps( key_info, sort_keys=True ).encode( "utf-8" ) ).hexdigest()
+
+def get_cached_analysis( cache_key ):
+    """Get an analysis from the cache."""
+    if not cache_key or not _analysis_cache:
+        return None
+    val = _analysis_cache.get( cache_key )
+    if val is None:
+        return None
+    return json.loads( val.decode( "utf-8" ) )
+
+def save_cached_analysis( cache_key, report ):
+    """Save an analysis in the cache."""
+    if not cache_key or not _analysis_cache:
+        return
+    _analysis_cache.put( cache_key, json.dumps( report ).encode( "utf-8" ) )
+
+# ---------------------------------------------------------------------
+
 class VassalShim:
     """Provide access to VASSAL via the Java shim."""
 
@@ -334,13 +560,7 @@ class VassalShim:
             raise SimpleError( "Can't find Vengine.jar: {}".format( vassal_dir ) )
 
         # locate the VASSAL shim JAR
-        self.shim_jar = app.config.get( "VASSAL_SHIM" )
-        if not self.shim_jar:
-            if IS_FROZEN:
-                meipass = sys._MEIPASS #pylint: disable=no-member,protected-access
-                self.shim_jar = os.path.join( meipass, "vasl_templates/webapp/vassal-shim.jar" )
-            else:
-                self.shim_jar = os.path.join( os.path.split(__file__)[0], "../../vassal-shim/release/vassal-shim.jar" )
+        self.shim_jar = app.config.get( "VASSAL_SHIM" ) or self.get_default_shim_jar()
         if not os.path.isfile( self.shim_jar ):
             raise SimpleError( "Can't find the VASSAL shim JAR." )
 
@@ -352,6 +572,14 @@ class VassalShim:
         if os.path.isfile( fname ):
             shutil.copy( fname, os.path.split(self.shim_jar)[0] )
 
+    @staticmethod
+    def get_default_shim_jar():
+        """Get the default location of the VASSAL shim JAR."""
+        if IS_FROZEN:
+            meipass = sys._MEIPASS #pylint: disable=no-member,protected-access
+            return os.path.join( meipass, "vasl_templates/webapp/vassal-shim.jar" )
+        return os.path.join( os.path.split(__file__)[0], "../../vassal-shim/release/vassal-shim.jar" )
+
     @staticmethod
     def get_version():
         """Get the VASSAL version."""
@@ -443,10 +671,8 @@ class VassalShim:
                 class_path.append( BASE_DIR ) # nb: also to find logback(-test).xml
             sep = ";" if os.name == "nt" else ":"
             class_path = sep.join( class_path )
-        args2 = [
-            java_path, "-classpath", class_path, "vassal_shim.Main",
-            args[0]
-        ]
+        java_cmd = [ java_path, "-classpath", class_path, "vassal_shim.Main" ]
+        args2 = java_cmd + [ args[0] ]
         if args[0] in ("dump","analyze","analyzeLogs","update","prepareUpload"):
             if not globvars.vasl_mod:
                 raise SimpleError( "The VASL module has not been configured." )
@@ -460,6 +686,15 @@ class VassalShim:
         if timeout <= 0:
             timeout = None
 
+        # check if we can use a VASSAL shim daemon
+        if _can_use_vassal_shim_daemon( args ):
+            config_fname = os.path.join( os.path.split( self.shim_jar )[0], "vassal-shim.properties" )
+            stdout = _run_vassal_shim_daemon( java_cmd, globvars.vasl_mod.filename, config_fname,
+                args, timeout, logger
+            )
+            if stdout is not None:
+                return stdout
+
         # run the VASSAL shim
         logger.info( "Running VASSAL shim (timeout=%s): %s", str(timeout), " ".join(args2) )
         start_time = time.time()
@@ -603,6 +838,257 @@ class VassalShim:
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+# NOTE: Starting the VASSAL shim means starting a JVM, then loading VASSAL and the VASL module, which takes
+# several seconds, every time. If VASSAL_SHIM_DAEMONS is set, we instead keep that many copies of the VASSAL shim
+# running (in daemon mode), with the VASL module loaded, and send them commands. If a daemon can't be started
+# (e.g. the VASSAL shim JAR is too old to support daemon mode), we fall back to running the VASSAL shim normally.
+
+_DAEMON_COMMANDS = ( "dump", "analyze", "analyzeLogs", "update", "prepareUpload" )
+_DAEMON_RESPONSE_MARKER = "@@vassal-shim-daemon@@" # nb: this must match the Java code
+
+_vassal_shim_daemons_cond = threading.Condition()
+_vassal_shim_daemons = {} # nb: key => { "idle": [...], "nrunning": N }
+_curr_vassal_shim_daemons_key = None
+_failed_vassal_shim_daemons = set()
+
+def _can_use_vassal_shim_daemon( args ):
+    """Check if a command can be sent to a VASSAL shim daemon."""
+    if args[0] not in _DAEMON_COMMANDS:
+        return False
+    if parse_int( app.config.get( "VASSAL_SHIM_DAEMONS" ), 0 ) <= 0:
+        return False
+    # NOTE: We need pipes to talk to the daemon, and these don't work when we're frozen on Windows
+    # (see the comments in _run_vassal_shim()).
+    if os.name == "nt" and IS_FROZEN:
+        return False
+    # NOTE: Commands are sent as a single line, with the arguments separated by tabs.
+    return not any( "\t" in arg or "\n" in arg for arg in args )
+
+def _run_vassal_shim_daemon( java_cmd, vmod_fname, config_fname, args, timeout, logger ):
+    """Run a command in a VASSAL shim daemon.
+
+    Returns the command's stdout, or None if a daemon couldn't be started.
+    """
+
+    # NOTE: If the VASL module (or the JAR's) change, we need new daemons. A daemon also keeps the settings
+    # it loaded from its config file, and the boards directory it configured in VASSAL's preferences,
+    # for as long as it runs, so if either of these change, we also need new daemons.
+    key = json.dumps( [
+        java_cmd, vmod_fname, os.path.getmtime( vmod_fname ),
+        os.path.getmtime( config_fname ) if os.path.isfile( config_fname ) else None,
+        app.config.get( "BOARDS_DIR" ),
+    ] )
+    if key in _failed_vassal_shim_daemons:
+        return None
+
+    # get a daemon
+    daemon = _checkout_vassal_shim_daemon( key )
+    if not daemon:
+        try:
+            start_time = time.time()
+            daemon = _VassalShimDaemon( java_cmd, vmod_fname, timeout )
+            logger.info( "Started VASSAL shim daemon (pid=%d): %.3fs", daemon.proc.pid, time.time()-start_time )
+        except Exception as ex: #pylint: disable=broad-except
+            logger.warning( "Can't start the VASSAL shim daemon, falling back to normal mode: %s", ex )
+            with _vassal_shim_daemons_cond:
+                _failed_vassal_shim_daemons.add( key )
+                _vassal_shim_daemons[ key ][ "nrunning" ] -= 1
+                _vassal_shim_daemons_cond.notify_all()
+            return None
+
+    # run the command
+    ok = False
+    try:
+        logger.info( "Running VASSAL shim daemon (pid=%d, timeout=%s): %s",
+            daemon.proc.pid, str(timeout), " ".join( args )
+        )
+        start_time = time.time()
+        rc, stdout, stderr = daemon.run( args, timeout )
+        logger.info( "- Completed OK: %.3fs", time.time() - start_time )
+        ok = daemon.is_alive()
+    finally:
+        _checkin_vassal_shim_daemon( key, daemon, ok )
+
+    # check the result
+    # NOTE: We handle stderr output in the same way as _run_vassal_shim().
+    if stderr:
+        logger.warning( "VASSAL shim stderr output:\n%s", stderr )
+    if rc != 0:
+        raise VassalShimError( rc, stdout, stderr )
+    return stdout
+
+def _checkout_vassal_shim_daemon( key ):
+    """Check out a VASSAL shim daemon.
+
+    Returns None if the caller should start a new one.
+    """
+    global _curr_vassal_shim_daemons_key
+    max_daemons = max( parse_int( app.config.get( "VASSAL_SHIM_DAEMONS" ), 1 ), 1 )
+    stale_daemons = []
+    with _vassal_shim_daemons_cond:
+        if not _vassal_shim_daemons:
+            atexit.register( shutdown_vassal_shim_daemons )
+            globvars.cleanup_handlers.append( shutdown_vassal_shim_daemons )
+        if key != _curr_vassal_shim_daemons_key:
+            # NOTE: The daemons for the previous key are out-of-date, so we stop the idle ones now,
+            # and the busy ones when they get checked in.
+            for pool in _vassal_shim_daemons.values():
+                stale_daemons.extend( pool["idle"] )
+                pool["nrunning"] -= len( pool["idle"] )
+                pool["idle"] = []
+            _curr_vassal_shim_daemons_key = key
+        pool = _vassal_shim_daemons.setdefault( key, { "idle": [], "nrunning": 0 } )
+    for daemon in stale_daemons:
+        daemon.stop()
+    with _vassal_shim_daemons_cond:
+        while True:
+            if pool["idle"]:
+                return pool["idle"].pop()
+            if pool["nrunning"] < max_daemons:
+                pool["nrunning"] += 1
+                return None
+            _vassal_shim_daemons_cond.wait()
+
+def _checkin_vassal_shim_daemon( key, daemon, ok ):
+    """Return a VASSAL shim daemon to the pool."""
+    with _vassal_shim_daemons_cond:
+        pool = _vassal_shim_daemons[ key ]
+        if key != _curr_vassal_shim_daemons_key:
+            ok = False # nb: the daemon is out-of-date
+        if ok:
+            pool["idle"].append( daemon )
+        else:
+            # NOTE: The daemon crashed (or timed out, or is out-of-date), so we get rid of it.
+            # A new one will be started the next time one is needed.
+            pool["nrunning"] -= 1
+        _vassal_shim_daemons_cond.notify_all()
+    if not ok:
+        daemon.stop()
+
+def shutdown_vassal_shim_daemons():
+    """Stop all the VASSAL shim daemons."""
+    with _vassal_shim_daemons_cond:
+        daemons = []
+        for pool in _vassal_shim_daemons.values():
+            daemons.extend( pool["idle"] )
+            pool["nrunning"] -= len( pool["idle"] )
+            pool["idle"] = []
+    for daemon in daemons:
+        daemon.stop()
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class _VassalShimDaemon:
+    """Manage a VASSAL shim running in daemon mode."""
+
+    def __init__( self, java_cmd, vmod_fname, timeout ):
+
+        # start the daemon
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = 0x8000000 # nb: win32process.CREATE_NO_WINDOW
+        self.proc = subprocess.Popen( #pylint: disable=consider-using-with
+            java_cmd + [ "daemon", vmod_fname ],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            encoding="utf-8", errors="replace",
+            **kwargs
+        )
+
+        # start threads to read the daemon's output
+        # NOTE: We collect stdout line-by-line (so that we can wait for responses with a timeout),
+        # and keep stderr in a buffer that we empty after each command.
+        self._stdout = queue.Queue()
+        self._stderr = []
+        self._stderr_lock = threading.Lock()
+        def read_stdout(): #pylint: disable=missing-docstring
+            for line in self.proc.stdout:
+                self._stdout.put( line )
+            self._stdout.put( None )
+        def read_stderr(): #pylint: disable=missing-docstring
+            for line in self.proc.stderr:
+                with self._stderr_lock:
+                    self._stderr.append( line )
+        threading.Thread( target=read_stdout, daemon=True ).start()
+        threading.Thread( target=read_stderr, daemon=True ).start()
+
+        # wait for the daemon to load the VASL module
+        try:
+            rc, stdout, stderr = self._read_response( timeout )
+        except Exception:
+            self.stop()
+            raise
+        if rc != "ready":
+            self.stop()
+            raise VassalShimError( self.proc.returncode or -1, stdout, stderr )
+
+    def run( self, args, timeout ):
+        """Run a command."""
+        try:
+            self.proc.stdin.write( "\t".join( args ) + "\n" )
+            self.proc.stdin.flush()
+        except OSError as ex:
+            # NOTE: The daemon must have died.
+            stdout, stderr = self._get_output( [] )
+            raise VassalShimError( self.proc.poll() or -1, stdout, stderr ) from ex
+        rc, stdout, stderr = self._read_response( timeout )
+        if rc is None:
+            # NOTE: The daemon died while running the command.
+            return self.proc.wait(), stdout, stderr
+        mo = re.search( r"^rc=(-?\d+)( restart)?$", rc )
+        if not mo:
+            # NOTE: We don't know what state the daemon is in, so we stop it.
+            self.stop()
+            raise VassalShimError( -1, stdout, "Unexpected response from the VASSAL shim daemon: {}\n{}".format(
+                rc, stderr
+            ).strip() )
+        if mo.group( 2 ):
+            self.stop()
+        return int( mo.group(1) ), stdout, stderr
+
+    def _read_response( self, timeout ):
+        """Read a response from the daemon."""
+        lines = []
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            try:
+                line = self._stdout.get( timeout = max( deadline - time.time(), 0 ) if deadline else None )
+            except queue.Empty as ex:
+                # NOTE: We kill the daemon, since we don't know what state it's in.
+                self.stop()
+                raise subprocess.TimeoutExpired( self.proc.args, timeout ) from ex
+            if line is None:
+                # NOTE: The daemon has exited.
+                self.proc.wait()
+                return ( None, ) + self._get_output( lines )
+            if line.startswith( _DAEMON_RESPONSE_MARKER ):
+                return ( line[ len(_DAEMON_RESPONSE_MARKER): ].strip(), ) + self._get_output( lines )
+            lines.append( line )
+
+    def _get_output( self, lines ):
+        """Get the output for the current command."""
+        with self._stderr_lock:
+            stderr, self._stderr = self._stderr, []
+        stderr = "".join( stderr ).replace( "Warning: Could not get charToByteConverterClass!", "" ).strip()
+        return "".join( lines ), stderr
+
+    def is_alive( self ):
+        """Check if the daemon is still running."""
+        return self.proc.poll() is None
+
+    def stop( self ):
+        """Stop the daemon."""
+        if not self.is_alive():
+            return
+        try:
+            self.proc.stdin.write( "quit\n" )
+            self.proc.stdin.flush()
+            self.proc.wait( 5 )
+        except Exception: #pylint: disable=broad-except
+            self.proc.kill()
+            self.proc.wait()
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
 class VassalShimError( Exception ):
     """Represents an error returned by the VASSAL shim."""
 
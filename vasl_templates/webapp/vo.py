@@ -2,28 +2,35 @@
 
 import os
 import json
-import copy
+import hashlib
+import logging
 
 from flask import request, render_template, send_file, jsonify, abort
 
 from vasl_templates.webapp import app, globvars
-from vasl_templates.webapp.config.constants import DATA_DIR
+from vasl_templates.webapp.config.constants import DATA_DIR, APP_VERSION
+from vasl_templates.webapp.utils import MsgStore, LruCache, PreparedResponse, parse_int
 from vasl_templates.webapp.vo_utils import copy_vo_entry, add_vo_comments, apply_extn_info,  make_vo_index
 from vasl_templates.webapp import vo_utils as webapp_vo_utils
 
 _kfw_listings = { "vehicles": {}, "ordnance": {} }
 
+_prepared_listings = {}
+_filtered_listings_cache = None
+
+_COMPILED_VO_LISTINGS_VERSION = 1
+
 # ---------------------------------------------------------------------
 
 @app.route( "/vehicles" )
 def get_vehicle_listings():
     """Return the vehicle listings."""
-    return jsonify( _do_get_listings( "vehicles" ) )
+    return _do_get_listings( "vehicles" )
 
 @app.route( "/ordnance" )
 def get_ordnance_listings():
     """Return the ordnance listings."""
-    return jsonify( _do_get_listings( "ordnance" ) )
+    return _do_get_listings( "ordnance" )
 
 def _do_get_listings( vo_type ):
     """Return the vehicle/ordnance listings."""
@@ -31,28 +38,203 @@ def _do_get_listings( vo_type ):
         # nb: this is the normal case
         if not globvars.vo_listings:
             abort( 404 )
-        return globvars.vo_listings[ vo_type ]
+        # check if the caller only wants some of the nationalities
+        if request.args.get( "nat" ):
+            return _get_filtered_listings( vo_type,
+                request.args.get( "nat" ), request.args.get( "theater" ), parse_int( request.args.get( "year" ) )
+            ).make_response()
+        # NOTE: The listings are large, and don't change once they've been loaded, so we return
+        # the payload that was prepared (and compressed) when they were loaded.
+        return _prepared_listings[ vo_type ].make_response()
     else:
         # nb: we should only get here during tests
-        return _do_load_vo_listings(
+        return jsonify( _do_load_vo_listings(
             globvars.vasl_mod, vo_type,
             request.args.get("merge_common") == "1", request.args.get("report") == "1",
             None
-        )
+        ) )
+
+def _get_filtered_listings( vo_type, nats, theater, year ):
+    """Return the vehicle/ordnance listings for the specified nationalities."""
+
+    # check if we've already prepared these listings
+    nats = sorted( set( nat.strip() for nat in nats.split( "," ) if nat.strip() ) )
+    theater = theater.strip().lower() if theater else None
+    key = ( vo_type, tuple(nats), theater, year )
+    prepared_listings = _filtered_listings_cache.get( key )
+    if prepared_listings:
+        return prepared_listings
+
+    # filter the listings
+    # NOTE: The K:FW vehicles/ordnance are merged into the American and British listings, but they are
+    # only relevant to scenarios set in Korea (1950-53), so we drop them if we know we won't need them.
+    drop_kfw = ( theater and theater != "korea" ) or ( year and year < 1950 )
+    listings = {}
+    for nat in nats:
+        vo_entries = globvars.vo_listings[ vo_type ].get( nat )
+        if vo_entries is None:
+            continue
+        if drop_kfw and not nat.startswith( "kfw-" ):
+            vo_entries = [ e for e in vo_entries if not e["id"].startswith( "kfw-" ) ]
+        listings[ nat ] = vo_entries
+
+    # prepare the response
+    prepared_listings = PreparedResponse.from_json( listings )
+    _filtered_listings_cache.put( key, prepared_listings )
+    return prepared_listings
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def load_vo_listings( msg_store ):
     """Load and install the vehicle/ordnance listings."""
     globvars.vo_listings = get_vo_listings( globvars.vasl_mod, msg_store )
+    # prepare the responses for the listings
+    for vo_type in ( "vehicles", "ordnance" ):
+        _prepared_listings[ vo_type ] = PreparedResponse.from_json( globvars.vo_listings[ vo_type ] )
+    global _filtered_listings_cache
+    _filtered_listings_cache = LruCache( "vo-listings",
+        parse_int( app.config.get( "VO_LISTINGS_CACHE_SIZE" ), 5 ) * 1024*1024,
+        lambda prepared_listings: prepared_listings.size
+    )
 
 def get_vo_listings( vasl_mod, msg_store ):
     """Get the vehicle/ordnance listings."""
+    # check if we have compiled listings for the VASL module and extensions
+    listings = _load_compiled_vo_listings( vasl_mod, msg_store )
+    if listings:
+        return listings
+    return _do_get_vo_listings( vasl_mod, msg_store )
+
+def _do_get_vo_listings( vasl_mod, msg_store ):
+    """Load the vehicle/ordnance listings from our data files."""
     return {
         "vehicles": _do_load_vo_listings( vasl_mod, "vehicles", True, False, msg_store ),
         "ordnance": _do_load_vo_listings( vasl_mod, "ordnance", True, False, msg_store )
     }
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def compile_vo_listings( vasl_mod, dname ):
+    """Compile the vehicle/ordnance listings for a VASL module and its extensions, and save them to a file."""
+
+    # load the vehicle/ordnance listings
+    # NOTE: We save any warnings that were issued, so that they can be re-issued when the listings are loaded.
+    msg_store = MsgStore()
+    listings = _do_get_vo_listings( vasl_mod, msg_store )
+
+    # save the compiled listings
+    compiled_listings = {
+        "version": _COMPILED_VO_LISTINGS_VERSION,
+        "inputsHash": _get_vo_listings_inputs_hash( vasl_mod ),
+        "vaslVersion": vasl_mod.vasl_real_version if vasl_mod else None,
+        "extensions": [
+            "{}/{}".format( extn[1]["extensionId"], extn[1]["version"] )
+            for extn in vasl_mod.get_extns()
+        ] if vasl_mod else [],
+        "warnings": msg_store.get_msgs( "warning" ),
+        "listings": listings,
+    }
+    fname = _get_compiled_vo_listings_fname( dname, vasl_mod )
+    os.makedirs( dname, exist_ok=True )
+    # NOTE: We write to a temp file, then rename it into place, so that a concurrent (or crashed)
+    # instance of the program will never see a partially-written file.
+    temp_fname = "{}.{}.tmp".format( fname, os.getpid() )
+    try:
+        with open( temp_fname, "w", encoding="utf-8" ) as fp:
+            json.dump( compiled_listings, fp, sort_keys=True, separators=(",",":") )
+        os.replace( temp_fname, fname )
+    finally:
+        if os.path.isfile( temp_fname ):
+            os.unlink( temp_fname )
+
+    return fname
+
+def _load_compiled_vo_listings( vasl_mod, msg_store ):
+    """Load compiled vehicle/ordnance listings."""
+
+    # check if we have compiled listings for the VASL module and extensions
+    dname = get_compiled_vo_listings_dname()
+    if not dname:
+        return None
+    fname = _get_compiled_vo_listings_fname( dname, vasl_mod )
+    if not os.path.isfile( fname ):
+        return None
+    logger = logging.getLogger( "vo" )
+    with open( fname, "r", encoding="utf-8" ) as fp:
+        compiled_listings = json.load( fp )
+
+    # check that the compiled listings are up-to-date
+    # NOTE: If any of the data files they were compiled from have changed, we ignore them
+    # and load the listings dynamically, as normal.
+    if compiled_listings.get( "version" ) != _COMPILED_VO_LISTINGS_VERSION \
+       or compiled_listings.get( "inputsHash" ) != _get_vo_listings_inputs_hash( vasl_mod ):
+        logger.info( "Ignoring out-of-date compiled vehicle/ordnance listings: %s", fname )
+        return None
+
+    # re-issue any warnings that were issued when the listings were compiled
+    if msg_store:
+        for msg in compiled_listings[ "warnings" ]:
+            msg_store.warning( msg )
+
+    logger.info( "Loaded compiled vehicle/ordnance listings: %s", fname )
+    return compiled_listings[ "listings" ]
+
+def get_compiled_vo_listings_dname():
+    """Get the directory that contains the compiled vehicle/ordnance listings."""
+    dname = app.config.get( "COMPILED_VO_LISTINGS_DIR" )
+    if dname in ( "disable", "disabled" ):
+        return None
+    return dname or os.path.join( DATA_DIR, "compiled-vo-listings" )
+
+def _get_compiled_vo_listings_fname( dname, vasl_mod ):
+    """Get the name of the file that contains the compiled vehicle/ordnance listings."""
+    # NOTE: Listings are compiled for each version of VASL and set of extensions.
+    if not vasl_mod:
+        return os.path.join( dname, "vo-listings.json" )
+    key = vasl_mod.vasl_real_version
+    extns = sorted(
+        "{}/{}".format( extn[1]["extensionId"], extn[1]["version"] )
+        for extn in vasl_mod.get_extns()
+    )
+    if extns:
+        key += "-" + hashlib.md5( "|".join( extns ).encode( "utf-8" ) ).hexdigest()[:8]
+    return os.path.join( dname, "vo-listings-{}.json".format( key ) )
+
+def _get_vo_listings_inputs_hash( vasl_mod ):
+    """Generate a hash of everything that the vehicle/ordnance listings are generated from."""
+
+    # initialize
+    hasher = hashlib.sha1()
+    def add_val( val ): #pylint: disable=missing-docstring
+        hasher.update( json.dumps( val, sort_keys=True ).encode( "utf-8" ) )
+    add_val( [ _COMPILED_VO_LISTINGS_VERSION, APP_VERSION ] )
+
+    # add the data files
+    data_dir = app.config.get( "DATA_DIR", DATA_DIR )
+    fnames = [ os.path.join( data_dir, "vo-comments.json" ) ]
+    for vo_type in ( "vehicles", "ordnance" ):
+        for root,_,fnames2 in os.walk( os.path.join( data_dir, vo_type ) ):
+            fnames.extend( os.path.join( root, fname ) for fname in fnames2 if fname.endswith( ".json" ) )
+    for fname in sorted( fnames ):
+        add_val( os.path.relpath( fname, data_dir ).replace( "\\", "/" ) )
+        with open( fname, "rb" ) as fp:
+            hasher.update( fp.read() )
+
+    # add the nationality types (these affect how comments are generated)
+    if globvars.template_pack:
+        add_val( {
+            nat: nat_info.get( "type" )
+            for nat, nat_info in globvars.template_pack[ "nationalities" ].items() #pylint: disable=unsubscriptable-object
+        } )
+
+    # add the VASL module and extensions
+    if vasl_mod:
+        add_val( vasl_mod.vasl_real_version )
+        for extn in vasl_mod.get_extns():
+            add_val( extn[1] )
+
+    return hasher.hexdigest()
+
 def _do_load_vo_listings( vasl_mod, vo_type, merge_common, real_data_dir, msg_store ): #pylint: disable=too-many-locals,too-many-branches,too-many-statements
     """Load the vehicle/ordnance listings."""
 
@@ -104,8 +286,10 @@ def _do_load_vo_listings( vasl_mod, vo_type, merge_common, real_data_dir, msg_st
         for minor_type in ( "allied-minor", "axis-minor" ):
             if minor_type+"-common" not in listings:
                 continue
+            # NOTE: Comments are generated for each nationality (since they sometimes depend on it), so each one
+            # gets its own copy of each entry, but the rest of the entry (e.g. capabilities) is shared.
             for nat in minor_nats[minor_type]:
-                listings[nat].extend( copy.deepcopy( listings[minor_type+"-common"] ) )
+                listings[nat].extend( dict(vo_entry) for vo_entry in listings[minor_type+"-common"] )
             del listings[ minor_type+"-common" ]
 
     # add vehicle/ordnance comments (based on what notes they have)
@@ -137,7 +321,7 @@ def _do_load_vo_listings( vasl_mod, vo_type, merge_common, real_data_dir, msg_st
                 # FUDGE! Landing Craft get appended to the vehicles for the Japanese/American/British,
                 # so we need to tag the note numbers so that they refer to the *Landing Craft* note,
                 # not the Japanese/American/British vehicle note.
-                lc = copy.deepcopy( lc )
+                lc = dict( lc ) # nb: we only change top-level values, so we don't need a deep copy
                 if "note_number" in lc:
                     lc["note_number"] = "LC {}".format( lc["note_number"] )
                 if lc["name"] in ("Daihatsu","Shohatsu"):
@@ -5,7 +5,7 @@ import os
 import io
 import re
 import json
-import copy
+import hashlib
 import logging
 import urllib.request
 from collections import defaultdict
@@ -15,9 +15,12 @@ from flask import request, render_template, jsonify, send_file, abort, redirect,
 from vasl_templates.webapp import app, globvars
 from vasl_templates.webapp.files import FileServer
 from vasl_templates.webapp.webdriver import WebDriver
-from vasl_templates.webapp.utils import read_text_file, resize_image_response, is_image_file, is_empty_file
+from vasl_templates.webapp.utils import LruCache, read_text_file, resize_image_response, is_image_file, parse_int
 
 _vo_notes_image_cache_dname = None
+_vo_note_content_cache = None
+_chapter_h_index_cache_dname = None
+_CHAPTER_H_INDEX_CACHE_VERSION = 2
 
 _asl_rulebook2_targets = None
 _asl_rulebook2_target_url_template = None
@@ -62,6 +65,14 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
         return
     file_server = FileServer( dname )
 
+    # initialize the cache for the content of HTML vehicle/ordnance notes
+    # NOTE: We only load these when they are needed (see get_vo_note_content()).
+    global _vo_note_content_cache
+    _vo_note_content_cache = LruCache( "vo-notes",
+        parse_int( app.config.get( "VO_NOTES_CACHE_SIZE" ), 5 ) * 1024*1024,
+        lambda val: len( val[1] )
+    )
+
     # generate a list of extension ID's
     extn_ids = set()
     if globvars.vasl_mod:
@@ -92,12 +103,15 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
     # multi-applicable notes, so we force them to appear in the final results.
     vo_notes["vehicles"]["british~anzac"] = {}
     vo_notes["ordnance"]["indonesian"] = {}
-    vo_note_layout_width = app.config.get( "VO_NOTE_LAYOUT_WIDTH", 500 )
+
+    # scan the Chapter H directory
+    chapter_h_index = ChapterHIndex( dname )
 
     # load the vehicle/ordnance notes
-    for root,_,fnames in os.walk( dname, followlinks=True ):
+    for rel_root, dir_info in chapter_h_index.dirs.items():
 
         # initialize
+        root = os.path.join( dname, *rel_root.split("/") ) if rel_root else dname
         dname2, vo_type2 = os.path.split( root )
         if vo_type2 in extn_ids:
             extn_id = vo_type2
@@ -116,12 +130,10 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
 
         # process each file in the next directory
         ma_notes = {}
-        for fname in fnames:
+        for fname, (fsize, mtime) in dir_info["files"].items():
 
-            # ignore placeholder files
+            # NOTE: The index doesn't include placeholder (empty) files.
             fname = os.path.join( root, fname )
-            if is_empty_file( fname ):
-                continue
 
             # figure out what kind of file we have
             extn = os.path.splitext( fname )[1].lower()
@@ -145,47 +157,29 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
 
             elif extn == ".html":
 
-                # HTML file - read the content
-                fname = os.path.join( root, fname )
-                html_content = read_text_file( fname ).strip()
-                if "&half;" in html_content:
-                    # NOTE: VASSAL doesn't like this, use "frac12;" :-/
-                    logging.warning( "Found &half; in HTML: %s", fname )
-
-                # check what kind of file we have
+                # HTML file - check what kind of file we have
                 key = get_ma_note_key( nat2, os.path.split(fname)[1] )
                 if re.search( r"^\d+(\.\d+)?$", key ):
 
-                    # FUDGE! The HTML version of the Chapter H content contain a lot of notes
-                    # that start with "<p> &dagger;". We detect these and add a CSS class.
-                    # Larger blocks of content need to be wrapped in a <div>.
-                    html_content = re.sub( r"^<(p|div)>\s*&dagger;", r"<\1 class='dagger-note'> &dagger;",
-                        html_content,
-                        flags=re.MULTILINE
-                    )
-
-                    # check if the content is specifying its own layout
-                    if "<!-- vasl-templates:manual-layout -->" not in html_content:
-                        # nope - use the default one
-                        html_content = "<table width='{}'><tr><td>\n{}\n</table>".format(
-                            vo_note_layout_width, html_content
-                        )
-
                     # save it as a vehicle/ordnance note
+                    # NOTE: We don't load the content now, since there can be a lot of these files,
+                    # and only a few of them will typically be used.
                     if extn_id:
                         key = "{}:{}".format( extn_id, key )
-                    rel_path = os.path.relpath( os.path.split(fname)[0], dname )
+                    rel_path = os.path.relpath( fname, dname )
                     vo_notes[ vo_type2 ][ nat2 ][ key ] = {
-                        "filename": fname,
-                        "content": _fixup_urls(
-                            html_content,
-                            "{{CHAPTER_H}}/" + rel_path.replace( "\\", "/" ) + "/"
-                        )
+                        "filename": rel_path.replace( "\\", "/" ),
+                        "html": True,
+                        "size": fsize,
+                        "mtime": mtime,
                     }
 
                 else:
 
                     # save it as a multi-applicable note
+                    # NOTE: We always load these from disk (they're not stored in the index), since changing
+                    # a file's content doesn't update its directory's mtime. There are only a few of them.
+                    html_content = _read_html_file( fname )
                     if extn_id:
                         key = "{}:{}".format( extn_id, key )
                     if html_content.startswith( "<p>" ):
@@ -204,15 +198,16 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
     # update nationality variants with the notes from their base nationality
     for vo_type2, vo_notes2 in vo_notes.items():
         # FUDGE! Some nationalities don't have any vehicles/ordnance of their own, so we have to do this manually.
-        # NOTE: We do a deep copy so that these new nationalities don't get affected by changes we make
-        # to the base nationality later (e.g. adding K:FW counters to the British).
+        # NOTE: We copy the notes so that these new nationalities don't get affected by changes we make
+        # to the base nationality later (e.g. adding K:FW counters to the British). However, these changes
+        # only ever add notes, so the notes themselves (which can be large) are shared.
         if "chinese" in vo_notes2:
-            vo_notes2["chinese~gmd"] = copy.deepcopy( vo_notes2["chinese"] )
+            vo_notes2["chinese~gmd"] = _copy_nat_vo_notes( vo_notes2["chinese"] )
         if "british" in vo_notes2:
-            vo_notes2["british~canadian"] = copy.deepcopy( vo_notes2["british"] )
-            vo_notes2["british~newzealand"] = copy.deepcopy( vo_notes2["british"] )
-            vo_notes2["british~australian"] = copy.deepcopy( vo_notes2["british"] )
-            vo_notes2["british~anzac"] = copy.deepcopy( vo_notes2["british"] )
+            vo_notes2["british~canadian"] = _copy_nat_vo_notes( vo_notes2["british"] )
+            vo_notes2["british~newzealand"] = _copy_nat_vo_notes( vo_notes2["british"] )
+            vo_notes2["british~australian"] = _copy_nat_vo_notes( vo_notes2["british"] )
+            vo_notes2["british~anzac"] = _copy_nat_vo_notes( vo_notes2["british"] )
 
     def install_kfw_vo_notes( nat, vo_type, extn_id, include ):
         """Install the K:FW vehicle/ordnance notes into the specified nationality."""
@@ -265,10 +260,80 @@ def load_vo_notes( msg_store ): #pylint: disable=too-many-statements,too-many-lo
     install_kfw_vo_notes( "kfw-kpa", "ordnance", "kfw-comm", lambda key: key <= 15 )
     install_kfw_vo_notes( "kfw-cpva", "ordnance", "kfw-comm", lambda key: key >= 16 )
 
+    # save the Chapter H index (if it changed)
+    chapter_h_index.save()
+
     # install the vehicle/ordnance notes
     globvars.vo_notes = { k: dict(v) for k,v in vo_notes.items() }
     globvars.vo_notes_file_server = file_server
 
+def get_vo_note_content( vo_note ):
+    """Get the content of an HTML vehicle/ordnance note.
+
+    Returns None if the note's file no longer exists.
+    """
+
+    # check if we have the content cached
+    # NOTE: We check the file's timestamp, so that we will pick up any changes made to it.
+    fname = _get_vo_note_fname( vo_note )
+    try:
+        mtime = os.path.getmtime( fname )
+    except OSError:
+        return None
+    cached = _vo_note_content_cache.get( fname )
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    # load the content
+    html_content = _read_html_file( fname )
+
+    # FUDGE! The HTML version of the Chapter H content contain a lot of notes
+    # that start with "<p> &dagger;". We detect these and add a CSS class.
+    # Larger blocks of content need to be wrapped in a <div>.
+    html_content = re.sub( r"^<(p|div)>\s*&dagger;", r"<\1 class='dagger-note'> &dagger;",
+        html_content,
+        flags=re.MULTILINE
+    )
+
+    # check if the content is specifying its own layout
+    if "<!-- vasl-templates:manual-layout -->" not in html_content:
+        # nope - use the default one
+        html_content = "<table width='{}'><tr><td>\n{}\n</table>".format(
+            app.config.get( "VO_NOTE_LAYOUT_WIDTH", 500 ), html_content
+        )
+
+    # fixup any URL's
+    rel_path = os.path.relpath( os.path.split(fname)[0], globvars.vo_notes_file_server.base_dir )
+    html_content = _fixup_urls(
+        html_content,
+        "{{CHAPTER_H}}/" + rel_path.replace( "\\", "/" ) + "/"
+    )
+
+    # save the content in the cache
+    _vo_note_content_cache.put( fname, ( mtime, html_content ) )
+
+    return html_content
+
+def _get_vo_note_fname( vo_note ):
+    """Get the full path of a vehicle/ordnance note's file."""
+    # NOTE: We only store the path relative to the Chapter H directory, since the notes get sent to the browser.
+    return os.path.join( globvars.vo_notes_file_server.base_dir, *vo_note["filename"].split( "/" ) )
+
+def _read_html_file( fname ):
+    """Read a Chapter H HTML file."""
+    html_content = read_text_file( fname ).strip()
+    if "&half;" in html_content:
+        # NOTE: VASSAL doesn't like this, use "frac12;" :-/
+        logging.warning( "Found &half; in HTML: %s", fname )
+    return html_content
+
+def _copy_nat_vo_notes( vo_notes ):
+    """Copy a nationality's vehicle/ordnance notes."""
+    vo_notes = dict( vo_notes )
+    if "multi-applicable" in vo_notes:
+        vo_notes[ "multi-applicable" ] = dict( vo_notes[ "multi-applicable" ] )
+    return vo_notes
+
 def _fixup_urls( html, url_stem ):
     """Fixup URL's to Chapter H files."""
     matches = list( re.finditer( r"<img [^>]*src=(['\"])(.*?)\1", html ) )
@@ -281,6 +346,132 @@ def _fixup_urls( html, url_stem ):
 
 # ---------------------------------------------------------------------
 
+class ChapterHIndex:
+    """Index of the files in the Chapter H directory.
+
+    Walking the Chapter H directory tree, and stat'ing every file in it, can be slow (e.g. if it's
+    on a network drive or mounted into a container), so we save the index in a cache file, and re-use
+    it the next time we start up. Each directory's entry is re-validated using the directory's mtime
+    (which changes when files are added, removed or renamed), and only directories that have changed
+    are re-scanned.
+
+    NOTE: The index only stores the size and mtime of each file, not its content, since changing a file's
+    content in-place doesn't update its parent directory's mtime.
+    """
+
+    def __init__( self, dname ):
+        self.base_dir = dname
+        self.dirs = {}
+        self._cache_fname = _get_chapter_h_index_cache_fname( dname )
+        self._dirty = True
+        self._nscanned = 0
+        # load the previous index
+        prev_dirs = {}
+        if self._cache_fname:
+            cached_index = _load_chapter_h_index_cache( self._cache_fname )
+            if cached_index:
+                prev_dirs = cached_index[ "dirs" ]
+                self._dirty = False
+        # scan the directory tree
+        # NOTE: We follow symlinks, in the same way os.walk( ..., followlinks=True ) would.
+        self._scan_dir( "", prev_dirs )
+        if len( self.dirs ) != len( prev_dirs ):
+            self._dirty = True # nb: some directories were removed
+        logging.debug( "Loaded the Chapter H index: #dirs=%d ; #scanned=%d", len(self.dirs), self._nscanned )
+
+    def _scan_dir( self, rel_path, prev_dirs ):
+        """Scan a directory in the Chapter H directory tree."""
+
+        # check if the directory has changed
+        path = os.path.join( self.base_dir, *rel_path.split("/") ) if rel_path else self.base_dir
+        try:
+            mtime = os.stat( path ).st_mtime
+        except OSError as ex:
+            logging.warning( "Can't check Chapter H directory: %s\n- %s", path, ex )
+            return
+        dir_info = prev_dirs.get( rel_path )
+        if not dir_info or dir_info["mtime"] != mtime:
+            # yup - re-scan it
+            dir_info = self._make_dir_info( path, mtime )
+            if not dir_info:
+                return
+            self._nscanned += 1
+            self._dirty = True
+        self.dirs[ rel_path ] = dir_info
+
+        # scan any child directories
+        for subdir in dir_info["subdirs"]:
+            self._scan_dir( rel_path+"/"+subdir if rel_path else subdir, prev_dirs )
+
+    @staticmethod
+    def _make_dir_info( path, mtime ):
+        """Generate the index entry for a directory."""
+        subdirs, files = [], {}
+        try:
+            with os.scandir( path ) as dir_iter:
+                for entry in dir_iter:
+                    if entry.is_dir():
+                        subdirs.append( entry.name )
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        if stat.st_size == 0:
+                            continue # nb: ignore placeholder files
+                        files[ entry.name ] = [ stat.st_size, stat.st_mtime ]
+        except OSError as ex:
+            logging.warning( "Can't scan Chapter H directory: %s\n- %s", path, ex )
+            return None
+        return {
+            "mtime": mtime,
+            "subdirs": sorted( subdirs ),
+            "files": dict( sorted( files.items() ) ),
+        }
+
+    def save( self ):
+        """Save the index to the cache."""
+        if not self._cache_fname or not self._dirty:
+            return
+        cached_index = {
+            "version": _CHAPTER_H_INDEX_CACHE_VERSION,
+            "base_dir": self.base_dir,
+            "dirs": self.dirs,
+        }
+        # NOTE: We write to a temp file, then rename it into place, so that a concurrent (or crashed)
+        # instance of the program will never see a partially-written file.
+        try:
+            os.makedirs( os.path.dirname( self._cache_fname ), exist_ok=True )
+            temp_fname = "{}.{}.tmp".format( self._cache_fname, os.getpid() )
+            with open( temp_fname, "w", encoding="utf-8" ) as fp:
+                json.dump( cached_index, fp )
+            os.replace( temp_fname, self._cache_fname )
+        except Exception as ex: #pylint: disable=broad-except
+            logging.warning( "Can't save the Chapter H index cache: %s\n- %s", self._cache_fname, ex )
+            return
+        self._dirty = False
+        logging.debug( "Saved the Chapter H index cache: %s", self._cache_fname )
+
+def _get_chapter_h_index_cache_fname( dname ):
+    """Get the name of the file we cache the Chapter H index in."""
+    if not _chapter_h_index_cache_dname:
+        return None
+    key = hashlib.sha1( dname.encode( "utf-8" ) ).hexdigest()
+    return os.path.join( _chapter_h_index_cache_dname, key+".json" )
+
+def _load_chapter_h_index_cache( cache_fname ):
+    """Load a cached Chapter H index."""
+    if not os.path.isfile( cache_fname ):
+        return None
+    try:
+        with open( cache_fname, "r", encoding="utf-8" ) as fp:
+            cached_index = json.load( fp )
+    except Exception as ex: #pylint: disable=broad-except
+        logging.warning( "Can't load the Chapter H index cache: %s\n- %s", cache_fname, ex )
+        return None
+    if cached_index.get( "version" ) != _CHAPTER_H_INDEX_CACHE_VERSION:
+        return None
+    return cached_index
+
+# ---------------------------------------------------------------------
+
 @app.route( "/<vo_type>/<nat>/note/<key>" )
 def get_vo_note( vo_type, nat, key ):
     """Return a Chapter H vehicle/ordnance note."""
@@ -294,14 +485,20 @@ def get_vo_note( vo_type, nat, key ):
         abort( 404 )
 
     # serve the file
-    if "content" not in vo_note:
+    if not vo_note.get( "html" ):
         resp = globvars.vo_notes_file_server.serve_file( vo_note["filename"], ignore_empty=True )
         if not resp:
             abort( 404 )
         default_scaling = app.config.get( "CHAPTER_H_IMAGE_SCALING", 100 )
         return resize_image_response( resp, default_scaling=default_scaling )
     else:
-        buf = _make_vo_note_html( vo_note["content"] )
+        content = get_vo_note_content( vo_note )
+        if content is None:
+            abort( 404 )
+        if request.args.get( "f" ) == "raw":
+            # return the raw content (nb: the front-end loads HTML vehicle/ordnance notes this way)
+            return Response( content, mimetype="text/html" )
+        buf = _make_vo_note_html( content )
         if request.args.get( "f" ) == "html":
             # return the content as HTML
             return Response( buf, mimetype="text/html" )
@@ -318,7 +515,7 @@ def get_vo_note( vo_type, nat, key ):
             if cached_fname and os.path.isfile( cached_fname ):
                 # we have a cached copy - compare the timestamps of the source HTML and the cached image
                 # NOTE: We should also check the HTML for any associated images, and check their timestamps, as well.
-                if os.path.getmtime( cached_fname ) >= os.path.getmtime( vo_note["filename"] ):
+                if os.path.getmtime( cached_fname ) >= os.path.getmtime( _get_vo_note_fname( vo_note ) ):
                     # FUDGE! We get errors on Windows when using waitress to serve the webapp, when the tests end
                     # and ControlTestsServicer tries to clean up its TemporaryDirectory ("not a directory" errors
                     # for something that is a file :-/). TemporaryDirectory added a ignore_cleanup_errors argument
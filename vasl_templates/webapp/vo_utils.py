@@ -23,6 +23,13 @@ _NOTE_ID_PREFIXES = {
     "AllM": "allied-minor",
 }
 
+# NOTE: Entries in a vehicle/ordnance's "disabled_comments" that match this disable all comments
+# associated with a note ID (e.g. "A", "Br B"), otherwise they disable that specific comment.
+_DISABLED_NOTE_ID_REGEX = re.compile( "^(({}) )?[A-Za-z]{{,2}}$".format( "|".join( _NOTE_ID_PREFIXES.keys() ) ) )
+_SUP_REGEX = re.compile( r"\<sup\>.*?\</sup\>" )
+_STRIKEOUT_REGEX = re.compile( r"\<s\>.*?\</s\>" )
+_NOTE_ID_REGEX = re.compile( "^[A-Za-z0-9 ]+$" )
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 _COMMENT_HANDLERS = {
@@ -222,19 +229,17 @@ def _do_add_vo_comments( vo_entry, nat, vo_type, msg_store ): #pylint: disable=t
     # figure out which comments have been disabled
     disable_comments_for_note_ids = set() # disable all omments associated with these note ID's
     disabled_comments = set() # disable these specific comments
-    prefixes = "|".join( _NOTE_ID_PREFIXES.keys() )
-    regex = re.compile( "^(({}) )?[A-Za-z]{{,2}}$".format( prefixes ) )
     vals = vo_entry.get( "disabled_comments", [] )
     for val in vals if isinstance(vals,list) else [vals]:
-        if regex.search( val ):
+        if _DISABLED_NOTE_ID_REGEX.search( val ):
             disable_comments_for_note_ids.add( val )
         else:
             disabled_comments.add( val )
 
     # get the vehicle/ordnance's manually-defined comments
+    # NOTE: We don't update the existing list in-place, since it may be shared with other entries.
     comments = vo_entry.get( "comments", [] )
-    if isinstance( comments, str ):
-        comments = [ comments ]
+    comments = [ comments ] if isinstance( comments, str ) else list( comments )
 
     # add any generated comments
     comments.extend(
@@ -297,11 +302,11 @@ def _make_comments( vo_entry, nat, vo_type, disabled_note_ids ): #pylint: disabl
         pos = note_id.find( "\u2020" )
         if pos >= 0:
             note_id = note_id[:pos]
-        note_id = re.sub( r"\<sup\>.*?\</sup\>", "", note_id )
-        note_id = re.sub( r"\<s\>.*?\</s\>", "", note_id )
+        note_id = _SUP_REGEX.sub( "", note_id )
+        note_id = _STRIKEOUT_REGEX.sub( "", note_id )
         if not note_id:
             continue
-        assert re.search( "^[A-Za-z0-9 ]+$", note_id )
+        assert _NOTE_ID_REGEX.search( note_id )
 
         # translate nationality-specific note ID's
         orig_note_id = note_id
@@ -463,8 +468,11 @@ def apply_extn_info( listings, extn_fname, extn_info, vo_index, vo_type ):
                 logger.debug( "  - %s => %s", prev_gpids, vo_entry["gpid"] )
             else:
                 # add a new vehicle/ordnance
+                # NOTE: We add a copy of the entry, since it will be updated later (e.g. when comments
+                # are added), and we don't want to change the extension info itself.
                 if nat not in listings:
                     listings[ nat ] = []
+                entry = copy.deepcopy( entry )
                 entry[ "extn_id" ] = extn_info[ "extensionId" ]
                 listings[ nat ].append( entry )
 
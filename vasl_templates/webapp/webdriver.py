@@ -2,26 +2,33 @@
 
 import os
 import threading
+import time
 import io
+import json
+import hashlib
 import tempfile
 import atexit
 import logging
 
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from PIL import Image
 
 from vasl_templates.webapp import app, globvars
-from vasl_templates.webapp.utils import TempFile, SimpleError, trim_image, is_windows
+from vasl_templates.webapp.utils import TempFile, DiskLruCache, SimpleError, trim_image, is_windows, parse_int
 
 _logger = logging.getLogger( "webdriver" )
 
+_snippet_image_cache = None
+_SNIPPET_IMAGE_CACHE_VERSION = 1
+
 # ---------------------------------------------------------------------
 
 class WebDriver:
     """Wrapper for a Selenium webdriver."""
 
     # NOTE: The thread-safety lock controls access to the _shared_instances variable,
-    # not the WebDriver it points to (it has its own lock).
+    # not the WebDriver pools it points to (they have their own lock).
     _shared_instances_lock = threading.RLock()
     _shared_instances = {}
 
@@ -155,22 +162,35 @@ class WebDriver:
         # the user still has a chance to recover from it. Note that this doesn't mean that they can't
         # have really large labels, it just affects the positioning of auto-created labels.
 
-        window_size, window_size2 = (500,500), (1500,1500)
-        if snippet_id and snippet_id.startswith(
-            ("ob_vehicles_ma_notes_","ob_vehicle_note_","ob_ordnance_ma_notes_","ob_ordnance_note_")
-        ):
-            # nb: these tend to be large, don't bother with a smaller window
-            window_size, window_size2 = window_size2, None
+        window_size, window_size2 = _get_snippet_window_sizes( snippet_id )
         return self.get_screenshot( snippet, window_size, window_size2 )
 
+    def is_healthy( self ):
+        """Check if the webdriver is still responding."""
+        try:
+            _ = self.driver.current_url
+            return True
+        except Exception as ex: #pylint: disable=broad-except
+            _logger.warning( "WebDriver (%x) is not responding: %s", id(self), ex )
+            return False
+
     @staticmethod
     def get_instance( key="default" ):
-        """Return the shared WebDriver instance.
+        """Return a WebDriver from the shared pool.
+
+        A Selenium webdriver has a hefty startup time, so we keep a pool of them running, and re-use them.
+        The caller should use the returned object as a context manager, which will check a WebDriver out
+        of the pool, and return it when it's done with it e.g.
+            with WebDriver.get_instance() as webdriver:
+                img = webdriver.get_snippet_screenshot( ... )
+
+        Separate pools are kept for each key, so that code that is using a WebDriver can trigger requests
+        that need a WebDriver themselves (e.g. Chapter H notes), without deadlocking.
 
-        A Selenium webdriver has a hefty startup time, so we create one on first use, and then re-use it.
         There are 2 main issues with this approach:
-        - thread-safety: Flask handles requests in multiple threads, so we need to serialize access.
-        - clean-up: it's difficult to know when to clean up the shared WebDriver object. The WebDriver object
+        - thread-safety: Flask handles requests in multiple threads, so each WebDriver is only ever used
+            by one thread at a time (the pool will start up to WEBDRIVER_POOL_SIZE of them).
+        - clean-up: it's difficult to know when to clean up the shared WebDriver's. Each WebDriver object
             wraps a chrome/geckodriver process, so we can't just let it leak, since these abandoned processes
             will just build up. We install atexit and SIGINT handlers, but webdriver processes will still leak
             if we abend.
@@ -178,36 +198,33 @@ class WebDriver:
         There is a script to stress-test this in the tools directory.
         """
 
-        # NOTE: We provide a debug switch to disable the shared instance, in case it causes problems
+        # NOTE: We provide a debug switch to disable the shared instances, in case they cause problems
         # (although things will, of course, run insanely slowly :-/).
         if app.config.get( "DISABLE_SHARED_WEBDRIVER" ):
             return WebDriver()
 
         with WebDriver._shared_instances_lock:
 
-            # check if we've already created the shared WebDriver
-            if key in WebDriver._shared_instances:
-                # yup - just return it (nb: the caller is responsible for locking it)
-                _logger.info( "Returning shared WebDriver (%s): %x", key, id(WebDriver._shared_instances[key]) )
+            # check if we've already created the pool
+            pool = WebDriver._shared_instances.get( key )
+            if not pool:
+                # nope - create it now, and make sure it gets cleaned up
+                pool = WebDriverPool( key,
+                    parse_int( app.config.get( "WEBDRIVER_POOL_SIZE" ), 2 ),
+                    parse_int( app.config.get( "WEBDRIVER_MAX_USES" ), 200 )
+                )
+                WebDriver._shared_instances[ key ] = pool
+                atexit.register( pool.shutdown )
+                globvars.cleanup_handlers.append( pool.shutdown )
 
-                return WebDriver._shared_instances[ key ]
+        return _WebDriverCheckout( pool )
 
-            # nope - create a new WebDriver instance
-            # NOTE: We start it here to keep it alive even after the caller has finished with it,
-            # and take steps to make sure it gets stopped and cleaned up when the program exits.
-            wdriver = WebDriver()
-            _logger.info( "Created shared WebDriver (%s): %x", key, id(wdriver) )
-            wdriver._do_start() #pylint: disable=protected-access
-            WebDriver._shared_instances[ key ] = wdriver
-
-            # make sure the shared WebDriver gets cleaned up
-            def cleanup(): #pylint: disable=missing-docstring
-                _logger.info( "Cleaning up shared WebDriver (%s): %x", key, id(wdriver) )
-                wdriver._do_stop() #pylint: disable=protected-access
-            atexit.register( cleanup )
-            globvars.cleanup_handlers.append( cleanup )
-
-            return wdriver
+    @staticmethod
+    def get_pool_stats():
+        """Get statistics about the shared WebDriver pools."""
+        with WebDriver._shared_instances_lock:
+            pools = list( WebDriver._shared_instances.values() )
+        return { pool.key: pool.get_stats() for pool in pools }
 
     def __enter__( self ):
         self.start()
@@ -215,3 +232,233 @@ class WebDriver:
 
     def __exit__( self, *args ):
         self.stop()
+
+# ---------------------------------------------------------------------
+
+def get_snippet_image( snippet_id, snippet ):
+    """Get an image for an HTML snippet.
+
+    Returns the PNG image data, and the image's size. Since generating a screenshot is slow, we cache the results,
+    keyed by the snippet's HTML (and anything else that can affect what it looks like).
+    """
+
+    # check if the image is in the cache
+    cache_key = _make_snippet_image_cache_key( snippet_id, snippet ) if _snippet_image_cache else None
+    if cache_key:
+        img_data = _snippet_image_cache.get( cache_key )
+        if img_data:
+            # NOTE: Opening the image only reads the header, which is all we need to get its size.
+            with Image.open( io.BytesIO( img_data ) ) as img:
+                return img_data, img.size
+
+    # nope - generate the image
+    with WebDriver.get_instance() as wdriver:
+        img = wdriver.get_snippet_screenshot( snippet_id, snippet )
+    buf = io.BytesIO()
+    img.save( buf, format="PNG" )
+    img_data = buf.getvalue()
+
+    # save the image in the cache
+    if cache_key:
+        _snippet_image_cache.put( cache_key, img_data )
+
+    return img_data, img.size
+
+def init_snippet_image_cache():
+    """Initialize the snippet image cache."""
+    global _snippet_image_cache
+    _snippet_image_cache = None
+    dname = app.config.get( "SNIPPET_IMAGE_CACHE_DIR" )
+    if dname in ( "disable", "disabled" ):
+        return
+    if not dname:
+        dname = os.path.join( tempfile.gettempdir(), "vasl-templates", "snippet-image-cache" )
+    max_size = parse_int( app.config.get( "SNIPPET_IMAGE_CACHE_SIZE" ), 50 ) * 1024*1024
+    if max_size <= 0:
+        return
+    try:
+        _snippet_image_cache = DiskLruCache( "snippet-images", dname, max_size, extn=".png" )
+    except OSError as ex:
+        _logger.warning( "Can't initialize the snippet image cache: %s\n- %s", dname, ex )
+
+def _make_snippet_image_cache_key( snippet_id, snippet ):
+    """Generate the cache key for a snippet image."""
+    # NOTE: As well as the snippet's HTML, we include the template pack CSS, and the browser that
+    # will generate the screenshot (the webdriver/browser paths, and when they were last updated).
+    def get_file_info( fname ): #pylint: disable=missing-docstring
+        if not fname or not os.path.isfile( fname ):
+            return fname
+        return [ fname, os.path.getmtime( fname ) ]
+    css = globvars.template_pack.get( "css" ) if globvars.template_pack else None
+    key_info = [
+        _SNIPPET_IMAGE_CACHE_VERSION,
+        snippet,
+        _get_snippet_window_sizes( snippet_id ),
+        css,
+        get_file_info( app.config.get( "WEBDRIVER_PATH" ) ),
+        get_file_info( app.config.get( "CHROME_PATH" ) ),
+        app.config.get( "WEBDRIVER_SCREENSHOT_RETRY_RATIO" ),
+    ]
+    return hashlib.sha256( json.dumps( key_info, sort_keys=True ).encode( "utf-8" ) ).hexdigest()
+
+def _get_snippet_window_sizes( snippet_id ):
+    """Get the window sizes to use when taking a screenshot of a snippet."""
+    window_size, window_size2 = (500,500), (1500,1500)
+    if snippet_id and snippet_id.startswith(
+        ("ob_vehicles_ma_notes_","ob_vehicle_note_","ob_ordnance_ma_notes_","ob_ordnance_note_")
+    ):
+        # nb: these tend to be large, don't bother with a smaller window
+        window_size, window_size2 = window_size2, None
+    return window_size, window_size2
+
+# ---------------------------------------------------------------------
+
+class WebDriverPool: #pylint: disable=too-many-instance-attributes
+    """Manage a pool of running WebDriver's."""
+
+    def __init__( self, key, max_size, max_uses ):
+        self.key = key
+        self.max_size = max( max_size, 1 )
+        self.max_uses = max_uses # nb: 0 = no limit
+        self._idle = [] # nb: WebDriver's that are running, but not checked out
+        self._use_counts = {}
+        self._nrunning = 0 # nb: includes any that are starting up
+        self._is_shutdown = False
+        self._cond = threading.Condition()
+        # initialize the metrics
+        self._ncheckouts = self._nwaits = 0
+        self._total_wait_time = self._max_wait_time = 0.0
+        self._nstarted = self._nrecycled = self._nunhealthy = 0
+
+    def checkout( self ):
+        """Check a WebDriver out of the pool."""
+
+        # wait for a WebDriver to become available
+        start_time = time.time()
+        waited = False
+        with self._cond:
+            while True:
+                if self._is_shutdown:
+                    raise SimpleError( "The WebDriver pool has been shut down." )
+                if self._idle:
+                    wdriver = self._idle.pop()
+                    break
+                if self._nrunning < self.max_size:
+                    # NOTE: We start a new WebDriver outside the lock, since it can take a while.
+                    self._nrunning += 1
+                    wdriver = None
+                    break
+                waited = True
+                self._cond.wait()
+        wait_time = time.time() - start_time
+        self._update_wait_metrics( waited, wait_time )
+        if waited:
+            _logger.debug( "Waited for WebDriver pool (%s): %.3fs", self.key, wait_time )
+
+        # check that the WebDriver is OK
+        # NOTE: If it isn't, we keep its slot in the pool reserved for the replacement we're about to start.
+        if wdriver and not wdriver.is_healthy():
+            with self._cond:
+                self._nunhealthy += 1
+            self._stop_webdriver( wdriver, release_slot=False )
+            wdriver = None
+
+        # start a new WebDriver, if necessary
+        if not wdriver:
+            wdriver = WebDriver()
+            try:
+                wdriver._do_start() #pylint: disable=protected-access
+            except:
+                with self._cond:
+                    self._nrunning -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._use_counts[ wdriver ] = 0
+                self._nstarted += 1
+            _logger.info( "Started pooled WebDriver (%s): %x", self.key, id(wdriver) )
+
+        with self._cond:
+            self._use_counts[ wdriver ] += 1
+        return wdriver
+
+    def checkin( self, wdriver, discard=False ):
+        """Return a WebDriver to the pool."""
+        with self._cond:
+            if not discard and not self._is_shutdown:
+                if self.max_uses <= 0 or self._use_counts[ wdriver ] < self.max_uses:
+                    self._idle.append( wdriver )
+                    self._cond.notify()
+                    return
+            self._nrecycled += 1
+        # NOTE: The WebDriver has been used too many times (or has crashed), so we stop it.
+        # A new one will be started the next time one is needed.
+        _logger.info( "Recycling pooled WebDriver (%s): %x", self.key, id(wdriver) )
+        self._stop_webdriver( wdriver )
+
+    def _stop_webdriver( self, wdriver, release_slot=True ):
+        """Stop a WebDriver, and remove it from the pool."""
+        with self._cond:
+            self._use_counts.pop( wdriver, None )
+            if release_slot:
+                self._nrunning -= 1
+                self._cond.notify()
+        try:
+            wdriver._do_stop() #pylint: disable=protected-access
+        except Exception as ex: #pylint: disable=broad-except
+            _logger.warning( "Can't stop WebDriver (%x): %s", id(wdriver), ex )
+
+    def shutdown( self ):
+        """Stop all the WebDriver's in the pool."""
+        with self._cond:
+            self._is_shutdown = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        _logger.info( "Cleaning up WebDriver pool (%s): #idle=%d", self.key, len(idle) )
+        for wdriver in idle:
+            self._stop_webdriver( wdriver )
+
+    def _update_wait_metrics( self, waited, wait_time ):
+        """Update the queue-wait metrics."""
+        with self._cond:
+            self._ncheckouts += 1
+            if waited:
+                self._nwaits += 1
+                self._total_wait_time += wait_time
+                self._max_wait_time = max( self._max_wait_time, wait_time )
+
+    def get_stats( self ):
+        """Get statistics about the pool."""
+        with self._cond:
+            return {
+                "maxSize": self.max_size,
+                "maxUses": self.max_uses,
+                "running": self._nrunning,
+                "idle": len( self._idle ),
+                "checkouts": self._ncheckouts,
+                "waits": self._nwaits,
+                "totalWaitTime": round( self._total_wait_time, 3 ),
+                "avgWaitTime": round( self._total_wait_time / self._nwaits, 3 ) if self._nwaits else None,
+                "maxWaitTime": round( self._max_wait_time, 3 ),
+                "started": self._nstarted,
+                "recycled": self._nrecycled,
+                "unhealthy": self._nunhealthy,
+            }
+
+class _WebDriverCheckout:
+    """Check a WebDriver out of a pool, for use in a with statement."""
+
+    def __init__( self, pool ):
+        self.pool = pool
+        self.wdriver = None
+
+    def __enter__( self ):
+        self.wdriver = self.pool.checkout()
+        return self.wdriver
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        # NOTE: If the webdriver failed, we don't put it back into the pool, since it may be in a bad state
+        # (or the browser may have crashed).
+        discard = exc_type is not None and issubclass( exc_type, WebDriverException )
+        self.pool.checkin( self.wdriver, discard=discard )
+        self.wdriver = None
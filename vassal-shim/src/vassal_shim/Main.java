@@ -1,7 +1,10 @@
 package vassal_shim ;
 
 import java.io.BufferedWriter ;
+import java.io.BufferedReader ;
 import java.io.FileWriter ;
+import java.io.InputStreamReader ;
+import java.io.IOException ;
 import java.util.ArrayList ;
 import java.lang.reflect.Method ;
 import java.lang.reflect.InvocationTargetException ;
@@ -14,6 +17,9 @@ import vassal_shim.VassalShim ;
 
 public class Main
 {
+    // NOTE: This must match what the web server is looking for.
+    private static final String DAEMON_RESPONSE_MARKER = "@@vassal-shim-daemon@@" ;
+
     public static void main( String[] args )
     {
         // FUDGE! In VASSAL 3.4.4, they changed the way the version number is tracked (it's now in the resources),
@@ -82,6 +88,12 @@ public class Main
                 shim.prepareUpload( args[2], args[3], args[4] ) ;
                 System.exit( 0 ) ;
             }
+            else if ( cmd.equals( "daemon" ) ) {
+                checkArgs( args, 2, false, "the VASL .vmod file" ) ;
+                VassalShim shim = new VassalShim( args[1], null ) ;
+                runDaemon( shim ) ;
+                System.exit( 0 ) ;
+            }
             else if ( cmd.equals( "version" ) ) {
                 checkArgs( args, 2, false, "the output file" ) ;
                 System.out.println( Info.getVersion() ) ;
@@ -102,6 +114,94 @@ public class Main
         }
     }
 
+    private static void runDaemon( VassalShim shim ) throws IOException
+    {
+        // NOTE: Loading VASSAL and the VASL module takes a long time, so the web server can start us up
+        // as a daemon, and send us commands (one per line, arguments separated by tabs) on stdin.
+        // After each command, we write a line to stdout containing the marker and the result code.
+
+        // let the web server know we're ready
+        System.out.println( DAEMON_RESPONSE_MARKER + " ready" ) ;
+        System.out.flush() ;
+
+        // process commands
+        BufferedReader reader = new BufferedReader( new InputStreamReader( System.in, "UTF-8" ) ) ;
+        for ( ; ; ) {
+            String line = reader.readLine() ;
+            if ( line == null || line.equals( "quit" ) )
+                break ;
+            if ( line.trim().length() == 0 )
+                continue ;
+            // execute the next command
+            int rc ;
+            try {
+                rc = runDaemonCommand( shim, line.split( "\t", -1 ) ) ;
+            } catch( Exception ex ) {
+                System.out.println( "ERROR: " + ex ) ;
+                ex.printStackTrace( System.out ) ;
+                rc = -1 ;
+            }
+            // clean up
+            // NOTE: If we can't reset the game state, it's not safe to keep going, so we tell the web server
+            // to restart us.
+            boolean restart = false ;
+            try {
+                shim.resetGameState() ;
+            } catch( Exception ex ) {
+                System.out.println( "Can't reset the game state: " + ex ) ;
+                restart = true ;
+            }
+            System.out.println( DAEMON_RESPONSE_MARKER + " rc=" + rc + (restart ? " restart" : "") ) ;
+            System.out.flush() ;
+            if ( restart )
+                System.exit( 3 ) ;
+        }
+    }
+
+    private static int runDaemonCommand( VassalShim shim, String[] args ) throws Exception
+    {
+        // execute the specified command
+        // NOTE: These are the same as the normal commands, but without the VASL .vmod file (since we already have it loaded).
+        String cmd = args[0].toLowerCase() ;
+        if ( cmd.equals( "dump" ) ) {
+            checkDaemonArgs( args, 2, false ) ;
+            shim.dumpScenario( args[1] ) ;
+        }
+        else if ( cmd.equals( "analyze" ) ) {
+            checkDaemonArgs( args, 3, false ) ;
+            shim.analyzeScenario( args[1], args[2] ) ;
+        }
+        else if ( cmd.equals( "analyzelogs" ) ) {
+            checkDaemonArgs( args, 3, true ) ;
+            ArrayList<String> logFilenames = new ArrayList<String>() ;
+            for ( int i=1 ; i < args.length-1 ; ++i )
+                logFilenames.add( args[i] ) ;
+            shim.analyzeLogs( logFilenames, args[args.length-1] ) ;
+        }
+        else if ( cmd.equals( "update" ) ) {
+            checkDaemonArgs( args, 6, false ) ;
+            shim.setBoardsDir( args[1] ) ;
+            shim.updateScenario( args[2], args[3], args[4], args[5] ) ;
+        }
+        else if ( cmd.equals( "prepareupload" ) ) {
+            checkDaemonArgs( args, 4, false ) ;
+            shim.prepareUpload( args[1], args[2], args[3] ) ;
+        }
+        else {
+            System.out.println( "Unknown daemon command: " + cmd ) ;
+            return 1 ;
+        }
+        return 0 ;
+    }
+
+    private static void checkDaemonArgs( String[] args, int expected, boolean orMore )
+    {
+        // check the number of arguments
+        boolean ok = orMore ? args.length >= expected : args.length == expected ;
+        if ( ! ok )
+            throw new IllegalArgumentException( "Incorrect number of arguments for daemon command: " + args[0] ) ;
+    }
+
     private static void checkArgs( String[] args, int expected, boolean orMore, String hint )
     {
         // check the number of arguments
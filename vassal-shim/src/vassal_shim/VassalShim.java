@@ -123,6 +123,22 @@ public class VassalShim
         logger.debug( "- Loaded OK." ) ;
     }
 
+    public void setBoardsDir( String boardsDir )
+    {
+        // set the boards directory
+        // NOTE: When we are running as a daemon, the same VassalShim object is used for every command.
+        this.boardsDir = boardsDir ;
+    }
+
+    public void resetGameState()
+    {
+        // close the current game, so that the next command (if we are running as a daemon) starts from a clean slate
+        GameModule.getGameModule().getGameState().setup( false ) ;
+        // NOTE: The boards directory has to be passed in with each command that needs it. The boards directory
+        // configured in VASSAL's preferences persists, but the web server restarts us if it changes.
+        boardsDir = null ;
+    }
+
     public void dumpScenario( String scenarioFilename ) throws IOException
     {
         // load the scenario and dump its commands